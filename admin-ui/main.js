@@ -25,10 +25,91 @@ tabButtons.forEach(btn => {
 
 
 // =========================
-// 📄 Logs Page
+// 📡 Shared Logs + Live Stream
 // =========================
 
+// Logs and Dashboard share one snapshot of the log (newest first); new entries arrive over
+// /api/logs/stream and are applied as deltas instead of re-fetching the whole file.
 let logsData = [];
+let logCursor = '';
+let logsRequest = null;
+let logStream = null;
+let pendingLogs = [];
+let pendingFlush = null;
+
+const byNewest = (a, b) => new Date(b.timestamp) - new Date(a.timestamp);
+
+function fetchLogs() {
+  if (!logsRequest) {
+    logsRequest = (async () => {
+      const res = await fetch('webhook_logs.json');
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      const logs = await res.json();
+      if (!Array.isArray(logs)) throw new Error('Invalid logs data');
+
+      logsData = logs.sort(byNewest);
+      logCursor = res.headers.get('X-Log-Cursor') || '';
+      startLogStream();
+      return logsData;
+    })();
+    logsRequest.catch(() => { logsRequest = null; });
+  }
+  return logsRequest;
+}
+
+function startLogStream() {
+  if (logStream) logStream.close();
+  logStream = new EventSource(`/api/logs/stream?cursor=${encodeURIComponent(logCursor)}`);
+
+  logStream.addEventListener('log', e => {
+    logCursor = e.lastEventId;
+    pendingLogs.push(JSON.parse(e.data));
+    // Coalesce bursts into one re-render
+    if (!pendingFlush) pendingFlush = setTimeout(flushPendingLogs, 250);
+  });
+
+  logStream.addEventListener('reset', () => {
+    // Too far behind to catch up from deltas — take a fresh snapshot
+    logStream.close();
+    logStream = null;
+    logsRequest = null;
+    fetchLogs().then(refreshLogViews).catch(err => console.error('Error reloading logs:', err));
+  });
+
+  logStream.onerror = () => {
+    // EventSource reconnects by itself unless the server refused outright (e.g. 503 when busy)
+    if (logStream.readyState === EventSource.CLOSED) setTimeout(startLogStream, 30000);
+  };
+}
+
+function flushPendingLogs() {
+  const fresh = pendingLogs.sort(byNewest);
+  pendingLogs = [];
+  pendingFlush = null;
+
+  logsData = fresh.concat(logsData);
+  // Don't yank the page out from under someone reading an older page or an expanded payload
+  if (logsRendered && currentPage === 1 && !document.querySelector('#log-entries details[open]')) renderLogs();
+  if (dashboardStats) {
+    tallyLogs(dashboardStats, fresh);
+    renderDashboard();
+  }
+}
+
+function refreshLogViews() {
+  if (logsRendered) renderLogs();
+  if (dashboardStats) {
+    dashboardStats = tallyLogs(emptyDashboardStats(), logsData);
+    renderDashboard();
+  }
+}
+
+
+// =========================
+// 📄 Logs Page
+// =========================
+
+let logsRendered = false;
 let currentPage = 1;
 const logsPerPage = 10;
 
@@ -37,15 +118,7 @@ async function loadLogs() {
   container.innerHTML = '<p class="text-gray-500">Loading logs...</p>';
 
   try {
-    const res = await fetch('webhook_logs.json');
-    logsData = await res.json();
-
-    if (!Array.isArray(logsData) || logsData.length === 0) {
-      container.innerHTML = '<p class="text-gray-500">No logs found.</p>';
-      return;
-    }
-
-    logsData.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
+    await fetchLogs();
 
     container.innerHTML = `
       <div class="flex flex-col sm:flex-row sm:items-center sm:justify-between gap-2 mb-4">
@@ -74,6 +147,7 @@ async function loadLogs() {
       renderLogs();
     });
 
+    logsRendered = true;
     renderLogs();
 
   } catch (err) {
@@ -95,6 +169,11 @@ function renderLogs() {
     return matchesSearch && matchesStatus;
   });
 
+  if (logsData.length === 0) {
+    entriesContainer.innerHTML = '<p class="text-gray-500">No logs found.</p>';
+    return;
+  }
+
   const totalPages = Math.ceil(filtered.length / logsPerPage);
   const start = (currentPage - 1) * logsPerPage;
   const pageItems = filtered.slice(start, start + logsPerPage);
@@ -117,14 +196,18 @@ function renderLogs() {
         <pre class="mt-1 overflow-x-auto text-xs">${JSON.stringify({ ...log.changes, mailchimp_error: undefined }, null, 2)}</pre>
       </details>` : '';
 
-    const payload = log.payload ? `
-      <details class="bg-gray-50 p-2 border rounded mt-1">
+    // Payloads are stored separately and fetched when the row is expanded; older entries embed them
+    const payloadAttr = log.payload_ref
+      ? `data-ref="${log.payload_ref}"`
+      : `data-payload='${JSON.stringify(log.payload || null).replace(/'/g, "&#39;")}'`;
+    const payload = (log.payload_ref || log.payload) ? `
+      <details class="bg-gray-50 p-2 border rounded mt-1" ${payloadAttr} ontoggle="showPayload(this)">
         <summary class="cursor-pointer font-medium text-sm text-gray-700">Payload</summary>
-        <pre class="mt-1 overflow-x-auto text-xs">${JSON.stringify(log.payload, null, 2)}</pre>
+        <pre class="mt-1 overflow-x-auto text-xs">${log.payload ? JSON.stringify(log.payload, null, 2) : 'Loading...'}</pre>
         <button
           class="mt-2 bg-blue-500 text-white text-xs px-3 py-1 rounded hover:bg-blue-600"
           onclick="replayPayload(this)"
-          data-payload='${JSON.stringify(log.payload).replace(/'/g, "&#39;")}'
+          ${payloadAttr}
         >↻ Replay</button>
         <small class="replay-status ml-2 text-gray-500 text-xs"></small>
       </details>` : '';
@@ -182,18 +265,50 @@ function gotoLogPage(page) {
   renderLogs();
 }
 
+// =========================
+// 📦 Lazy Payloads
+// =========================
+
+const payloadCache = new Map();
+
+async function fetchPayload(ref) {
+  if (!payloadCache.has(ref)) {
+    const res = await fetch(`/api/payloads/${ref}`);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    payloadCache.set(ref, await res.json());
+  }
+  return payloadCache.get(ref);
+}
+
+async function showPayload(details) {
+  const ref = details.getAttribute('data-ref');
+  if (!details.open || !ref || details.dataset.loaded) return;
+
+  const pre = details.querySelector('pre');
+  try {
+    pre.textContent = JSON.stringify(await fetchPayload(ref), null, 2);
+    details.dataset.loaded = 'true';
+  } catch (err) {
+    console.error('Failed to load payload:', err);
+    pre.textContent = '❌ Could not load payload';
+  }
+}
+
+
 // =========================
 // 📧 Event Replay Logic
 // =========================
 
 async function replayPayload(button) {
   const statusElem = button.nextElementSibling;
+  const ref = button.getAttribute('data-ref');
   const payloadJson = button.getAttribute('data-payload');
   button.disabled = true;
   statusElem.textContent = '⏳ Replaying...';
 
   try {
-    const payload = JSON.parse(payloadJson);
+    // The server resolves refs itself, so a replay never has to download the payload first
+    const payload = ref ? { payload_ref: ref } : JSON.parse(payloadJson);
 
     const res = await fetch('/replay-log', {
       method: 'POST',
@@ -220,31 +335,42 @@ async function replayPayload(button) {
 // =========================
 
 let cacheData = [];
+let cacheTotal = 0;
 let cachePage = 1;
+let cacheSearchTimer = null;
 const cachePerPage = 100;
 
 async function loadEmailCache() {
+  document.getElementById('cache-search').addEventListener('input', () => {
+    clearTimeout(cacheSearchTimer);
+    cacheSearchTimer = setTimeout(() => {
+      cachePage = 1;
+      fetchCachePage();
+    }, 250);
+  });
+
+  await fetchCachePage();
+}
+
+async function fetchCachePage() {
   const container = document.getElementById('cache-entries');
+  const query = document.getElementById('cache-search').value.trim();
   container.innerHTML = `<p class="text-sm text-gray-500">Loading...</p>`;
 
   try {
-    const res = await fetch('email_cache.json');
+    const params = new URLSearchParams({ q: query, page: cachePage, per_page: cachePerPage });
+    const res = await fetch(`/api/email-cache?${params}`);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
     const data = await res.json();
 
-    if (!data || Object.keys(data).length === 0) {
+    cacheData = data.items.map(item => [item.member_id, item.email]);
+    cacheTotal = data.total;
+
+    if (cacheTotal === 0 && !query) {
       container.innerHTML = '<p class="text-gray-500 mt-2">No cache data available.</p>';
       return;
     }
 
-    // Flatten cache into array of [id, email]
-    cacheData = Object.entries(data);
-    cacheData.sort((a, b) => b[0] - a[0]); // Descending by ID
-
-    document.getElementById('cache-search').addEventListener('input', () => {
-      cachePage = 1;
-      renderCache();
-    });
-
     renderCache();
 
   } catch (err) {
@@ -254,18 +380,12 @@ async function loadEmailCache() {
 }
 
 function renderCache() {
-  const query = document.getElementById('cache-search').value.toLowerCase();
   const container = document.getElementById('cache-entries');
 
-  const filtered = cacheData.filter(([id, email]) =>
-    id.includes(query) || email.toLowerCase().includes(query)
-  );
-
-  const totalPages = Math.ceil(filtered.length / cachePerPage);
+  const totalPages = Math.ceil(cacheTotal / cachePerPage);
   const start = (cachePage - 1) * cachePerPage;
-  const pageItems = filtered.slice(start, start + cachePerPage);
 
-  const rows = pageItems.map(([id, email]) => `
+  const rows = cacheData.map(([id, email]) => `
     <tr class="border-b border-gray-200">
       <td class="p-2 font-mono text-xs">${id}</td>
       <td class="p-2">${email}</td>
@@ -291,7 +411,7 @@ function renderCache() {
 
     <div class="mt-4 flex flex-col sm:flex-row justify-between items-center text-sm text-gray-600">
       <div class="mb-2 sm:mb-0">
-        Showing ${start + 1}–${Math.min(start + cachePerPage, filtered.length)} of ${filtered.length} entries
+        Showing ${cacheTotal ? start + 1 : 0}–${Math.min(start + cachePerPage, cacheTotal)} of ${cacheTotal} entries
       </div>
       <div class="flex flex-wrap gap-1 justify-center sm:justify-end">
         ${pagination}
@@ -302,7 +422,7 @@ function renderCache() {
 
 function gotoCachePage(n) {
   cachePage = n;
-  renderCache();
+  fetchCachePage();
 }
 
 
@@ -310,86 +430,134 @@ function gotoCachePage(n) {
 // 📊 Dashboard Page
 // =========================
 
+async function loadDependencyStatus() {
+  const container = document.getElementById('dependency-status');
+  try {
+    const res = await fetch('/health');
+    const { circuits = {} } = await res.json();
+    const styles = {
+      closed: ['border-green-100', 'text-green-600', 'Healthy'],
+      half_open: ['border-yellow-100', 'text-yellow-600', 'Recovering'],
+      open: ['border-red-100', 'text-red-600', 'Down'],
+    };
+    container.innerHTML = Object.entries(circuits).map(([name, c]) => {
+      const [border, text, label] = styles[c.state] || styles.open;
+      const detail = c.state === 'open'
+        ? `retry in ${Math.ceil(c.retry_in_seconds)}s — webhooks are being deferred`
+        : `${c.consecutive_failures} recent failures`;
+      return `
+        <div class="p-4 rounded-lg border ${border} text-center">
+          <div class="text-sm text-gray-500 capitalize">${name}</div>
+          <div class="text-xl font-bold ${text}">${label}</div>
+          <div class="text-xs text-gray-400 mt-1">${detail}</div>
+        </div>
+      `;
+    }).join('');
+  } catch (err) {
+    console.error('❌ Failed to load dependency status:', err);
+    container.innerHTML = '<p class="text-red-600">Could not load dependency status.</p>';
+  }
+}
+
+let dashboardStats = null;
+let eventChart = null;
+let lineChart = null;
+
+const chartColors = [
+  '#3B82F6', '#10B981', '#F59E0B',
+  '#EF4444', '#8B5CF6', '#F43F5E',
+  '#0EA5E9', '#14B8A6', '#6366F1',
+];
+
+function emptyDashboardStats() {
+  return { total: 0, success: 0, counts: {}, dateCounts: {} };
+}
+
+function tallyLogs(stats, logs) {
+  logs.forEach(l => {
+    stats.total += 1;
+    if (l.status === 'success') stats.success += 1;
+    stats.counts[l.event] = (stats.counts[l.event] || 0) + 1;
+    const date = l.timestamp?.slice(0, 10); // 'YYYY-MM-DD'
+    if (date) stats.dateCounts[date] = (stats.dateCounts[date] || 0) + 1;
+  });
+  return stats;
+}
+
 async function loadDashboard() {
   console.log('🚀 loadDashboard() triggered');
+  loadDependencyStatus();
 
   const statsContainer = document.getElementById('dashboard-stats');
-  const chartCanvas = document.getElementById('event-chart');
-  const lineCanvas = document.getElementById('line-chart');
-  const topEventsContainer = document.getElementById('top-events');
   statsContainer.innerHTML = 'Loading stats...';
 
   try {
-    const res = await fetch('webhook_logs.json');
-    let logs = await res.json();
-    logs = logs.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
-
-    if (!Array.isArray(logs)) throw new Error('Invalid logs data');
-
-    const total = logs.length;
-    const success = logs.filter(l => l.status === 'success').length;
-    const failed = total - success;
-
-    // 👉 Stat Cards
-    statsContainer.innerHTML = `
-      <div class="bg-white p-4 rounded-lg shadow border border-blue-100 text-center">
-        <i data-lucide="webhook" class="mx-auto text-blue-400 mb-2 w-6 h-6"></i>
-        <div class="text-sm text-gray-500">Total Webhooks</div>
-        <div class="text-3xl font-bold text-blue-600">${total}</div>
-      </div>
-      <div class="bg-white p-4 rounded-lg shadow border border-green-100 text-center">
-        <i data-lucide="check-circle" class="mx-auto text-green-400 mb-2 w-6 h-6"></i>
-        <div class="text-sm text-gray-500">Successful</div>
-        <div class="text-3xl font-bold text-green-600">${success}</div>
-      </div>
-      <div class="bg-white p-4 rounded-lg shadow border border-red-100 text-center">
-        <i data-lucide="x-circle" class="mx-auto text-red-400 mb-2 w-6 h-6"></i>
-        <div class="text-sm text-gray-500">Failed</div>
-        <div class="text-3xl font-bold text-red-600">${failed}</div>
-      </div>
-    `;
+    const logs = await fetchLogs();
+    dashboardStats = tallyLogs(emptyDashboardStats(), logs);
+    renderDashboard();
+  } catch (err) {
+    console.error('Dashboard load error:', err);
+    statsContainer.innerHTML = '<p class="text-red-500">Failed to load dashboard data.</p>';
+  }
+}
 
-    // 👉 Count event types
-    const counts = {};
-    logs.forEach(l => {
-      counts[l.event] = (counts[l.event] || 0) + 1;
-    });
+function renderDashboard() {
+  const { total, success, counts, dateCounts } = dashboardStats;
+  const failed = total - success;
 
-    console.log('📊 Chart data:', counts);
-
-    // 👉 Top 5 Events summary
-    const top = Object.entries(counts)
-      .sort((a, b) => b[1] - a[1])
-      .slice(0, 5);
-
-    topEventsContainer.innerHTML = `
-      <ul class="text-sm text-gray-700 space-y-1">
-        ${top.map(([event, count]) => `
-          <li class="flex justify-between border-b py-1">
-            <span class="font-medium">${event}</span>
-            <span class="text-gray-500">${count}</span>
-          </li>
-        `).join('')}
-      </ul>
-    `;
+  // 👉 Stat Cards
+  document.getElementById('dashboard-stats').innerHTML = `
+    <div class="bg-white p-4 rounded-lg shadow border border-blue-100 text-center">
+      <i data-lucide="webhook" class="mx-auto text-blue-400 mb-2 w-6 h-6"></i>
+      <div class="text-sm text-gray-500">Total Webhooks</div>
+      <div class="text-3xl font-bold text-blue-600">${total}</div>
+    </div>
+    <div class="bg-white p-4 rounded-lg shadow border border-green-100 text-center">
+      <i data-lucide="check-circle" class="mx-auto text-green-400 mb-2 w-6 h-6"></i>
+      <div class="text-sm text-gray-500">Successful</div>
+      <div class="text-3xl font-bold text-green-600">${success}</div>
+    </div>
+    <div class="bg-white p-4 rounded-lg shadow border border-red-100 text-center">
+      <i data-lucide="x-circle" class="mx-auto text-red-400 mb-2 w-6 h-6"></i>
+      <div class="text-sm text-gray-500">Failed</div>
+      <div class="text-3xl font-bold text-red-600">${failed}</div>
+    </div>
+  `;
 
-    // 👉 Bar Chart: Events by type
-    const chartColors = [
-      '#3B82F6', '#10B981', '#F59E0B',
-      '#EF4444', '#8B5CF6', '#F43F5E',
-      '#0EA5E9', '#14B8A6', '#6366F1',
-    ];
+  // 👉 Top 5 Events summary
+  const top = Object.entries(counts)
+    .sort((a, b) => b[1] - a[1])
+    .slice(0, 5);
+
+  document.getElementById('top-events').innerHTML = `
+    <ul class="text-sm text-gray-700 space-y-1">
+      ${top.map(([event, count]) => `
+        <li class="flex justify-between border-b py-1">
+          <span class="font-medium">${event}</span>
+          <span class="text-gray-500">${count}</span>
+        </li>
+      `).join('')}
+    </ul>
+  `;
 
-    new Chart(chartCanvas, {
+  // 👉 Bar Chart: Events by type (updated in place on later renders)
+  const eventLabels = Object.keys(counts);
+  const eventData = {
+    labels: eventLabels,
+    datasets: [{
+      label: 'Webhook Events',
+      data: Object.values(counts),
+      backgroundColor: eventLabels.map((_, i) => chartColors[i % chartColors.length]),
+    }]
+  };
+
+  if (eventChart) {
+    eventChart.data = eventData;
+    eventChart.update();
+  } else {
+    eventChart = new Chart(document.getElementById('event-chart'), {
       type: 'bar',
-      data: {
-        labels: Object.keys(counts),
-        datasets: [{
-          label: 'Webhook Events',
-          data: Object.values(counts),
-          backgroundColor: Object.keys(counts).map((_, i) => chartColors[i % chartColors.length]),
-        }]
-      },
+      data: eventData,
       options: {
         responsive: true,
         plugins: {
@@ -403,31 +571,31 @@ async function loadDashboard() {
         }
       }
     });
+  }
 
-    // 👉 Line Chart: Webhooks over time
-    const dateCounts = {};
-    logs.forEach(l => {
-      const date = l.timestamp?.slice(0, 10); // 'YYYY-MM-DD'
-      if (date) dateCounts[date] = (dateCounts[date] || 0) + 1;
-    });
-
-    const sortedDates = Object.keys(dateCounts).sort();
-
-    new Chart(lineCanvas, {
+  // 👉 Line Chart: Webhooks over time
+  const sortedDates = Object.keys(dateCounts).sort();
+  const lineData = {
+    labels: sortedDates,
+    datasets: [{
+      label: 'Webhooks Per Day',
+      data: sortedDates.map(date => dateCounts[date]),
+      borderColor: '#3B82F6',
+      backgroundColor: 'rgba(59, 130, 246, 0.1)',
+      fill: true,
+      tension: 0.3,
+      pointRadius: 3,
+      pointBackgroundColor: '#3B82F6',
+    }]
+  };
+
+  if (lineChart) {
+    lineChart.data = lineData;
+    lineChart.update();
+  } else {
+    lineChart = new Chart(document.getElementById('line-chart'), {
       type: 'line',
-      data: {
-        labels: sortedDates,
-        datasets: [{
-          label: 'Webhooks Per Day',
-          data: sortedDates.map(date => dateCounts[date]),
-          borderColor: '#3B82F6',
-          backgroundColor: 'rgba(59, 130, 246, 0.1)',
-          fill: true,
-          tension: 0.3,
-          pointRadius: 3,
-          pointBackgroundColor: '#3B82F6',
-        }]
-      },
+      data: lineData,
       options: {
         responsive: true,
         plugins: {
@@ -445,20 +613,18 @@ async function loadDashboard() {
         }
       }
     });
-
-    // 🪄 Replace Lucide icon tags
-    lucide.createIcons();
-
-  } catch (err) {
-    console.error('Dashboard load error:', err);
-    statsContainer.innerHTML = '<p class="text-red-500">Failed to load dashboard data.</p>';
   }
+
+  // 🪄 Replace Lucide icon tags
+  lucide.createIcons();
 }
 
 // =========================
 // 🧩 Merge Field Mapping
 // =========================
 
+let loadedMergeMap = {};
+
 async function loadMergeMap() {
   const form = document.getElementById('merge-map-form');
   const status = document.getElementById('merge-map-status');
@@ -468,6 +634,7 @@ async function loadMergeMap() {
   try {
     const res = await fetch('/api/merge-map');
     const map = await res.json();
+    loadedMergeMap = map;
 
     const renderSection = (label, obj) => {
       const header = `<h3 class="text-sm font-semibold text-gray-700 mt-6">${label}</h3>`;
@@ -502,7 +669,8 @@ document.getElementById('save-merge-map').addEventListener('click', async () =>
   status.textContent = 'Saving...';
 
   const inputs = document.querySelectorAll('#merge-map-form input');
-  const updatedMap = { MERGE_FIELDS: {}, GBX_PROFILE_FIELDS: {} };
+  // Keep sections the form doesn't edit (e.g. FIELD_TRANSFORMS)
+  const updatedMap = { ...loadedMergeMap, MERGE_FIELDS: {}, GBX_PROFILE_FIELDS: {} };
 
   inputs.forEach(input => {
     const [section, key] = input.name.split(':');
@@ -517,7 +685,14 @@ document.getElementById('save-merge-map').addEventListener('click', async () =>
     });
 
     if (res.ok) {
-      status.textContent = '✅ Saved successfully!';
+      const body = await res.json();
+      status.textContent = body.warnings && body.warnings.length
+        ? `✅ Saved, with warnings: ${body.warnings.join('; ')}`
+        : '✅ Saved successfully!';
+      loadedMergeMap = updatedMap;
+    } else if (res.status === 400) {
+      const body = await res.json();
+      status.textContent = `❌ ${body.error}`;
     } else {
       throw new Error('Failed to save');
     }
@@ -528,6 +703,131 @@ document.getElementById('save-merge-map').addEventListener('click', async () =>
 });
 
 
+// =========================
+// 🔁 Retries Page
+// =========================
+
+// Entries carry webhook payloads and error text, so anything interpolated into the table is escaped
+function escapeHtml(value) {
+  return String(value ?? '').replace(/[&<>"']/g, ch => (
+    { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[ch]
+  ));
+}
+
+function retryEventLabel(entry) {
+  const payload = entry.payload || {};
+  const email = payload.member?.email || payload.email || payload.data?.object?.customer_email || '';
+  const event = payload.event_type || payload.event || payload.type || '';
+  return `${entry.source}${event ? ` · ${event}` : ''}${email ? ` · ${email}` : ''}`;
+}
+
+function renderRetryTable(entries, { selectable, timeColumn, timeOf }) {
+  if (!entries.length) return '<p class="text-gray-500">Nothing here.</p>';
+  const rows = entries.map(entry => `
+    <tr class="border-b align-top">
+      ${selectable ? `<td class="px-2 py-2"><input type="checkbox" class="dead-letter-check" value="${escapeHtml(entry.id)}"></td>` : ''}
+      <td class="px-2 py-2 font-medium">${escapeHtml(retryEventLabel(entry))}</td>
+      <td class="px-2 py-2 text-center">${escapeHtml(entry.attempts || 0)}</td>
+      <td class="px-2 py-2 text-gray-600">${escapeHtml(timeOf(entry))}</td>
+      <td class="px-2 py-2 text-red-600 break-all">${escapeHtml(entry.reason)}</td>
+      <td class="px-2 py-2">
+        <details>
+          <summary class="cursor-pointer text-gray-700">Payload</summary>
+          <pre class="mt-1 overflow-x-auto text-xs">${escapeHtml(JSON.stringify(entry.payload, null, 2))}</pre>
+        </details>
+      </td>
+    </tr>
+  `).join('');
+
+  return `
+    <table class="min-w-full text-left">
+      <thead>
+        <tr class="border-b text-gray-500">
+          ${selectable ? '<th class="px-2 py-2"><input type="checkbox" id="dead-letter-check-all"></th>' : ''}
+          <th class="px-2 py-2">Event</th>
+          <th class="px-2 py-2">Attempts</th>
+          <th class="px-2 py-2">${timeColumn}</th>
+          <th class="px-2 py-2">Last Error</th>
+          <th class="px-2 py-2"></th>
+        </tr>
+      </thead>
+      <tbody>${rows}</tbody>
+    </table>
+  `;
+}
+
+async function loadRetries() {
+  const deadContainer = document.getElementById('dead-letter-entries');
+  const pendingContainer = document.getElementById('pending-retry-entries');
+  deadContainer.innerHTML = pendingContainer.innerHTML = '<p class="text-gray-500">Loading...</p>';
+
+  try {
+    const res = await fetch('/api/retries');
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const { pending, dead_letter } = await res.json();
+
+    deadContainer.innerHTML = renderRetryTable(dead_letter, {
+      selectable: true,
+      timeColumn: 'Dead Since',
+      timeOf: entry => new Date(entry.dead_at).toLocaleString(),
+    });
+    pendingContainer.innerHTML = renderRetryTable(pending, {
+      selectable: false,
+      timeColumn: 'Next Attempt',
+      timeOf: entry => new Date(entry.next_attempt_at * 1000).toLocaleString(),
+    });
+
+    document.getElementById('dead-letter-check-all')?.addEventListener('change', e => {
+      document.querySelectorAll('.dead-letter-check').forEach(box => { box.checked = e.target.checked; });
+    });
+  } catch (err) {
+    console.error('Failed to load retries:', err);
+    deadContainer.innerHTML = pendingContainer.innerHTML = '<p class="text-red-600">Could not load the retry store.</p>';
+  }
+}
+
+async function postRetryAction(action, body) {
+  const status = document.getElementById('retries-status');
+  status.textContent = '⏳ Working...';
+  try {
+    const res = await fetch(`/api/retries/dead-letter/${action}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(body),
+    });
+    const result = await res.json();
+    if (!res.ok) throw new Error(result.error || `HTTP ${res.status}`);
+    status.textContent = action === 'retry'
+      ? `✅ Requeued ${result.requeued} events`
+      : `✅ Discarded ${result.discarded} events`;
+    loadRetries();
+  } catch (err) {
+    console.error(`Failed to ${action} dead letters:`, err);
+    status.textContent = `❌ ${err.message}`;
+  }
+}
+
+function selectedDeadLetterIds() {
+  return [...document.querySelectorAll('.dead-letter-check:checked')].map(box => box.value);
+}
+
+document.getElementById('retry-selected').addEventListener('click', () => {
+  const ids = selectedDeadLetterIds();
+  if (ids.length) postRetryAction('retry', { ids });
+});
+
+document.getElementById('retry-all').addEventListener('click', () => {
+  if (confirm('Requeue every dead-lettered event?')) postRetryAction('retry', { all: true });
+});
+
+document.getElementById('discard-selected').addEventListener('click', () => {
+  const ids = selectedDeadLetterIds();
+  if (ids.length && confirm(`Discard ${ids.length} dead-lettered events? This can't be undone.`)) {
+    postRetryAction('discard', { ids });
+  }
+});
+
+
 // =========================
 // ✅ Page Handlers & Init
 // =========================
@@ -537,6 +837,7 @@ const pageHandlers = {
   cache: loadEmailCache,
   dashboard: loadDashboard,
   'merge-map': loadMergeMap,
+  retries: loadRetries,
 };
 
 document.querySelector('[data-tab="dashboard"]').click();
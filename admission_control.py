@@ -0,0 +1,182 @@
+# admission_control.py
+#
+# Bounded in-flight work per webhook route, so a burst on one route can't take every request
+# thread in the worker. Each route has its own cap, and all routes share WEBHOOK_MAX_IN_FLIGHT
+# slots, of which WEBHOOK_PRIORITY_RESERVED_SLOTS are kept for payment events. A request that
+# can't get a slot waits up to ADMISSION_QUEUE_SECONDS, and higher priorities go first. After
+# that it is refused: 429 when its own route is at its cap, 503 when the worker is full.
+# The asyncio path (asgi.py) has its own gate with every limit scaled by ASYNC_ADMISSION_SCALE,
+# since a waiting coroutine costs a few KB rather than a request thread.
+
+import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from config import (
+    WEBHOOK_MAX_IN_FLIGHT,
+    WEBHOOK_PRIORITY_RESERVED_SLOTS,
+    ADMISSION_QUEUE_SECONDS,
+    ADMISSION_RETRY_AFTER_SECONDS,
+    MEMBERFUL_MAX_IN_FLIGHT,
+    STRIPE_MAX_IN_FLIGHT,
+    GBX_MAX_IN_FLIGHT,
+    GBX_BULK_MAX_IMPORTS,
+    ASYNC_ADMISSION_SCALE,
+)
+from metrics_utils import incr, set_gauge
+
+# Lower number = higher priority
+PAYMENT, PROFILE, BULK = 0, 1, 2
+
+ROUTES = {
+    "stripe": {"limit": STRIPE_MAX_IN_FLIGHT, "priority": PAYMENT},
+    "memberful": {"limit": MEMBERFUL_MAX_IN_FLIGHT, "priority": PROFILE},
+    "gbx": {"limit": GBX_MAX_IN_FLIGHT, "priority": BULK},
+    "gbx_bulk": {"limit": GBX_BULK_MAX_IMPORTS, "priority": BULK},
+}
+
+class AdmissionRejected(Exception):
+    """No slot for this request; `status` is 429 (route at its cap) or 503 (worker full)"""
+
+    def __init__(self, route, status, retry_after=ADMISSION_RETRY_AFTER_SECONDS):
+        super().__init__(f"{route} webhook rejected with {status}: too much work in flight")
+        self.route = route
+        self.status = status
+        self.retry_after = retry_after
+
+class _Gate:
+    """In-flight and queued counts for one execution model, with every limit multiplied by `scale`"""
+
+    def __init__(self, scale, metric_prefix):
+        self.scale = scale
+        self.metric_prefix = metric_prefix
+        self.in_flight = {route: 0 for route in ROUTES}
+        self.queued = {route: 0 for route in ROUTES}
+
+    def limit(self, route):
+        return ROUTES[route]["limit"] * self.scale
+
+    def capacity(self, priority):
+        if priority == PAYMENT:
+            return WEBHOOK_MAX_IN_FLIGHT * self.scale
+        return max(WEBHOOK_MAX_IN_FLIGHT - WEBHOOK_PRIORITY_RESERVED_SLOTS, 0) * self.scale
+
+    def blocker(self, route):
+        """Why `route` can't take a slot right now (429 / 503), or None if it can"""
+        priority = ROUTES[route]["priority"]
+        if self.in_flight[route] >= self.limit(route):
+            return 429
+        if sum(self.in_flight.values()) >= self.capacity(priority):
+            return 503
+        # A freed slot goes first to a waiting higher-priority request that could use it
+        if any(
+            self.queued[other] and ROUTES[other]["priority"] < priority and self.in_flight[other] < self.limit(other)
+            for other in ROUTES
+        ):
+            return 503
+        return None
+
+    def report(self, route):
+        set_gauge(f"{self.metric_prefix}.{route}.in_flight", self.in_flight[route])
+        set_gauge(f"{self.metric_prefix}.{route}.queued", self.queued[route])
+
+    def reject(self, route, blocker):
+        incr(f"{self.metric_prefix}.{route}.rejected.{blocker}")
+        self.report(route)
+        print(f"🚦 Rejected {route} webhook with {blocker}: {self.in_flight[route]} in flight")
+        raise AdmissionRejected(route, blocker)
+
+    def take(self, route, waited_from):
+        self.in_flight[route] += 1
+        incr(f"{self.metric_prefix}.{route}.admitted")
+        set_gauge(f"{self.metric_prefix}.{route}.last_wait_seconds", round(time.monotonic() - waited_from, 3))
+        self.report(route)
+
+    def status(self):
+        return {
+            route: {"in_flight": self.in_flight[route], "queued": self.queued[route], "limit": self.limit(route)}
+            for route in ROUTES
+        }
+
+_slots = threading.Condition()
+_threads = _Gate(1, "admission")
+_async_slots = None  # asyncio.Condition, created on the event loop
+_tasks = _Gate(ASYNC_ADMISSION_SCALE, "admission.async")
+
+@contextmanager
+def admit(route):
+    """Hold one of `route`'s slots for the duration of the block, or raise AdmissionRejected"""
+    gives_up_at = time.monotonic() + ADMISSION_QUEUE_SECONDS
+    waited_from = time.monotonic()
+
+    with _slots:
+        blocker = _threads.blocker(route)
+        if blocker:
+            _threads.queued[route] += 1
+            _threads.report(route)
+            try:
+                while blocker:
+                    remaining = gives_up_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    _slots.wait(remaining)
+                    blocker = _threads.blocker(route)
+            finally:
+                _threads.queued[route] -= 1
+                # Our leaving the queue may unblock lower priorities
+                _slots.notify_all()
+
+        if blocker:
+            _threads.reject(route, blocker)
+        _threads.take(route, waited_from)
+
+    try:
+        yield
+    finally:
+        with _slots:
+            _threads.in_flight[route] -= 1
+            _threads.report(route)
+            _slots.notify_all()
+
+@asynccontextmanager
+async def admit_async(route):
+    """admit() for coroutines on the asyncio path"""
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Condition()
+    waited_from = time.monotonic()
+
+    async with _async_slots:
+        blocker = _tasks.blocker(route)
+        if blocker:
+            _tasks.queued[route] += 1
+            _tasks.report(route)
+            try:
+                await asyncio.wait_for(
+                    _async_slots.wait_for(lambda: not _tasks.blocker(route)), ADMISSION_QUEUE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                _tasks.queued[route] -= 1
+                _async_slots.notify_all()
+            blocker = _tasks.blocker(route)
+
+        if blocker:
+            _tasks.reject(route, blocker)
+        _tasks.take(route, waited_from)
+
+    try:
+        yield
+    finally:
+        async with _async_slots:
+            _tasks.in_flight[route] -= 1
+            _tasks.report(route)
+            _async_slots.notify_all()
+
+def admission_status():
+    with _slots:
+        return _threads.status()
+
+def admission_status_async():
+    return _tasks.status()
@@ -1,3 +1,7 @@
+import time
+from metrics_utils import incr, set_gauge, snapshot as metrics_snapshot
+_import_started = time.perf_counter()
+
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -9,7 +13,7 @@ import json
 from datetime import datetime, timedelta
 from flask import (
     Flask, request, render_template, redirect, url_for,
-    session, abort, send_from_directory, jsonify
+    session, abort, send_from_directory, jsonify, Response
 )
 from werkzeug.security import check_password_hash
 from functools import wraps
@@ -30,17 +34,28 @@ limiter = Limiter(get_remote_address, app=app)
 LOG_FILE = "webhook_logs.json"
 LOGS_USER = os.getenv("LOGS_USER")
 LOGS_PASSWORD_HASH = os.getenv("LOGS_PASSWORD_HASH")
-
-import stripe
-app_env = os.getenv("APP_ENV", "local")
-stripe.api_key = os.getenv("STRIPE_API_KEY_LIVE") if app_env == "production" else os.getenv("STRIPE_API_KEY_TEST")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 # ✅ Utility Imports
-from storage_utils import load_json, load_merge_map, save_merge_map
-from cache_utils import load_cache, save_cache, get_cached_email
-from log_utils import append_log_entry
-from mailchimp_sync import sync_to_mailchimp
-from config import MEMBERFUL_WEBHOOK_SECRET
+from merge_utils import load_merge_map, save_merge_map
+from cache_utils import load_cache, get_cached_email, remove_from_cache, find_member_ids, search_cache
+from log_utils import append_log_entry, load_logs_since
+import log_stream
+from payload_store import load_payload
+from mailchimp_sync import sync_to_mailchimp, sync_payment_tag, SyncFailed, ADD_TAG_EVENTS, REMOVE_TAG_EVENTS
+from payment_state import APPLY, claim_payment_event, release_payment_event, superseding_outcome
+from concurrency_utils import run_concurrently
+from stripe_client import get_stripe, retrieve_customer, stripe_credentials
+from circuit_breaker import CircuitOpenError, DeadlineExceeded, request_deadline, breaker_states
+from admission_control import admit, AdmissionRejected, admission_status, admission_status_async
+from deferred_utils import (
+    defer_event, dead_letter_event, blocked_by, register_processor, start_drain_thread, tracking_steps, once,
+    load_deferred_events, load_dead_letters, requeue_dead_letters, discard_dead_letters
+)
+from config import MEMBERFUL_WEBHOOK_SECRET, WARMUP_ON_BOOT, IMPORT_TIME_BUDGET_SECONDS, CIRCUIT_RESET_SECONDS
+
+# Stripe events that toggle the "Payment Failed" tag (order.failed is Memberful-only and deprecated)
+STRIPE_TAG_EVENTS = (ADD_TAG_EVENTS | REMOVE_TAG_EVENTS) - {"order.failed"}
 
 # ✅ Custom login_required decorator
 def login_required(f):
@@ -100,20 +115,39 @@ def datetimeformat(value, mode='full'):
 
 # ✅ Signature verification
 def verify_signature(request):
-    signature = request.headers.get("X-Memberful-Webhook-Signature")
+    return memberful_signature_valid(request.headers.get("X-Memberful-Webhook-Signature"), request.get_data())
+
+def memberful_signature_valid(signature, payload):
     if signature == "REPLAY":
         return True
     if not signature:
         print("❌ Missing signature header")
         return False
     secret = MEMBERFUL_WEBHOOK_SECRET.encode()
-    payload = request.get_data()
     computed = hmac.new(secret, payload, hashlib.sha256).hexdigest()
     if not hmac.compare_digest(computed, signature):
         print("❌ Webhook signature does not match!")
         return False
     return True
 
+# ⏸️ Deferral when a dependency is down
+def _retry_later():
+    return "Service temporarily unavailable", 503, {"Retry-After": str(int(CIRCUIT_RESET_SECONDS))}
+
+def _defer(source, payload, reason, completed_steps=()):
+    if defer_event(source, payload, reason, completed_steps=completed_steps):
+        return jsonify({"status": "deferred", "reason": reason}), 202
+    return _retry_later()
+
+# 🚦 Too much webhook work already in flight — tell the sender to come back
+@app.errorhandler(AdmissionRejected)
+def _admission_rejected(e):
+    return jsonify({"error": str(e)}), e.status, {"Retry-After": str(e.retry_after)}
+
+@app.before_request
+def _start_background_jobs():
+    start_drain_thread()
+
 # ✅ Memberful Webhook
 @app.route('/memberful-webhook', methods=['POST'])
 def memberful_webhook():
@@ -121,10 +155,64 @@ def memberful_webhook():
         return abort(403, description="Invalid webhook signature")
 
     data = request.json
-    event_type = data.get("event")
+    blocked = blocked_by("memberful")
+    if blocked:
+        return _defer("memberful", data, f"Circuit open: {', '.join(blocked)}")
+
+    try:
+        with admit("memberful"), request_deadline(), tracking_steps() as steps:
+            process_memberful_event(data)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        return _defer("memberful", data, str(e), steps)
+
+    return '', 200
+
+def process_memberful_event(data):
+    lookup_id = memberful_lookup_id(data)
+    plan = plan_memberful_event(data, get_cached_email(lookup_id) if lookup_id else None)
+    if not plan:
+        return
+
+    # ⚡ The webhook log doesn't depend on the Mailchimp result — persist it alongside the sync.
+    # Both are once-only, so a replay after a later failure doesn't repeat them.
+    run_concurrently(
+        lambda: once("mailchimp", sync_to_mailchimp, plan["member"], plan["subscription"], plan["event_type"], override_guid=plan["override_guid"]),
+        lambda: once("log", append_log_entry, plan["event_type"], plan["email"], "success", diff=plan["changes"], payload=data)
+    )
+    if plan["uncache"]:
+        # Must follow the sync, which reads (and re-saves) the cached email
+        remove_from_cache(plan["uncache"])
+
+def _memberful_parts(data):
+    member = data.get("member") or data.get("subscription", {}).get("member") or {}
+    return data.get("event"), member, data.get("subscription") or {}
+
+def memberful_lookup_id(data):
+    """Member ID whose cached email handling this event needs, if any"""
+    event_type, member, _ = _memberful_parts(data)
+    if event_type == "member.deleted" or (event_type == "member_updated" and member.get("email")):
+        return member.get("id")
+    return None
+
+def plan_memberful_event(data, cached_email):
+    """What a Memberful event does, given the cached email for memberful_lookup_id(data).
+
+    Returns the sync to run and log to write — {event_type, member, subscription, override_guid,
+    email, changes, uncache} — or None when the event needs no sync.
+    """
+    event_type, member, subscription = _memberful_parts(data)
     print(f"Received webhook: {event_type}")
     print("Raw webhook payload:")
     print(data)
+    plan = {
+        "event_type": event_type,
+        "member": member,
+        "subscription": subscription,
+        "override_guid": False,
+        "email": member.get("email"),
+        "changes": None,
+        "uncache": None
+    }
 
     # if event_type == "order.failed":
     #     # 🟡 Deprecated: 'order.failed' events are now handled via Stripe webhook
@@ -136,12 +224,9 @@ def memberful_webhook():
     #     append_log_entry(event_type, member["email"], "success", payload=data)
     #     return '', 200
 
-    member = data.get("member") or data.get("subscription", {}).get("member") or {}
-    subscription = data.get("subscription") or {}
-
     if not member.get("email") and event_type != "member.deleted":
         print("⚠️ No email — skipping sync.")
-        return '', 200
+        return None
 
     if event_type in [
         "member_signup", "member_updated",
@@ -153,70 +238,56 @@ def memberful_webhook():
         if event_type == "subscription.created":
             member["lead_stage"] = "Converted"
 
-        sync_to_mailchimp(member, subscription, event_type)
-
         if event_type == "member_updated":
-            member_id = member.get("id")
             current_email = member.get("email")
-            cached_email = get_cached_email(member_id)
-            changes = data.get("changed", {})
+            plan["changes"] = data.get("changed", {})
             if cached_email and cached_email != current_email:
                 print(f"✳️ Email changed: {cached_email} → {current_email}")
-            append_log_entry(event_type, current_email, "success", diff=changes, payload=data)
-        else:
-            append_log_entry(event_type, member.get("email"), "success", payload=data)
+        return plan
 
     elif event_type == "subscription.deactivated":
-        subscription_stub = {
+        plan["subscription"] = {
             "active": False,
             "plan_name": subscription.get("plan_name") or subscription.get("subscription_plan", {}).get("name", ""),
             "autorenew": subscription.get("autorenew"),
             "expires_at": subscription.get("expires_at")
         }
-        sync_to_mailchimp(member, subscription_stub, event_type)
-        append_log_entry(event_type, member.get("email"), "success", payload=data)
+        return plan
 
     elif event_type == "subscription.deleted":
-        member["email"] = member.get("email") or get_cached_email(member.get("id"))
+        member["email"] = member.get("email") or cached_email
         if member["email"]:
-            subscription_stub = {
+            plan["email"] = member["email"]
+            plan["subscription"] = {
                 "active": False,
                 "plan_name": "",
                 "autorenew": None,
                 "expires_at": None
             }
-            sync_to_mailchimp(member, subscription_stub, event_type)
-            append_log_entry(event_type, member["email"], "success", payload=data)
-        else:
-            print("⚠️ No email found for deleted subscription")
+            return plan
+        print("⚠️ No email found for deleted subscription")
 
     elif event_type == "member.deleted":
         member_id = member.get("id")
         if member_id:
-            cached_email = get_cached_email(member_id)
             if cached_email:
-                member_stub = {
+                plan["member"] = {
                     "email": cached_email,
                     "id": member_id,
                     "first_name": "",
                     "last_name": "",
                     "created_at": ""
                 }
-                subscription_stub = {
+                plan["subscription"] = {
                     "active": False,
                     "plan_name": "",
                     "autorenew": None,
                     "expires_at": None
                 }
-                sync_to_mailchimp(member_stub, subscription_stub, event_type, override_guid=True)
-                append_log_entry(event_type, cached_email, "success", payload=data)
-                cache = load_cache()
-                cache.pop(str(member_id), None)
-                save_cache(cache)
-            else:
-                print(f"⚠️ No cached email for deleted member ID {member_id}")
-
-    return '', 200
+                plan.update(override_guid=True, email=cached_email, uncache=member_id)
+                return plan
+            print(f"⚠️ No cached email for deleted member ID {member_id}")
+    return None
 
 # ✅ GBX Webhook
 @app.route('/gbx-member-profile-webhook', methods=['POST'])
@@ -230,27 +301,58 @@ def gbx_member_profile_webhook():
             print("❌ Invalid GBX webhook secret")
             return "Unauthorized", 403
 
+        profile = {key: value for key, value in payload.items() if key != "secret"}
+        blocked = blocked_by("gbx")
+        if blocked:
+            return _defer("gbx", profile, f"Circuit open: {', '.join(blocked)}")
+
         from gbx_sync import sync_gbx_profile_to_mailchimp
-        sync_gbx_profile_to_mailchimp(payload)
+        try:
+            with admit("gbx"), request_deadline():
+                sync_gbx_profile_to_mailchimp(payload)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            return _defer("gbx", profile, str(e))
         return '', 200
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"❌ Error processing GBX profile webhook: {e}")
         return 'Error', 500
 
+# ✅ GBX Bulk Import — JSON array or NDJSON stream of profiles
+@app.route('/gbx-member-profile-webhook/bulk', methods=['POST'])
+def gbx_member_profile_bulk_webhook():
+    secret = os.getenv("GBX_WEBHOOK_SECRET") or ""
+    provided = request.headers.get("X-GBX-Webhook-Secret") or ""
+    if not secret or not hmac.compare_digest(provided, secret):
+        print("❌ Invalid GBX webhook secret")
+        return "Unauthorized", 403
+
+    blocked = blocked_by("gbx")
+    if blocked:
+        # Too big to park — ask GBX to resend once the circuit has had time to close
+        print(f"⏸️ Refusing GBX bulk import while circuit open: {', '.join(blocked)}")
+        return _retry_later()
+
+    try:
+        from gbx_sync import iter_profiles, sync_gbx_profiles_bulk
+        with admit("gbx_bulk"):
+            summary = sync_gbx_profiles_bulk(iter_profiles(request.stream))
+        return jsonify(summary), 200
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"❌ Error processing GBX bulk import: {e}")
+        return 'Error', 500
+
 # ✅ Stripe Webhook - For payment info
 @app.route('/stripe-webhook', methods=['POST'])
 def stripe_webhook():
+    stripe = get_stripe()
     payload = request.data
     sig_header = request.headers.get('Stripe-Signature')
 
-    # Pick correct secret based on environment
-    app_env = os.getenv('APP_ENV', 'local')
-    if app_env == 'production':
-        webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET_PROD')
-        stripe.api_key = os.getenv("STRIPE_API_KEY_PROD")
-    else:
-        webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET_LOCAL')
-        stripe.api_key = os.getenv("STRIPE_API_KEY_TEST")
+    webhook_secret, stripe.api_key = stripe_credentials()
 
     try:
         event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
@@ -264,82 +366,154 @@ def stripe_webhook():
     event_type = event['type']
     print(f"⚡ Received Stripe event: {event_type}")
 
-    # Supported tag-relevant events
-    ADD_TAG_EVENTS = {
-        'invoice.payment_failed',
-        'charge.failed',
-        'payment_intent.payment_failed'
-    }
-
-    REMOVE_TAG_EVENTS = {
-        'invoice.payment_succeeded',
-        'invoice.paid',
-        'charge.succeeded',
-        'payment_intent.succeeded'
-    }
+    if event_type not in STRIPE_TAG_EVENTS:
+        print(f"ℹ️ Received unsupported event: {event_type} — no action taken")
+        return '', 200
 
-    if event_type in ADD_TAG_EVENTS.union(REMOVE_TAG_EVENTS):
-        obj = event['data']['object']
-        customer_id = obj.get('customer')
+    blocked = blocked_by("stripe")
+    if blocked:
+        return _defer("stripe", event, f"Circuit open: {', '.join(blocked)}")
 
-        if not customer_id:
-            print("⚠️ No customer ID in event — skipping")
+    try:
+        with admit("stripe"), request_deadline(), tracking_steps() as steps:
+            process_stripe_event(event)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        return _defer("stripe", event, str(e), steps)
+    except SyncFailed as e:
+        if e.permanent:
+            dead_letter_event("stripe", event, str(e), attempts=1, completed_steps=steps)
             return '', 200
+        return _defer("stripe", event, str(e), steps)
+    except AdmissionRejected:
+        raise
+    except Exception:
+        return "Error", 500
 
-        # 🔍 Check for member_id in metadata
-        metadata = obj.get("metadata", {})
-        if event_type.startswith("payment_intent.") and "charges" in obj:
-            charges = obj.get("charges", {}).get("data", [])
-            if charges and isinstance(charges, list):
-                metadata = charges[0].get("metadata", {})
+    return '', 200
 
-        if "member_id" not in metadata:
-            print(f"⚠️ Skipping {event_type} — no member_id in metadata")
-            return '', 200
+def payment_event_member(event):
+    """(customer ID, metadata member ID) for a payment event, or None when it isn't tied to a member"""
+    event_type = event['type']
+    obj = event['data']['object']
+    customer_id = obj.get('customer')
+
+    if not customer_id:
+        print("⚠️ No customer ID in event — skipping")
+        return None
+
+    # 🔍 Check for member_id in metadata
+    metadata = obj.get("metadata", {})
+    if event_type.startswith("payment_intent.") and "charges" in obj:
+        charges = obj.get("charges", {}).get("data", [])
+        if charges and isinstance(charges, list):
+            metadata = charges[0].get("metadata", {})
+
+    if "member_id" not in metadata:
+        print(f"⚠️ Skipping {event_type} — no member_id in metadata")
+        return None
+    return customer_id, str(metadata.get("member_id") or "")
+
+def collapsed(event, customer_id, decision):
+    """True (and counted) when claim_payment_event says another event already does this work"""
+    if decision == APPLY:
+        return False
+    print(f"🔗 Collapsed {event['type']} {event.get('id')} for {customer_id}: {decision}")
+    incr(f"stripe.{decision}")
+    return True
 
-        print(f"🔍 Fetching Stripe customer: {customer_id}")
-        email = "unknown"  # Ensure it's defined for logging
+def matched_member_id(email, cached_ids):
+    """Member ID for a payment whose metadata has none, from the reverse email index"""
+    if cached_ids:
+        print(f"🔗 Matched {email} to cached member {cached_ids[0]}")
+        return cached_ids[0]
+    return None
+
+def payment_member_stub(member_id, email, customer=None):
+    """Minimal member-like object for the tag update, named from the Stripe customer if we fetched it"""
+    first_name = last_name = created_at = ""
+    if customer:
+        # ✅ Safe name splitting
+        customer_name = customer.get("name") or ""
+        name_parts = customer_name.strip().split(" ", 1)
+        first_name = name_parts[0] if len(name_parts) > 0 else ""
+        last_name = name_parts[1] if len(name_parts) > 1 else ""
+        created_at = customer.get("created", "")
+    return {
+        "email": email,
+        "id": member_id,
+        "first_name": first_name,
+        "last_name": last_name,
+        "created_at": created_at
+    }
 
-        try:
-            customer = stripe.Customer.retrieve(customer_id)
-            email = customer.get("email")
-            print(f"📧 Email from Stripe: {email}")
+def process_stripe_event(event):
+    event_type = event['type']
+    tied = payment_event_member(event)
+    if not tied:
+        return
+    customer_id, member_id = tied
 
-            if not email:
-                print("⚠️ Stripe customer has no email — skipping Mailchimp sync")
-                return '', 200
-
-            # ✅ Safe name splitting
-            customer_name = customer.get("name") or ""
-            name_parts = customer_name.strip().split(" ", 1)
-            first_name = name_parts[0] if len(name_parts) > 0 else ""
-            last_name = name_parts[1] if len(name_parts) > 1 else ""
-
-            # Construct minimal member-like object
-            member_stub = {
-                "email": email,
-                "id": "",
-                "first_name": first_name,
-                "last_name": last_name,
-                "created_at": customer.get("created", "")
-            }
+    # 🔗 One payment arrives as several events; only the first (and only if it's the newest) does the work
+    decision, previous = claim_payment_event(customer_id, event)
+    if collapsed(event, customer_id, decision):
+        return
 
-            from mailchimp_sync import sync_to_mailchimp
-            sync_to_mailchimp(member_stub, None, event_type, tag_only=True)
+    email = "unknown"  # Ensure it's defined for logging
 
-            from log_utils import append_log_entry
-            append_log_entry(event_type, email, "success", payload=event)
+    try:
+        # 🧠 Resolve email ↔ member ID from the cache first — only call Stripe if we must
+        cached_email = get_cached_email(member_id) if member_id else None
 
-        except Exception as e:
-            print(f"❌ Failed to sync payment event to Mailchimp: {e}")
-            from log_utils import append_log_entry
-            append_log_entry(event_type, email, "error", diff={"error": str(e)}, payload=event)
-            return "Error", 500
+        if cached_email:
+            email = cached_email
+            print(f"📧 Email from cache for member {member_id}: {email}")
+            member_stub = payment_member_stub(member_id, email)
+        else:
+            print(f"🔍 Fetching Stripe customer: {customer_id}")
+            customer = retrieve_customer(customer_id)
+            email = customer.get("email")
+            print(f"📧 Email from Stripe: {email}")
 
-    else:
-        print(f"ℹ️ Received unsupported event: {event_type} — no action taken")
+            if not email:
+                print("⚠️ Stripe customer has no email — skipping Mailchimp sync")
+                return
+
+            # The metadata member ID is authoritative; the reverse index only fills in a missing one
+            if not member_id:
+                member_id = matched_member_id(email, find_member_ids(email))
+            member_stub = payment_member_stub(member_id, email, customer)
+
+        once("tag", sync_payment_tag, member_stub, event_type)
+        # Only logged as a success once the tag update has gone through
+        once("log", append_log_entry, event_type, email, "success", payload=event)
+
+        # A newer outcome claimed while our tag update was in flight may have landed first — reassert it
+        newer = superseding_outcome(customer_id, event)
+        if newer:
+            print(f"🔁 {newer['event_type']} superseded {event_type} for {customer_id} — reapplying it")
+            sync_payment_tag(member_stub, newer["event_type"])
+
+    except SyncFailed as e:
+        # The Stripe event itself is retried (holding its claim), so a late retry is re-checked for staleness
+        print(f"❌ Failed to update payment tag in Mailchimp: {e}")
+        append_log_entry(event_type, email, "error", diff={"error": str(e)}, payload=event)
+        if e.permanent:
+            release_payment_event(customer_id, event["id"], previous)
+        raise
+    except (CircuitOpenError, DeadlineExceeded):
+        release_payment_event(customer_id, event["id"], previous)
+        raise
+    except Exception as e:
+        print(f"❌ Failed to sync payment event to Mailchimp: {e}")
+        release_payment_event(customer_id, event["id"], previous)
+        append_log_entry(event_type, email, "error", diff={"error": str(e)}, payload=event)
+        raise
 
-    return '', 200
+def release_dead_stripe_event(event):
+    """A dead-lettered Stripe event gives up its payment claim, so a correlated event can apply the outcome"""
+    tied = payment_event_member(event)
+    if tied:
+        release_payment_event(tied[0], event["id"], None)
 
 # ✅ Admin + API Routes
 @app.route('/admin')
@@ -363,11 +537,31 @@ def admin_static(path):
 @login_required
 def serve_webhook_logs_json():
     try:
-        return load_json(LOG_FILE), 200
+        entries, cursor = load_logs_since(0)
+        # The cursor lets the admin UI pick up /api/logs/stream exactly where this snapshot ends
+        return jsonify([entry for _, entry in entries]), 200, {"X-Log-Cursor": str(cursor)}
     except Exception as e:
         print(f"❌ Error loading logs JSON: {e}")
         return {"error": "Could not load logs"}, 500
 
+@app.route('/api/logs/stream')
+@login_required
+def stream_logs():
+    # EventSource resends the last id it saw when it reconnects; an explicit ?cursor= is for the first connect
+    cursor = request.headers.get("Last-Event-ID", request.args.get("cursor"))
+    try:
+        cursor = int(cursor) if cursor not in (None, "") else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    if not log_stream.acquire():
+        return jsonify({"error": "Too many live log streams"}), 503, {"Retry-After": "30"}
+    response = Response(log_stream.events(cursor), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(log_stream.release)
+    return response
+
 @app.route('/email_cache.json')
 @login_required
 def serve_email_cache():
@@ -377,6 +571,53 @@ def serve_email_cache():
         print(f"❌ Error loading email cache: {e}")
         return {"error": "Could not load email cache"}, 500
 
+@app.route('/api/email-cache', methods=['GET'])
+@login_required
+def api_email_cache():
+    try:
+        query = request.args.get("q", "")
+        match = "prefix" if request.args.get("match") == "prefix" else "substring"
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(max(request.args.get("per_page", 100, type=int), 1), 500)
+
+        total, items = search_cache(query, match, offset=(page - 1) * per_page, limit=per_page)
+        return jsonify({
+            "items": [{"member_id": member_id, "email": email} for member_id, email in items],
+            "total": total,
+            "page": page,
+            "per_page": per_page
+        })
+    except Exception as e:
+        print(f"❌ Error searching email cache: {e}")
+        return jsonify({"error": "Could not search email cache"}), 500
+
+@app.route('/api/email-cache/lookup', methods=['GET'])
+@login_required
+def api_email_cache_lookup():
+    email = request.args.get("email", "").strip()
+    if not email:
+        return jsonify({"error": "Missing email"}), 400
+    try:
+        return jsonify({"email": email, "member_ids": find_member_ids(email)})
+    except Exception as e:
+        print(f"❌ Error looking up {email} in email cache: {e}")
+        return jsonify({"error": "Could not look up email"}), 500
+
+@app.route('/api/payloads/<ref>', methods=['GET'])
+@login_required
+def api_payload(ref):
+    try:
+        payload = load_payload(ref)
+    except Exception as e:
+        print(f"❌ Failed to load payload {ref}: {e}")
+        return jsonify({"error": "Could not load payload"}), 500
+    if payload is None:
+        return jsonify({"error": "Payload not found"}), 404
+    # Content-addressed, so a ref's payload never changes
+    response = jsonify(payload)
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
 @app.route('/replay-log', methods=['POST'])
 @login_required
 def replay_log():
@@ -384,6 +625,12 @@ def replay_log():
         data = request.get_json()
         print("📥 Incoming replay payload:", data)
 
+        # Logged payloads are replayed by reference; older entries still send the payload inline
+        if isinstance(data, dict) and data.get("payload_ref"):
+            data = load_payload(data["payload_ref"])
+            if data is None:
+                return "Payload not found", 404
+
         if not data or "event" not in data:
             print("⚠️ Missing event or invalid data:", request.data)
             return "Missing payload or event", 400
@@ -398,6 +645,12 @@ def replay_log():
         ):
             return memberful_webhook()
 
+    except AdmissionRejected:
+        # Surfaces as the gate's 503/429 with Retry-After (see _admission_rejected)
+        raise
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        print(f"⏸️ Replay unavailable while a dependency is down: {e}")
+        return _retry_later()
     except Exception as e:
         print("❌ Replay handler failed:", e)
         return "Server error", 500
@@ -416,16 +669,102 @@ def get_merge_map():
 def update_merge_map():
     try:
         data = request.get_json()
-        save_merge_map(data)
-        return jsonify({"status": "ok"})
+        warnings = save_merge_map(data)
+        for warning in warnings:
+            print(f"⚠️ Merge map saved with warning: {warning}")
+        return jsonify({"status": "ok", "warnings": warnings})
+    except ValueError as e:
+        print(f"❌ Rejected invalid merge map: {e}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"❌ Failed to save merge map: {e}")
         return jsonify({"error": "Failed to save merge map"}), 500
 
+# 🔁 Retry store
+@app.route('/api/retries', methods=['GET'])
+@login_required
+def api_retries():
+    try:
+        pending = sorted(load_deferred_events(), key=lambda e: e.get("next_attempt_at", 0))
+        dead = sorted(load_dead_letters(), key=lambda e: e.get("dead_at", ""), reverse=True)
+        return jsonify({"pending": pending, "dead_letter": dead})
+    except Exception as e:
+        print(f"❌ Failed to load retry store: {e}")
+        return jsonify({"error": "Could not load retry store"}), 500
+
+def _selected_ids():
+    data = request.get_json(silent=True) or {}
+    if data.get("all"):
+        return None
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not ids:
+        return []
+    return set(ids)
+
+@app.route('/api/retries/dead-letter/retry', methods=['POST'])
+@login_required
+def api_retry_dead_letters():
+    ids = _selected_ids()
+    if ids == []:
+        return jsonify({"error": "Pass ids or all=true"}), 400
+    try:
+        return jsonify({"requeued": requeue_dead_letters(ids)})
+    except Exception as e:
+        print(f"❌ Failed to requeue dead letters: {e}")
+        return jsonify({"error": "Could not requeue dead letters"}), 500
+
+@app.route('/api/retries/dead-letter/discard', methods=['POST'])
+@login_required
+def api_discard_dead_letters():
+    ids = _selected_ids()
+    if not ids:
+        return jsonify({"error": "Pass the ids to discard"}), 400
+    try:
+        return jsonify({"discarded": discard_dead_letters(ids)})
+    except Exception as e:
+        print(f"❌ Failed to discard dead letters: {e}")
+        return jsonify({"error": "Could not discard dead letters"}), 500
+
 @app.route('/health')
 def health_check():
-    return {"status": "ok"}, 200
+    circuits = breaker_states()
+    degraded = any(c["state"] != "closed" for c in circuits.values())
+    return {"status": "degraded" if degraded else "ok", "circuits": circuits}, 200
+
+@app.route('/metrics')
+def metrics():
+    # Scrapers send METRICS_TOKEN as a bearer token; people use the admin login
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        if not METRICS_TOKEN or not hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}"):
+            return "Unauthorized", 401
+    elif not session.get("logged_in"):
+        return redirect(url_for("login"))
+    return jsonify({**metrics_snapshot(), "admission": admission_status(), "admission_async": admission_status_async()})
+
+# ▶️ Deferred event processors
+def _process_gbx_profile(profile):
+    from gbx_sync import sync_gbx_profile_to_mailchimp
+    sync_gbx_profile_to_mailchimp(profile)
+
+def _process_gbx_bulk(profiles):
+    from gbx_sync import sync_gbx_profiles_bulk
+    sync_gbx_profiles_bulk(profiles)
+
+register_processor("memberful", process_memberful_event)
+register_processor("stripe", process_stripe_event, on_dead_letter=release_dead_stripe_event)
+register_processor("gbx", _process_gbx_profile)
+register_processor("gbx_bulk", _process_gbx_bulk)
+
+# ⏱️ Import-time budget
+_import_seconds = time.perf_counter() - _import_started
+set_gauge("startup.import_seconds", round(_import_seconds, 3))
+if _import_seconds > IMPORT_TIME_BUDGET_SECONDS:
+    print(f"⚠️ app.py took {_import_seconds:.2f}s to import (budget {IMPORT_TIME_BUDGET_SECONDS:.2f}s)")
 
 if __name__ == '__main__':
+    if WARMUP_ON_BOOT:
+        from warmup import warm_up
+        warm_up()
     port = int(os.environ.get("PORT", 5050))
     app.run(host="0.0.0.0", port=port)
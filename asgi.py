@@ -0,0 +1,430 @@
+# asgi.py — `uvicorn asgi:app --workers 2`
+#
+# asyncio entry point for high-concurrency deployments. The three per-event webhook routes
+# (Memberful, Stripe, single GBX profiles) run natively on the event loop. Their Mailchimp,
+# Stripe and Spaces calls go over one pooled httpx client, so thousands of webhooks can be in
+# flight in a handful of processes instead of one request thread each. Every other route
+# (admin UI, APIs, the log stream, GBX bulk import) is served by the Flask app over a small
+# WSGI bridge, so `gunicorn app:app` and this entry point behave the same.
+
+import os
+import sys
+import json
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from app import (
+    app as flask_app,
+    memberful_signature_valid,
+    memberful_lookup_id,
+    plan_memberful_event,
+    payment_event_member,
+    collapsed,
+    matched_member_id,
+    payment_member_stub,
+    STRIPE_TAG_EVENTS,
+)
+from config import (
+    ASGI_WSGI_THREADS, CIRCUIT_RESET_SECONDS, WARMUP_ON_BOOT, LOG_STREAM_MAX_CLIENTS, GBX_BULK_MAX_IMPORTS
+)
+from cache_utils import get_cached_email_async, remove_from_cache_async, find_member_ids
+from log_utils import append_log_entry_async
+from mailchimp_sync import sync_to_mailchimp_async, sync_payment_tag_async, SyncFailed
+from mailchimp_client import mailchimp_request_async, MAILCHIMP_BASE_URL
+from gbx_sync import sync_gbx_profile_to_mailchimp_async
+from payment_state import claim_payment_event_async, release_payment_event_async, superseding_outcome_async
+from stripe_client import get_stripe, retrieve_customer_async, stripe_credentials
+from concurrency_utils import gather_all
+from circuit_breaker import CircuitOpenError, DeadlineExceeded, request_deadline
+from admission_control import admit_async, AdmissionRejected
+from deferred_utils import defer_event, dead_letter_event, blocked_by, start_drain_thread, tracking_steps, once_async
+from async_http import close_async_client
+
+_wsgi_pool = ThreadPoolExecutor(ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+
+# Routes that hold their thread for minutes (the log stream, a GBX bulk import) get their own
+# pool, sized to the per-worker limits those routes enforce plus one thread to turn away the
+# excess, so they can never starve the admin UI and APIs of _wsgi_pool threads.
+LONG_RUNNING_PATHS = {"/api/logs/stream", "/gbx-member-profile-webhook/bulk"}
+_long_running_pool = ThreadPoolExecutor(LOG_STREAM_MAX_CLIENTS + GBX_BULK_MAX_IMPORTS + 1, thread_name_prefix="wsgi-long")
+
+# 📨 Webhook processing
+async def process_memberful_event_async(data):
+    lookup_id = memberful_lookup_id(data)
+    plan = plan_memberful_event(data, await get_cached_email_async(lookup_id) if lookup_id else None)
+    if not plan:
+        return
+
+    await gather_all(
+        once_async("mailchimp", sync_to_mailchimp_async, plan["member"], plan["subscription"], plan["event_type"], override_guid=plan["override_guid"]),
+        once_async("log", append_log_entry_async, plan["event_type"], plan["email"], "success", diff=plan["changes"], payload=data)
+    )
+    if plan["uncache"]:
+        # Must follow the sync, which reads (and re-saves) the cached email
+        await remove_from_cache_async(plan["uncache"])
+
+async def process_stripe_event_async(event, api_key=None):
+    event_type = event['type']
+    tied = payment_event_member(event)
+    if not tied:
+        return
+    customer_id, member_id = tied
+
+    decision, previous = await claim_payment_event_async(customer_id, event)
+    if collapsed(event, customer_id, decision):
+        return
+
+    email = "unknown"
+
+    try:
+        cached_email = await get_cached_email_async(member_id) if member_id else None
+
+        if cached_email:
+            email = cached_email
+            print(f"📧 Email from cache for member {member_id}: {email}")
+            member_stub = payment_member_stub(member_id, email)
+        else:
+            print(f"🔍 Fetching Stripe customer: {customer_id}")
+            customer = await retrieve_customer_async(customer_id, api_key)
+            email = customer.get("email")
+            print(f"📧 Email from Stripe: {email}")
+
+            if not email:
+                print("⚠️ Stripe customer has no email — skipping Mailchimp sync")
+                return
+
+            # The reverse index is in memory once built; building it reads every cache shard
+            if not member_id:
+                member_id = matched_member_id(email, await asyncio.to_thread(find_member_ids, email))
+            member_stub = payment_member_stub(member_id, email, customer)
+
+        await once_async("tag", sync_payment_tag_async, member_stub, event_type)
+        # Only logged as a success once the tag update has gone through
+        await once_async("log", append_log_entry_async, event_type, email, "success", payload=event)
+
+        newer = await superseding_outcome_async(customer_id, event)
+        if newer:
+            print(f"🔁 {newer['event_type']} superseded {event_type} for {customer_id} — reapplying it")
+            await sync_payment_tag_async(member_stub, newer["event_type"])
+
+    except SyncFailed as e:
+        print(f"❌ Failed to update payment tag in Mailchimp: {e}")
+        await append_log_entry_async(event_type, email, "error", diff={"error": str(e)}, payload=event)
+        if e.permanent:
+            await release_payment_event_async(customer_id, event["id"], previous)
+        raise
+    except (CircuitOpenError, DeadlineExceeded):
+        await release_payment_event_async(customer_id, event["id"], previous)
+        raise
+    except Exception as e:
+        print(f"❌ Failed to sync payment event to Mailchimp: {e}")
+        await release_payment_event_async(customer_id, event["id"], previous)
+        await append_log_entry_async(event_type, email, "error", diff={"error": str(e)}, payload=event)
+        raise
+
+# ✅ Native routes — each returns (status, headers, body)
+def _text(body, status, headers=None):
+    return status, {"Content-Type": "text/html; charset=utf-8", **(headers or {})}, body.encode()
+
+def _json(data, status, headers=None):
+    return status, {"Content-Type": "application/json", **(headers or {})}, json.dumps(data).encode()
+
+def _retry_later():
+    return _text("Service temporarily unavailable", 503, {"Retry-After": str(int(CIRCUIT_RESET_SECONDS))})
+
+async def _defer(source, payload, reason, completed_steps=()):
+    # The retry store is shared with the threaded path — write to it from a worker thread
+    if await asyncio.to_thread(defer_event, source, payload, reason, completed_steps=completed_steps):
+        return _json({"status": "deferred", "reason": reason}, 202)
+    return _retry_later()
+
+def _admission_rejected(e):
+    return _json({"error": str(e)}, e.status, {"Retry-After": str(e.retry_after)})
+
+async def memberful_webhook(body, headers):
+    if not memberful_signature_valid(headers.get("x-memberful-webhook-signature"), body):
+        return _text("Invalid webhook signature", 403)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return _text("Invalid JSON", 400)
+
+    blocked = blocked_by("memberful")
+    if blocked:
+        return await _defer("memberful", data, f"Circuit open: {', '.join(blocked)}")
+
+    try:
+        async with admit_async("memberful"):
+            with request_deadline(), tracking_steps() as steps:
+                await process_memberful_event_async(data)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        return await _defer("memberful", data, str(e), steps)
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
+
+    return _text("", 200)
+
+async def gbx_member_profile_webhook(body, headers):
+    try:
+        payload = json.loads(body)
+        print("✅ Received GBX profile webhook payload:")
+        print(json.dumps(payload, indent=2))
+
+        if payload.get("secret") != os.getenv("GBX_WEBHOOK_SECRET"):
+            print("❌ Invalid GBX webhook secret")
+            return _text("Unauthorized", 403)
+
+        profile = {key: value for key, value in payload.items() if key != "secret"}
+        blocked = blocked_by("gbx")
+        if blocked:
+            return await _defer("gbx", profile, f"Circuit open: {', '.join(blocked)}")
+
+        try:
+            async with admit_async("gbx"):
+                with request_deadline():
+                    await sync_gbx_profile_to_mailchimp_async(payload)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            return await _defer("gbx", profile, str(e))
+        return _text("", 200)
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
+    except Exception as e:
+        print(f"❌ Error processing GBX profile webhook: {e}")
+        return _text("Error", 500)
+
+async def stripe_webhook(body, headers):
+    stripe = get_stripe()
+    webhook_secret, api_key = stripe_credentials()
+
+    try:
+        event = stripe.Webhook.construct_event(body, headers.get("stripe-signature"), webhook_secret)
+    except stripe.error.SignatureVerificationError:
+        print("❌ Invalid Stripe signature")
+        return _text("Invalid signature", 400)
+    except Exception as e:
+        print(f"❌ Error verifying webhook: {e}")
+        return _text("Webhook error", 400)
+
+    event_type = event['type']
+    print(f"⚡ Received Stripe event: {event_type}")
+
+    if event_type not in STRIPE_TAG_EVENTS:
+        print(f"ℹ️ Received unsupported event: {event_type} — no action taken")
+        return _text("", 200)
+
+    blocked = blocked_by("stripe")
+    if blocked:
+        return await _defer("stripe", event, f"Circuit open: {', '.join(blocked)}")
+
+    try:
+        async with admit_async("stripe"):
+            with request_deadline(), tracking_steps() as steps:
+                await process_stripe_event_async(event, api_key)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        return await _defer("stripe", event, str(e), steps)
+    except SyncFailed as e:
+        if e.permanent:
+            await asyncio.to_thread(dead_letter_event, "stripe", event, str(e), attempts=1, completed_steps=steps)
+            return _text("", 200)
+        return await _defer("stripe", event, str(e), steps)
+    except AdmissionRejected as e:
+        return _admission_rejected(e)
+    except Exception:
+        return _text("Error", 500)
+
+    return _text("", 200)
+
+NATIVE_ROUTES = {
+    "/memberful-webhook": memberful_webhook,
+    "/gbx-member-profile-webhook": gbx_member_profile_webhook,
+    "/stripe-webhook": stripe_webhook,
+}
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+async def _respond(send, status, headers, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _native(route, scope, receive, send):
+    body = await _read_body(receive)
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    try:
+        status, response_headers, content = await route(body, headers)
+    except Exception as e:
+        print(f"❌ Unhandled error in {scope['path']}: {e}")
+        status, response_headers, content = _text("Internal Server Error", 500)
+    await _respond(send, status, response_headers, content)
+
+# 🌉 WSGI bridge — the Flask app runs on _wsgi_pool (or _long_running_pool) threads, one response chunk at a time
+class _RequestBody(io.RawIOBase):
+    """wsgi.input that pulls the ASGI request body from the event loop as the Flask app reads it.
+
+    Only the message being read is held, so a large upload (a GBX bulk import) streams
+    through to the parser instead of being collected first.
+    """
+
+    def __init__(self, receive, loop, first, on_complete):
+        super().__init__()
+        self._receive = receive
+        self._loop = loop
+        self._on_complete = on_complete  # on_complete(client_gone), called on the event loop
+        self._chunk = b""
+        self._more = True
+        self._take(first)
+
+    def _take(self, message):
+        if message["type"] == "http.disconnect":
+            self._more = False
+            self._loop.call_soon_threadsafe(self._on_complete, True)
+            raise OSError("Client disconnected before sending the whole request body")
+        self._chunk = message.get("body", b"")
+        if not message.get("more_body"):
+            self._more = False
+            self._loop.call_soon_threadsafe(self._on_complete, False)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more:
+            self._take(asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result())
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+def _environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # The body stream ends where the request does, chunked or not
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def _bridge(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    pool = _long_running_pool if scope["path"] in LONG_RUNNING_PATHS else _wsgi_pool
+    first_message = await receive()
+    if first_message["type"] == "http.disconnect":
+        return
+
+    # Watch for the client going away, so a long-lived response (the log stream) is closed.
+    # The watcher only starts once the body has been read — until then the reader owns receive().
+    disconnected = asyncio.Event()
+    watcher = None
+
+    async def _watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    def _body_complete(client_gone):
+        nonlocal watcher
+        if client_gone:
+            disconnected.set()
+        else:
+            watcher = asyncio.ensure_future(_watch())
+
+    body = io.BufferedReader(_RequestBody(receive, loop, first_message, _body_complete))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+        return lambda data: None
+
+    iterable = await loop.run_in_executor(pool, flask_app, _environ(scope, body), start_response)
+    chunks = iter(iterable)
+    try:
+        first = await loop.run_in_executor(pool, next, chunks, None)
+        await send({
+            "type": "http.response.start",
+            "status": started["status"],
+            "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in started["headers"]]
+        })
+        chunk = first
+        while chunk is not None and not disconnected.is_set():
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await loop.run_in_executor(pool, next, chunks, None)
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        if watcher:
+            watcher.cancel()
+        close = getattr(iterable, "close", None)
+        if close:
+            await loop.run_in_executor(pool, close)
+
+# 🚀 Startup / shutdown
+async def _startup():
+    start_drain_thread()
+    if WARMUP_ON_BOOT:
+        from warmup import warm_up
+        await asyncio.to_thread(warm_up)
+        try:
+            # Open a pooled connection on this event loop's client too
+            await mailchimp_request_async("GET", f"{MAILCHIMP_BASE_URL}/ping", timeout=5)
+        except Exception as e:
+            print(f"⚠️ Async Mailchimp warm-up failed: {e}")
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await _startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_client()
+            _wsgi_pool.shutdown(wait=False)
+            _long_running_pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    route = NATIVE_ROUTES.get(scope["path"]) if scope["method"] == "POST" else None
+    if route:
+        await _native(route, scope, receive, send)
+    else:
+        await _bridge(scope, receive, send)
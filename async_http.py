@@ -0,0 +1,34 @@
+# async_http.py
+#
+# The pooled HTTP client behind the asyncio path (asgi.py). Mailchimp, Stripe and Spaces
+# share one httpx.AsyncClient per event loop, so a burst of webhooks reuses a bounded set of
+# keep-alive TLS connections instead of opening one per call. httpx is imported on first use
+# so gunicorn workers that never run the asyncio path don't pay for it.
+
+import asyncio
+from config import ASYNC_MAX_CONNECTIONS, MAILCHIMP_TIMEOUT_SECONDS, SPACES_CONNECT_TIMEOUT_SECONDS
+
+_clients = {}  # event loop → httpx.AsyncClient
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        import httpx
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(MAILCHIMP_TIMEOUT_SECONDS, connect=SPACES_CONNECT_TIMEOUT_SECONDS)
+        )
+        _clients[loop] = client
+    return client
+
+async def close_async_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def is_unhealthy(response):
+    return response.status_code >= 500 or response.status_code == 429
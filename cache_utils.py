@@ -1,19 +1,39 @@
 # cache_utils.py
 
-from config import CACHE_FILE
-from storage_utils import load_json, save_json
+from storage_backend import get_backend
 
 def load_cache():
-    return load_json(CACHE_FILE)
+    return get_backend().load_cache()
+
+def cache_shards():
+    return get_backend().cache_shards()
+
+def load_cache_shard(shard):
+    return get_backend().load_cache_shard(shard)
 
 def save_cache(cache):
-    save_json(CACHE_FILE, cache)
+    get_backend().replace_cache(cache)
 
 def get_cached_email(member_id):
-    cache = load_cache()
-    return cache.get(str(member_id))
+    return get_backend().get_cached_email(member_id)
 
 def update_cache(member_id, email):
-    cache = load_cache()
-    cache[str(member_id)] = email
-    save_cache(cache)
+    get_backend().set_cached_email(member_id, email)
+
+def remove_from_cache(member_id):
+    get_backend().delete_cached_email(member_id)
+
+async def get_cached_email_async(member_id):
+    return await get_backend().get_cached_email_async(member_id)
+
+async def update_cache_async(member_id, email):
+    await get_backend().set_cached_email_async(member_id, email)
+
+async def remove_from_cache_async(member_id):
+    await get_backend().delete_cached_email_async(member_id)
+
+def find_member_ids(email):
+    return get_backend().find_member_ids(email)
+
+def search_cache(query="", match="substring", offset=0, limit=100):
+    return get_backend().search_cache(query, match, offset, limit)
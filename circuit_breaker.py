@@ -0,0 +1,164 @@
+# circuit_breaker.py
+#
+# Per-dependency circuit breakers (Mailchimp, Stripe, Spaces) and a per-request
+# deadline budget. When a dependency keeps failing its circuit opens and calls fail
+# fast with CircuitOpenError, so webhooks get deferred instead of hanging on it.
+
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, REQUEST_DEADLINE_SECONDS
+from metrics_utils import incr
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit is open (retry in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+class DeadlineExceeded(Exception):
+    pass
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; lets one trial call through after `reset_seconds`"""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def _retry_in(self):
+        return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def _current_state(self):
+        if self._state == OPEN and self._retry_in() == 0:
+            self._state = HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._current_state() == OPEN
+
+    def before_call(self):
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._trial_in_flight):
+                incr(f"circuit.{self.name}.rejected")
+                raise CircuitOpenError(self.name, self._retry_in() if state == OPEN else self.reset_seconds)
+            if state == HALF_OPEN:
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print(f"✅ {self.name} circuit closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    print(f"🚨 {self.name} circuit opened after {self._failures} failures")
+                    incr(f"circuit.{self.name}.opened")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def call(self, fn, *args, is_failure=None, ignore=None, **kwargs):
+        """Run fn through the breaker.
+
+        `is_failure(result)` flags bad results (e.g. HTTP 5xx) as failures;
+        `ignore(exc)` marks exceptions that say nothing about the dependency's health.
+        """
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if ignore and ignore(e):
+                self.record_success()
+            else:
+                self.record_failure()
+            raise
+        if is_failure and is_failure(result):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    async def acall(self, fn, *args, is_failure=None, ignore=None, **kwargs):
+        """call() for a coroutine function"""
+        self.before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Says nothing either way — just don't leave a half-open trial slot taken
+            with self._lock:
+                self._trial_in_flight = False
+            raise
+        except Exception as e:
+            if ignore and ignore(e):
+                self.record_success()
+            else:
+                self.record_failure()
+            raise
+        if is_failure and is_failure(result):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    def status(self):
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "retry_in_seconds": round(self._retry_in(), 1) if state == OPEN else 0,
+            }
+
+BREAKERS = {name: CircuitBreaker(name) for name in ("mailchimp", "stripe", "spaces")}
+
+def get_breaker(name):
+    return BREAKERS[name]
+
+def breaker_states():
+    return {name: breaker.status() for name, breaker in BREAKERS.items()}
+
+def open_circuits(names):
+    return [name for name in names if BREAKERS[name].is_open]
+
+# ⏳ Per-request deadline budget (a ContextVar, so it follows work onto pool threads)
+_deadline = ContextVar("request_deadline", default=None)
+
+@contextmanager
+def request_deadline(seconds=REQUEST_DEADLINE_SECONDS):
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def deadline_timeout(default):
+    """Timeout for the next remote call: `default`, capped by what's left of the request budget"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        incr("deadline.exceeded")
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(default, remaining)
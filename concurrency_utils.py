@@ -0,0 +1,77 @@
+# concurrency_utils.py
+
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from config import SYNC_POOL_SIZE
+
+_executor = ThreadPoolExecutor(max_workers=SYNC_POOL_SIZE, thread_name_prefix="chimplink-sync")
+_pool_thread = threading.local()
+
+def _mark_pool_thread(fn):
+    # Carry the caller's context (e.g. the request deadline) onto the pool thread
+    context = contextvars.copy_context()
+
+    def run():
+        _pool_thread.active = True
+        return context.run(fn)
+    return run
+
+def run_concurrently(*calls):
+    """Run zero-arg callables at once and return their results in order.
+
+    The first call runs on the calling thread, the rest on the shared pool. Calls made
+    from inside a pool thread run inline so nested fan-outs can't starve the pool.
+    Exceptions propagate once every call has finished.
+    """
+    if len(calls) < 2 or getattr(_pool_thread, "active", False):
+        return [call() for call in calls]
+
+    futures = [_executor.submit(_mark_pool_thread(call)) for call in calls[1:]]
+    first_error = None
+    results = []
+    try:
+        results.append(calls[0]())
+    except Exception as e:
+        first_error = e
+        results.append(None)
+
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            first_error = first_error or e
+            results.append(None)
+
+    if first_error:
+        raise first_error
+    return results
+
+def map_concurrently(fn, items, max_in_flight=SYNC_POOL_SIZE):
+    """Yield fn(item) for each item, in order, with at most `max_in_flight` calls running.
+
+    `items` is consumed lazily, so this is safe to use on an unbounded stream.
+    """
+    if getattr(_pool_thread, "active", False):
+        for item in items:
+            yield fn(item)
+        return
+
+    pending = deque()
+    for item in items:
+        pending.append(_executor.submit(_mark_pool_thread(partial(fn, item))))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+async def gather_all(*awaitables):
+    """run_concurrently for coroutines: await them at once, results in order, first error raised after all finish"""
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
@@ -9,6 +9,10 @@ load_dotenv()
 MAILCHIMP_API_KEY = os.environ.get("MAILCHIMP_API_KEY")
 MAILCHIMP_LIST_ID = os.environ.get("MAILCHIMP_LIST_ID")
 MAILCHIMP_SERVER_PREFIX = os.environ.get("MAILCHIMP_SERVER_PREFIX")  # e.g., 'us10'
+# Audiences every sync fans out to (comma-separated list IDs); defaults to MAILCHIMP_LIST_ID alone
+MAILCHIMP_AUDIENCES = [
+    list_id.strip() for list_id in os.environ.get("MAILCHIMP_AUDIENCES", "").split(",") if list_id.strip()
+] or [MAILCHIMP_LIST_ID]
 MEMBERFUL_WEBHOOK_SECRET = os.environ.get("MEMBERFUL_WEBHOOK_SECRET")
 
 LOG_FILE = "webhook_logs.json"
@@ -16,3 +20,69 @@ CACHE_FILE = "member_email_cache.json"
 
 APP_ENV = os.environ.get("APP_ENV", "local")
 IS_PRODUCTION = APP_ENV == "production"
+
+# 🗄️ Storage backend: "json" (JSON blobs, Spaces in production) or "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "chimplink.db")
+STORAGE_SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get("STORAGE_SNAPSHOT_INTERVAL_SECONDS", "300" if IS_PRODUCTION else "0"))
+EMAIL_INDEX_TTL_SECONDS = int(os.environ.get("EMAIL_INDEX_TTL_SECONDS", "30"))
+# Member ID → email cache is split into this many shard objects (0 = the original single file)
+EMAIL_CACHE_SHARDS = int(os.environ.get("EMAIL_CACHE_SHARDS", "16"))
+
+# 🧵 Bounded thread pool for fanning out independent upstream calls
+SYNC_POOL_SIZE = int(os.environ.get("SYNC_POOL_SIZE", "8"))
+GBX_BULK_MAX_IN_FLIGHT = int(os.environ.get("GBX_BULK_MAX_IN_FLIGHT", "8"))
+MAILCHIMP_POOL_SIZE = int(os.environ.get("MAILCHIMP_POOL_SIZE", "20"))
+# Drift audit: contacts per members page (Mailchimp max 1000) and pages fetched at once
+AUDIT_PAGE_SIZE = int(os.environ.get("AUDIT_PAGE_SIZE", "1000"))
+AUDIT_MAX_IN_FLIGHT = int(os.environ.get("AUDIT_MAX_IN_FLIGHT", "4"))
+# ...and a cap on the email cache / sync state shards it keeps loaded (0 = all of them)
+AUDIT_CACHED_SHARDS = int(os.environ.get("AUDIT_CACHED_SHARDS", "0"))
+
+# ⚡ asyncio path (asgi.py)
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", "100"))
+ASYNC_ADMISSION_SCALE = int(os.environ.get("ASYNC_ADMISSION_SCALE", "100"))
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "16"))
+
+# 🚀 Startup
+WARMUP_ON_BOOT = os.environ.get("WARMUP_ON_BOOT", "true").lower() == "true"
+IMPORT_TIME_BUDGET_SECONDS = float(os.environ.get("IMPORT_TIME_BUDGET_SECONDS", "1.0"))
+
+# 🛡️ Circuit breakers + deadlines
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "25"))
+MAILCHIMP_TIMEOUT_SECONDS = float(os.environ.get("MAILCHIMP_TIMEOUT_SECONDS", "10"))
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get("STRIPE_TIMEOUT_SECONDS", "10"))
+SPACES_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("SPACES_CONNECT_TIMEOUT_SECONDS", "3"))
+SPACES_READ_TIMEOUT_SECONDS = float(os.environ.get("SPACES_READ_TIMEOUT_SECONDS", "10"))
+DEFERRED_DRAIN_INTERVAL_SECONDS = float(os.environ.get("DEFERRED_DRAIN_INTERVAL_SECONDS", "15"))
+
+# 📡 Live log stream (admin UI Server-Sent Events)
+LOG_STREAM_BUFFER = int(os.environ.get("LOG_STREAM_BUFFER", "500"))
+LOG_STREAM_POLL_SECONDS = float(os.environ.get("LOG_STREAM_POLL_SECONDS", "2"))
+LOG_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("LOG_STREAM_HEARTBEAT_SECONDS", "15"))
+LOG_STREAM_MAX_SECONDS = float(os.environ.get("LOG_STREAM_MAX_SECONDS", "300"))
+LOG_STREAM_MAX_CLIENTS = int(os.environ.get("LOG_STREAM_MAX_CLIENTS", "4"))
+
+# 🚦 Webhook admission control (per worker)
+WEBHOOK_MAX_IN_FLIGHT = int(os.environ.get("WEBHOOK_MAX_IN_FLIGHT", "6"))
+WEBHOOK_PRIORITY_RESERVED_SLOTS = int(os.environ.get("WEBHOOK_PRIORITY_RESERVED_SLOTS", "2"))
+MEMBERFUL_MAX_IN_FLIGHT = int(os.environ.get("MEMBERFUL_MAX_IN_FLIGHT", "4"))
+STRIPE_MAX_IN_FLIGHT = int(os.environ.get("STRIPE_MAX_IN_FLIGHT", "6"))
+GBX_MAX_IN_FLIGHT = int(os.environ.get("GBX_MAX_IN_FLIGHT", "2"))
+GBX_BULK_MAX_IMPORTS = int(os.environ.get("GBX_BULK_MAX_IMPORTS", "1"))
+ADMISSION_QUEUE_SECONDS = float(os.environ.get("ADMISSION_QUEUE_SECONDS", "2"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "10"))
+
+# 💳 Stripe payment events for one payment are collapsed into one tag update
+STRIPE_CORRELATION_WINDOW_SECONDS = float(os.environ.get("STRIPE_CORRELATION_WINDOW_SECONDS", "600"))
+PAYMENT_STATE_TTL_SECONDS = float(os.environ.get("PAYMENT_STATE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# 🔁 Retry store
+RETRY_BASE_SECONDS = float(os.environ.get("RETRY_BASE_SECONDS", "60"))
+RETRY_MAX_BACKOFF_SECONDS = float(os.environ.get("RETRY_MAX_BACKOFF_SECONDS", "3600"))
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "8"))
+RETRY_LEASE_SECONDS = float(os.environ.get("RETRY_LEASE_SECONDS", "300"))
+# Local directory events are parked in before they reach the shared store in Spaces
+RETRY_OUTBOX_DIR = os.environ.get("RETRY_OUTBOX_DIR", "retry_outbox")
@@ -0,0 +1,343 @@
+# deferred_utils.py
+#
+# Persistent retry store. Webhooks that arrive while a dependency's circuit is open,
+# and Mailchimp syncs that failed, are parked here with an attempt count and a
+# next-attempt time. A background thread retries them with exponential backoff and
+# jitter; entries that keep failing move to a dead-letter list shown in the admin UI.
+#
+# In production the store is shared through Spaces, which may be the very thing that's down
+# when an event has to be parked. New entries are written to an outbox on this host's disk
+# and moved into Spaces by the drain thread once it's reachable. Each entry also records the
+# once-only steps (e.g. writing the success log entry) that already ran, so a replay skips them.
+
+import os
+import time
+import uuid
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from config import (
+    DEFERRED_DRAIN_INTERVAL_SECONDS,
+    RETRY_BASE_SECONDS,
+    RETRY_MAX_BACKOFF_SECONDS,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_LEASE_SECONDS,
+    RETRY_OUTBOX_DIR,
+)
+from storage_utils import load_json, update_json, USE_SPACES
+from circuit_breaker import open_circuits, request_deadline, CircuitOpenError, DeadlineExceeded
+from metrics_utils import incr, set_gauge
+
+DEFERRED_FILE = "deferred_events.json"
+DEAD_LETTER_FILE = "dead_letter_events.json"
+
+# Which circuits each event source needs closed before it can be processed
+DEPENDENCIES = {
+    "memberful": ("mailchimp", "spaces"),
+    "stripe": ("stripe", "mailchimp", "spaces"),
+    "gbx": ("mailchimp", "spaces"),
+    "gbx_bulk": ("mailchimp", "spaces"),
+    "mailchimp_sync": ("mailchimp", "spaces"),
+}
+
+_processors = {}
+_dead_letter_hooks = {}
+_drain_thread_pid = None
+_drain_thread_lock = threading.Lock()
+# Steps of the event being processed that have completed (see tracking_steps)
+_completed_steps = contextvars.ContextVar("completed_steps", default=None)
+
+def register_processor(source, fn, on_dead_letter=None):
+    """fn(payload) processes one event from `source` and raises if it needs retrying.
+
+    on_dead_letter(payload), if given, runs once an event from `source` is dead-lettered.
+    """
+    _processors[source] = fn
+    if on_dead_letter:
+        _dead_letter_hooks[source] = on_dead_letter
+
+# 🪜 Once-only steps
+@contextmanager
+def tracking_steps(completed=()):
+    """Record which steps of an event complete; yields the set, to store with the event if it's deferred"""
+    token = _completed_steps.set(set(completed))
+    try:
+        yield _completed_steps.get()
+    finally:
+        _completed_steps.reset(token)
+
+def _already_done(step):
+    done = _completed_steps.get()
+    if done is not None and step in done:
+        print(f"⏭️ Skipping {step} — it completed in an earlier attempt")
+        return True
+    return False
+
+def _mark_done(step):
+    done = _completed_steps.get()
+    if done is not None:
+        done.add(step)
+
+def once(step, fn, *args, **kwargs):
+    """fn(*args, **kwargs) unless `step` completed in an earlier attempt at this event"""
+    if _already_done(step):
+        return None
+    result = fn(*args, **kwargs)
+    _mark_done(step)
+    return result
+
+async def once_async(step, fn, *args, **kwargs):
+    if _already_done(step):
+        return None
+    result = await fn(*args, **kwargs)
+    _mark_done(step)
+    return result
+
+def blocked_by(source):
+    return open_circuits(DEPENDENCIES[source])
+
+def retry_delay(attempts):
+    """Seconds to wait after `attempts` failures: doubling from RETRY_BASE_SECONDS, capped, with jitter"""
+    if attempts <= 0:
+        return 0.0
+    delay = min(RETRY_MAX_BACKOFF_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+def _make_entry(source, payload, reason, attempts=0, completed_steps=()):
+    entry = {
+        "id": uuid.uuid4().hex,
+        "source": source,
+        "payload": payload,
+        "reason": reason,
+        "attempts": attempts,
+        "deferred_at": datetime.utcnow().isoformat() + "Z",
+        "next_attempt_at": time.time() + retry_delay(attempts),
+    }
+    if completed_steps:
+        entry["completed_steps"] = sorted(completed_steps)
+    return entry
+
+def _as_list(events):
+    return events if isinstance(events, list) else []
+
+def _outbox(filename):
+    return os.path.join(RETRY_OUTBOX_DIR, filename)
+
+def _append_to(filename, entries):
+    def _add(events):
+        return _as_list(events) + entries
+    if USE_SPACES:
+        # Parked on this host's disk; flush_outbox moves them to the shared store
+        return update_json(_outbox(filename), _add, default=list, local=True) is not None
+    return update_json(filename, _add, default=list) is not None
+
+def defer_event(source, payload, reason, attempts=0, completed_steps=()):
+    """Park an event for later; returns False if it couldn't be stored (caller should ask for a retry).
+
+    `attempts` is how many times it has already failed — 0 means retry as soon as its circuits are closed.
+    `completed_steps` (from tracking_steps) are skipped when it's replayed.
+    """
+    entry = _make_entry(source, payload, reason, attempts, completed_steps)
+    try:
+        stored = _append_to(DEFERRED_FILE, [entry])
+    except Exception as e:
+        print(f"❌ Could not defer {source} event: {e}")
+        stored = False
+
+    if stored:
+        print(f"⏸️ Deferred {source} event: {reason}")
+        incr(f"deferred.{source}")
+    return stored
+
+def dead_letter_event(source, payload, reason, attempts=0, completed_steps=()):
+    entry = _make_entry(source, payload, reason, attempts, completed_steps)
+    del entry["next_attempt_at"]
+    entry["dead_at"] = entry["deferred_at"]
+    try:
+        stored = _append_to(DEAD_LETTER_FILE, [entry])
+    except Exception as e:
+        print(f"❌ Could not dead-letter {source} event: {e}")
+        stored = False
+
+    if stored:
+        print(f"☠️ Dead-lettered {source} event after {attempts} attempts: {reason}")
+        incr(f"dead_letter.{source}")
+        if source in _dead_letter_hooks:
+            try:
+                _dead_letter_hooks[source](payload)
+            except Exception as e:
+                print(f"⚠️ Dead-letter hook for {source} event failed: {e}")
+    return stored
+
+def _load_events(filename):
+    events = _as_list(load_json(filename))
+    if USE_SPACES:
+        # Include entries still waiting in this host's outbox
+        known = {event.get("id") for event in events}
+        events += [event for event in _as_list(load_json(_outbox(filename), local=True)) if event.get("id") not in known]
+    return events
+
+def load_deferred_events():
+    return _load_events(DEFERRED_FILE)
+
+def load_dead_letters():
+    return _load_events(DEAD_LETTER_FILE)
+
+def flush_outbox():
+    """Move entries parked on this host's disk into the shared store; returns how many moved"""
+    if not USE_SPACES or open_circuits(("spaces",)):
+        return 0
+
+    moved = 0
+    for filename in (DEFERRED_FILE, DEAD_LETTER_FILE):
+        pending = _as_list(load_json(_outbox(filename), local=True))
+        if not pending:
+            continue
+        ids = {event["id"] for event in pending}
+
+        def _merge(events):
+            # Keyed by id, so a flush that's retried after a crash doesn't duplicate anything
+            events = _as_list(events)
+            known = {event.get("id") for event in events}
+            return events + [event for event in pending if event["id"] not in known]
+
+        def _remove(events):
+            return [event for event in _as_list(events) if event.get("id") not in ids]
+
+        if update_json(filename, _merge, default=list) is None:
+            continue
+        update_json(_outbox(filename), _remove, default=list, local=True)
+        moved += len(pending)
+        print(f"📤 Moved {len(pending)} parked entries into {filename}")
+    return moved
+
+def _claim_ready_events(limit):
+    # Lease up to `limit` due events whose circuits are closed, in one compare-and-swap write.
+    # A leased event stays in the store, so it comes back if this worker dies mid-retry.
+    now = time.time()
+    claimed = []
+
+    def _lease(events):
+        claimed.clear()
+        events = _as_list(events)
+        for event in events:
+            if (
+                len(claimed) < limit
+                and event.get("source") in _processors
+                and event.get("next_attempt_at", 0) <= now
+                and not blocked_by(event["source"])
+            ):
+                event["next_attempt_at"] = now + RETRY_LEASE_SECONDS
+                claimed.append(dict(event))
+        return events
+
+    if update_json(DEFERRED_FILE, _lease, default=list) is None:
+        return []
+    return list(claimed)
+
+def _settle(event_id, changes=None):
+    """Remove a leased event (changes=None) or update it in place"""
+    def _apply(events):
+        settled = []
+        for event in _as_list(events):
+            if event.get("id") == event_id:
+                if changes is None:
+                    continue
+                event = {**event, **changes}
+            settled.append(event)
+        return settled
+    update_json(DEFERRED_FILE, _apply, default=list)
+
+def drain_deferred_events(limit=50):
+    """Retry due events whose dependencies are healthy; returns how many were attempted"""
+    events = _claim_ready_events(limit)
+    for event in events:
+        source = event["source"]
+        try:
+            with request_deadline(), tracking_steps(event.get("completed_steps", ())) as done:
+                _processors[source](event["payload"])
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            # The dependency is the problem, not the event — don't count it against the event
+            print(f"⏸️ Deferred {source} event {event['id']} still blocked: {e}")
+            _settle(event["id"], {"reason": str(e), "next_attempt_at": time.time(), "completed_steps": sorted(done)})
+            continue
+        except Exception as e:
+            attempts = event.get("attempts", 0) + 1
+            print(f"⚠️ Retry {attempts} of {source} event {event['id']} failed: {e}")
+            incr(f"retry.failed.{source}")
+            # Processors flag failures that can't succeed on retry (e.g. a Mailchimp 400) as permanent
+            if attempts >= RETRY_MAX_ATTEMPTS or getattr(e, "permanent", False):
+                if dead_letter_event(source, event["payload"], str(e), attempts, done):
+                    _settle(event["id"])
+            else:
+                _settle(event["id"], {
+                    "attempts": attempts,
+                    "reason": str(e),
+                    "next_attempt_at": time.time() + retry_delay(attempts),
+                    "completed_steps": sorted(done),
+                })
+            continue
+
+        _settle(event["id"])
+        print(f"▶️ Replayed deferred {source} event {event['id']}")
+        incr(f"deferred.replayed.{source}")
+    return len(events)
+
+# ☠️ Dead letters
+def requeue_dead_letters(ids=None):
+    """Move dead letters (all, or those in `ids`) back into the retry store with a fresh attempt count"""
+    selected = [event for event in load_dead_letters() if ids is None or event.get("id") in ids]
+    if not selected:
+        return 0
+
+    # Queue first, then remove: a failure in between duplicates a retry rather than losing it
+    fresh = [
+        _make_entry(event["source"], event["payload"], "Requeued from dead letters", completed_steps=event.get("completed_steps", ()))
+        for event in selected
+    ]
+    if not _append_to(DEFERRED_FILE, fresh):
+        raise RuntimeError("Could not requeue dead letters")
+    discard_dead_letters({event["id"] for event in selected})
+    print(f"🔁 Requeued {len(selected)} dead-lettered events")
+    return len(selected)
+
+def discard_dead_letters(ids):
+    removed = set()
+
+    def _remove(events):
+        kept = []
+        for event in _as_list(events):
+            if event.get("id") in ids:
+                removed.add(event.get("id"))
+            else:
+                kept.append(event)
+        return kept
+
+    if update_json(DEAD_LETTER_FILE, _remove, default=list) is None:
+        raise RuntimeError("Could not update dead letters")
+    if USE_SPACES and update_json(_outbox(DEAD_LETTER_FILE), _remove, default=list, local=True) is None:
+        raise RuntimeError("Could not update parked dead letters")
+    return len(removed)
+
+def _drain_loop():
+    while True:
+        time.sleep(DEFERRED_DRAIN_INTERVAL_SECONDS)
+        try:
+            flush_outbox()
+            drain_deferred_events()
+            set_gauge("deferred.pending", len(load_deferred_events()))
+            set_gauge("retry.dead_letter", len(load_dead_letters()))
+        except Exception as e:
+            print(f"⚠️ Deferred event drain failed: {e}")
+
+def start_drain_thread():
+    """Start the drain loop once per process (safe to call on every request; survives gunicorn forks)"""
+    global _drain_thread_pid
+    if _drain_thread_pid == os.getpid():
+        return
+    with _drain_thread_lock:
+        if _drain_thread_pid != os.getpid():
+            threading.Thread(target=_drain_loop, daemon=True, name="deferred-drain").start()
+            _drain_thread_pid = os.getpid()
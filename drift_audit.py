@@ -0,0 +1,223 @@
+# drift_audit.py
+#
+# Audit Mailchimp audiences against what ChimpLink last synced.
+#
+#   python drift_audit.py [--audience LIST_ID] [--report drift.ndjson] [--repair repair.json] [--apply]
+#
+# Pages through GET /lists/{id}/members with a trimmed fields= projection, several pages in
+# flight at once, and checks each contact against the email cache and the last-sent merge
+# fields (sync_state.py) as pages arrive. Both are looked up by shard and each shard is read
+# once per audience. Every page touches nearly every shard, so by default all of them stay
+# loaded; AUDIT_CACHED_SHARDS caps that for a cache too large to hold, at the cost of re-reads.
+# Drift is streamed to an NDJSON report; --repair writes a Mailchimp batch of upserts that
+# puts each drifted contact back, and --apply submits that batch to /batches.
+
+import sys
+import json
+import argparse
+from collections import Counter, OrderedDict
+from config import MAILCHIMP_AUDIENCES, AUDIT_PAGE_SIZE, AUDIT_MAX_IN_FLIGHT, AUDIT_CACHED_SHARDS
+from cache_utils import cache_shards, load_cache_shard
+from merge_utils import get_compiled_merge_maps, DELETED_MEMBER_ID
+from storage_backend import shard_for
+from sync_state import load_sync_state_shard, SYNC_STATE_SHARDS
+from concurrency_utils import map_concurrently
+from mailchimp_client import mailchimp_request, contact_hash, MAILCHIMP_BASE_URL
+
+MEMBER_FIELDS = "total_items,members.email_address,members.status,members.merge_fields"
+PAGE_TIMEOUT_SECONDS = 60
+
+def _fetch_page(list_id, offset, count):
+    response = mailchimp_request(
+        "GET",
+        f"{MAILCHIMP_BASE_URL}/lists/{list_id}/members",
+        params={"count": count, "offset": offset, "fields": MEMBER_FIELDS},
+        timeout=PAGE_TIMEOUT_SECONDS
+    )
+    response.raise_for_status()
+    return response.json()
+
+def iter_pages(list_id, page_size=AUDIT_PAGE_SIZE, max_in_flight=AUDIT_MAX_IN_FLIGHT):
+    """Yield the audience one page of contacts at a time; pages after the first are fetched concurrently.
+
+    Offset paging isn't a snapshot — contacts added or removed mid-audit can shift a page.
+    """
+    first = _fetch_page(list_id, 0, page_size)
+    yield first.get("members", [])
+
+    offsets = range(page_size, first.get("total_items", 0), page_size)
+    for page in map_concurrently(lambda offset: _fetch_page(list_id, offset, page_size), offsets, max_in_flight):
+        yield page.get("members", [])
+
+class ShardCache:
+    """Shards of a sharded store, loaded with load(shard) on first use.
+
+    Holds every shard unless `capacity` is set, then only the most recently used ones.
+    """
+
+    def __init__(self, shards, load, capacity=AUDIT_CACHED_SHARDS):
+        self.shards = shards
+        self._load = load
+        self._capacity = capacity or shards
+        self._held = OrderedDict()
+
+    def shard_of(self, member_id):
+        return shard_for(member_id, self.shards)
+
+    def shard(self, shard):
+        if shard in self._held:
+            self._held.move_to_end(shard)
+        else:
+            self._held[shard] = self._load(shard)
+            if len(self._held) > self._capacity:
+                self._held.popitem(last=False)
+        return self._held[shard]
+
+    def get(self, member_id):
+        return self.shard(self.shard_of(member_id)).get(member_id)
+
+def _member_id(contact, member_id_tag):
+    member_id = (contact.get("merge_fields") or {}).get(member_id_tag)
+    return "" if member_id is None else str(member_id)
+
+def _same(expected, actual):
+    # Mailchimp hands numbers and blanks back in its own shape; compare as trimmed text
+    def _text(value):
+        return "" if value is None else str(value).strip()
+    return _text(expected) == _text(actual)
+
+def repair_operation(list_id, member_id, mailchimp_email, email, state):
+    """One /batches operation that upserts the contact back to our email and last-sent merge fields"""
+    body = {"email_address": email, "status_if_new": "subscribed"}
+    if state:
+        body["merge_fields"] = state["merge_fields"]
+    return {
+        "method": "PUT",
+        "path": f"/lists/{list_id}/members/{contact_hash(mailchimp_email or email)}",
+        "operation_id": f"{list_id}:{member_id}",
+        "body": json.dumps(body)
+    }
+
+def audit_audience(list_id, emit, emit_repair=None):
+    """Compare one audience with local state, calling emit(drift) per finding; returns counts"""
+    member_id_tag = get_compiled_merge_maps([list_id])[list_id].member_id_tag
+    cache = ShardCache(cache_shards(), load_cache_shard)
+    state = ShardCache(SYNC_STATE_SHARDS, lambda shard: load_sync_state_shard(shard, list_id))
+    seen = set()
+    counts = Counter()
+
+    for page in iter_pages(list_id):
+        # Grouped by shard, so a page loads each email cache shard it touches once
+        for contact in sorted(page, key=lambda contact: cache.shard_of(_member_id(contact, member_id_tag))):
+            counts["contacts"] += 1
+            member_id = _member_id(contact, member_id_tag)
+            if member_id == DELETED_MEMBER_ID:
+                counts["deleted"] += 1
+                continue
+            email = cache.get(member_id)
+            if email is None:
+                # GBX-only contacts, manual signups, members we haven't seen a webhook for
+                counts["untracked"] += 1
+                continue
+
+            seen.add(member_id)
+            counts["checked"] += 1
+            merge_fields = contact.get("merge_fields") or {}
+            mailchimp_email = contact.get("email_address") or ""
+            drift = {}
+            if mailchimp_email.lower() != email.lower():
+                drift["email"] = {"expected": email, "actual": mailchimp_email}
+            sent = state.get(member_id)
+            if sent:
+                fields = {
+                    tag: {"expected": value, "actual": merge_fields.get(tag)}
+                    for tag, value in sent["merge_fields"].items()
+                    if not _same(value, merge_fields.get(tag))
+                }
+                if fields:
+                    drift["merge_fields"] = fields
+            if not drift:
+                continue
+
+            counts["drifted"] += 1
+            emit({"type": "drift", "audience": list_id, "member_id": member_id, "status": contact.get("status"), **drift})
+            if emit_repair:
+                emit_repair(repair_operation(list_id, member_id, mailchimp_email, email, sent))
+
+    # Members we know about that no contact in the audience carries the ID of, one cache shard at a time
+    for shard in range(cache.shards):
+        for member_id, email in cache.shard(shard).items():
+            if member_id in seen:
+                continue
+            counts["missing"] += 1
+            emit({"type": "missing", "audience": list_id, "member_id": member_id, "email": email})
+            sent = state.get(member_id) if emit_repair else None
+            if sent:
+                emit_repair(repair_operation(list_id, member_id, None, email, sent))
+
+    return dict(counts)
+
+def run_audit(audiences, report, repair=None):
+    """Audit each audience, writing drift as NDJSON to `report` and batch operations to `repair`"""
+    def emit(drift):
+        report.write(json.dumps(drift) + "\n")
+
+    emit_repair = None
+    operations = Counter()
+    if repair:
+        # Streamed out as {"operations": [...]} so a large batch never sits in memory
+        repair.write('{"operations": [\n')
+
+        def emit_repair(operation):
+            repair.write((",\n" if operations["total"] else "") + json.dumps(operation))
+            operations["total"] += 1
+
+    summary = {}
+    for list_id in audiences:
+        print(f"🔎 Auditing Mailchimp audience {list_id}")
+        summary[list_id] = audit_audience(list_id, emit, emit_repair)
+        print(f"📋 {list_id}: {json.dumps(summary[list_id])}")
+
+    if repair:
+        repair.write("\n]}\n")
+    return {"audiences": summary, "repair_operations": operations["total"]}
+
+def submit_repair_batch(path):
+    """POST a repair file to Mailchimp /batches; returns the batch ID to poll"""
+    with open(path, "rb") as f:
+        response = mailchimp_request(
+            "POST",
+            f"{MAILCHIMP_BASE_URL}/batches",
+            data=f,
+            headers={"Content-Type": "application/json"},
+            timeout=PAGE_TIMEOUT_SECONDS
+        )
+    response.raise_for_status()
+    return response.json().get("id")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Mailchimp audiences with ChimpLink's local state")
+    parser.add_argument("--audience", action="append", help="list ID to audit (repeatable; default: every configured audience)")
+    parser.add_argument("--report", help="write drift as NDJSON here (default: stdout)")
+    parser.add_argument("--repair", help="write a Mailchimp /batches body that repairs the drift here")
+    parser.add_argument("--apply", action="store_true", help="submit the repair batch to Mailchimp")
+    args = parser.parse_args()
+    if args.apply and not args.repair:
+        parser.error("--apply needs --repair")
+
+    report = open(args.report, "w") if args.report else sys.stdout
+    repair = open(args.repair, "w") if args.repair else None
+    try:
+        summary = run_audit(args.audience or MAILCHIMP_AUDIENCES, report, repair)
+    finally:
+        if args.report:
+            report.close()
+        if repair:
+            repair.close()
+
+    print(json.dumps(summary, indent=2))
+    if args.apply and summary["repair_operations"]:
+        print(f"🛠️ Submitted repair batch {submit_repair_batch(args.repair)}")
+    drifted = any(counts.get("drifted") or counts.get("missing") for counts in summary["audiences"].values())
+    sys.exit(2 if drifted else 0)
@@ -1,53 +1,310 @@
 # gbx_sync.py
 
-import hashlib
+import sys
+import codecs
 import json
-import requests
-from config import MAILCHIMP_API_KEY, MAILCHIMP_LIST_ID, MAILCHIMP_SERVER_PREFIX
-from log_utils import append_log_entry
-from storage_utils import load_merge_map
+from functools import partial
+from config import GBX_BULK_MAX_IN_FLIGHT
+from log_utils import append_log_entry, append_log_entry_async
+from merge_utils import get_compiled_merge_maps, get_compiled_merge_maps_async
+from concurrency_utils import map_concurrently, run_concurrently, gather_all
+from mailchimp_client import (
+    mailchimp_request, mailchimp_request_async, member_url, capture_failures, capture_failures_async,
+    succeeded, failure_result, audience_log_diff
+)
+from circuit_breaker import CircuitOpenError, DeadlineExceeded
+from deferred_utils import defer_event
 
-def sync_gbx_profile_to_mailchimp(payload):
-    try:
-        email = payload.get("email")
-        if not email:
-            raise ValueError("Missing email in GBX profile payload")
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_BYTES = 1024 * 1024
 
-        contact_hash = hashlib.md5(email.lower().encode()).hexdigest()
-        member_url = f"https://{MAILCHIMP_SERVER_PREFIX}.api.mailchimp.com/3.0/lists/{MAILCHIMP_LIST_ID}/members/{contact_hash}"
+def build_gbx_payload(profile, merge_map):
+    """Mailchimp upsert body for one GBX profile, given a compiled merge map"""
+    return {
+        "email_address": profile.get("email"),
+        "status_if_new": "subscribed",
+        "merge_fields": merge_map.gbx_merge_fields(profile)
+    }
 
-        # ⬇️ Load latest GBX mapping from storage
-        merge_map = load_merge_map()
-        gbx_map = merge_map.get("GBX_PROFILE_FIELDS", {})
+def _upsert_everywhere(email, mc_payloads):
+    """PUT each audience's payload at once; returns {list_id: result}"""
+    list_ids = list(mc_payloads)
+    responses = run_concurrently(*[
+        capture_failures(partial(mailchimp_request, "PUT", member_url(list_id, email), json=mc_payloads[list_id]))
+        for list_id in list_ids
+    ])
+    return _upsert_results(list_ids, responses)
 
-        merge_fields = {}
-        for key, merge_tag in gbx_map.items():
-            value = payload.get(key)
-            if value is not None:
-                merge_fields[merge_tag] = value
+async def _upsert_everywhere_async(email, mc_payloads):
+    list_ids = list(mc_payloads)
+    responses = await gather_all(*[
+        capture_failures_async(mailchimp_request_async("PUT", member_url(list_id, email), json=mc_payloads[list_id]))
+        for list_id in list_ids
+    ])
+    return _upsert_results(list_ids, responses)
 
-        mc_payload = {
-            "email_address": email,
-            "status_if_new": "subscribed",
-            "merge_fields": merge_fields
-        }
+def _upsert_results(list_ids, responses):
+    return {
+        list_id: {"status": "success"} if succeeded(response) else failure_result(response, "upsert")
+        for list_id, response in zip(list_ids, responses)
+    }
+
+def _profile_payloads(payload, merge_maps):
+    email = payload.get("email")
+    if not email:
+        raise ValueError("Missing email in GBX profile payload")
 
-        print("📬 Syncing GBX profile to Mailchimp:")
+    mc_payloads = {list_id: build_gbx_payload(payload, merge_map) for list_id, merge_map in merge_maps.items()}
+    for list_id, mc_payload in mc_payloads.items():
+        print(f"📬 Syncing GBX profile to Mailchimp audience {list_id}:")
         print(json.dumps(mc_payload, indent=2))
+    return email, mc_payloads
 
-        response = requests.put(
-            member_url,
-            auth=("anystring", MAILCHIMP_API_KEY),
-            json=mc_payload
-        )
+def _profile_status(email, results):
+    failed = [list_id for list_id, result in results.items() if result["status"] != "success"]
+    if not failed:
+        print(f"✅ GBX profile synced for {email}")
+        return "success"
+    for list_id in failed:
+        failure = results[list_id]
+        print(f"❌ Mailchimp error in {list_id}: {failure.get('mailchimp_error') or failure.get('error')}")
+    return "error"
 
-        if response.status_code in [200, 201]:
-            print(f"✅ GBX profile synced for {email}")
-            append_log_entry("gbx_profile_sync", email, "success", payload=payload)
-        else:
-            print(f"❌ Mailchimp error {response.status_code}: {response.text}")
-            append_log_entry("gbx_profile_sync", email, "error", payload=payload)
+def sync_gbx_profile_to_mailchimp(payload):
+    try:
+        # ⬇️ Load latest GBX mapping for every audience from storage
+        email, mc_payloads = _profile_payloads(payload, get_compiled_merge_maps())
+        results = _upsert_everywhere(email, mc_payloads)
+        append_log_entry(
+            "gbx_profile_sync", email, _profile_status(email, results), diff=audience_log_diff(results), payload=payload
+        )
 
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
         print(f"❌ Error syncing GBX profile: {e}")
         append_log_entry("gbx_profile_sync", payload.get("email", "unknown"), "exception", payload=payload)
+
+async def sync_gbx_profile_to_mailchimp_async(payload):
+    try:
+        email, mc_payloads = _profile_payloads(payload, await get_compiled_merge_maps_async())
+        results = await _upsert_everywhere_async(email, mc_payloads)
+        await append_log_entry_async(
+            "gbx_profile_sync", email, _profile_status(email, results), diff=audience_log_diff(results), payload=payload
+        )
+
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"❌ Error syncing GBX profile: {e}")
+        await append_log_entry_async("gbx_profile_sync", payload.get("email", "unknown"), "exception", payload=payload)
+
+# 📦 Bulk import
+class MalformedProfile:
+    """Stands in for a record iter_profiles couldn't parse, so it's reported in the summary"""
+
+    def __init__(self, error):
+        self.error = error
+
+def iter_profiles(stream, chunk_size=STREAM_CHUNK_SIZE, max_record_bytes=MAX_RECORD_BYTES):
+    """Incrementally parse profiles from a JSON array or NDJSON byte stream.
+
+    Only the profile currently being decoded is held in memory, so a full
+    GBX directory export can be streamed straight from the request body.
+    A record that can't be parsed is yielded as a MalformedProfile: NDJSON
+    resumes at the next line, while a broken JSON array stops there.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+    decode_error = None
+
+    def read_more():
+        nonlocal buffer, pos, eof, decode_error
+        chunk = stream.read(chunk_size)
+        try:
+            if not chunk:
+                eof = True
+                text = utf8.decode(b"", final=True)
+            else:
+                text = utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+        except UnicodeDecodeError as e:
+            # Treat it as the end of the body: everything before the bad byte is still imported
+            decode_error = f"Body is not valid UTF-8: {e}"
+            eof = True
+            text = e.object[:e.start].decode("utf-8")
+        # Drop what we've already consumed before growing the buffer
+        buffer = buffer[pos:] + text
+        pos = 0
+
+    def next_char():
+        """Skip whitespace; the next character, or None at the end of the stream"""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                return None
+            read_more()
+
+    def records():
+        nonlocal pos
+        first = next_char()
+        if first is None:
+            return
+
+        if first != "[":
+            # NDJSON: one profile per line
+            while True:
+                newline = buffer.find("\n", pos)
+                if newline < 0 and not eof:
+                    if len(buffer) - pos > max_record_bytes:
+                        yield MalformedProfile(f"Line longer than {max_record_bytes} bytes")
+                        return
+                    read_more()
+                    continue
+                end = len(buffer) if newline < 0 else newline
+                line = buffer[pos:end].strip()
+                pos = end + 1
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield MalformedProfile(str(e))
+                if newline < 0:
+                    return
+
+        # JSON array: values separated by commas, closed by "]"
+        pos += 1
+        if next_char() == "]":
+            pos += 1
+        else:
+            while True:
+                if next_char() is None:
+                    yield MalformedProfile("Unexpected end of the profiles array")
+                    return
+                while True:
+                    try:
+                        profile, pos = decoder.raw_decode(buffer, pos)
+                        break
+                    except json.JSONDecodeError as e:
+                        # Most likely the record runs past the buffer — read on, up to a limit
+                        if eof or len(buffer) - pos > max_record_bytes:
+                            yield MalformedProfile(str(e))
+                            return
+                        read_more()
+                yield profile
+
+                separator = next_char()
+                pos += 1
+                if separator == "]":
+                    break
+                if separator != ",":
+                    found = repr(separator) if separator else "the end of the body"
+                    yield MalformedProfile(f"Expected ',' or ']' after a record, found {found}")
+                    return
+
+        if next_char() is not None:
+            yield MalformedProfile("Unexpected data after the profiles array")
+
+    yield from records()
+    if decode_error:
+        yield MalformedProfile(decode_error)
+
+def _until_failure(profiles):
+    # A read error mid-stream ends the import with a failed record rather than losing the summary
+    try:
+        yield from profiles
+    except Exception as e:
+        yield MalformedProfile(f"Could not read the rest of the import: {e}")
+
+def sync_gbx_profiles_bulk(profiles, max_in_flight=GBX_BULK_MAX_IN_FLIGHT):
+    """Upsert an iterable of GBX profiles into Mailchimp with bounded concurrency.
+
+    The merge map is loaded once for the whole batch and the result is a
+    per-record summary; one summary log entry is written instead of one per profile.
+    Unparseable records are counted as failures, and the summary covers whatever was read.
+    """
+    merge_maps = get_compiled_merge_maps()
+    deferred_profiles = []
+
+    def _upsert(indexed_profile):
+        index, profile = indexed_profile
+        email = profile.get("email") if isinstance(profile, dict) else None
+        result = {"index": index, "email": email}
+        if isinstance(profile, MalformedProfile):
+            return {**result, "status": "error", "error": f"Malformed record: {profile.error}"}
+        if not email:
+            return {**result, "status": "error", "error": "Missing email"}
+        try:
+            mc_payloads = {list_id: build_gbx_payload(profile, merge_map) for list_id, merge_map in merge_maps.items()}
+            audiences = _upsert_everywhere(email, mc_payloads)
+        except CircuitOpenError as e:
+            deferred_profiles.append(profile)
+            return {**result, "status": "deferred", "error": str(e)}
+        except Exception as e:
+            return {**result, "status": "exception", "error": str(e)}
+
+        failures = [r for r in audiences.values() if r["status"] != "success"]
+        if len(audiences) > 1:
+            result.update(audience_log_diff(audiences))
+        if not failures:
+            return {**result, "status": "success"}
+        first = failures[0]
+        return {
+            **result,
+            "status": first["status"],
+            "mailchimp_status": first.get("mailchimp_status"),
+            "error": first.get("mailchimp_error", first.get("error"))
+        }
+
+    results = []
+    for result in map_concurrently(_upsert, enumerate(_until_failure(profiles)), max_in_flight):
+        results.append(result)
+        if result["status"] != "success":
+            print(f"❌ GBX profile #{result['index']} ({result['email']}) failed: {result.get('error')}")
+
+    # Park everything the open circuit refused as one event so the drain retries it later
+    if deferred_profiles:
+        defer_event("gbx_bulk", deferred_profiles, "Mailchimp circuit open during bulk import")
+
+    succeeded = sum(1 for r in results if r["status"] == "success")
+    summary = {
+        "total": len(results),
+        "succeeded": succeeded,
+        "deferred": len(deferred_profiles),
+        "failed": len(results) - succeeded - len(deferred_profiles),
+        "results": results
+    }
+
+    print(f"📦 GBX bulk import: {succeeded}/{len(results)} profiles synced")
+    append_log_entry(
+        "gbx_profile_bulk_sync",
+        None,
+        "success" if summary["failed"] == 0 else "error",
+        diff={
+            "total": summary["total"],
+            "succeeded": summary["succeeded"],
+            "deferred": summary["deferred"],
+            "failed": summary["failed"],
+            "failures": [r for r in results if r["status"] not in ("success", "deferred")]
+        }
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    # python gbx_sync.py profiles.json|profiles.ndjson   (or "-" for stdin)
+    if len(sys.argv) != 2:
+        print("Usage: python gbx_sync.py <profiles.json | profiles.ndjson | ->")
+        sys.exit(1)
+
+    source = sys.stdin.buffer if sys.argv[1] == "-" else open(sys.argv[1], "rb")
+    with source:
+        summary = sync_gbx_profiles_bulk(iter_profiles(source))
+    print(json.dumps({k: v for k, v in summary.items() if k != "results"}, indent=2))
+    sys.exit(0 if summary["failed"] == 0 else 2)
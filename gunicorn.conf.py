@@ -0,0 +1,18 @@
+# gunicorn.conf.py — picked up automatically by `gunicorn app:app`
+
+import os
+
+# Import the app once in the master so workers fork with modules already loaded.
+# Connections are still opened per worker in post_worker_init (sockets must not cross a fork).
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+# Threads per worker (gthread). The admin UI's live log stream holds a request open, so a
+# single-threaded sync worker would be tied up by one open browser tab.
+# This applies to every route: webhooks run up to `threads` at a time per worker too.
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+def post_worker_init(worker):
+    from config import WARMUP_ON_BOOT
+    if WARMUP_ON_BOOT:
+        from warmup import warm_up
+        warm_up()
@@ -0,0 +1,171 @@
+# log_stream.py
+#
+# Live tail of the webhook log for the admin UI (Server-Sent Events on /api/logs/stream).
+# One poller thread per process follows the storage backend and keeps the newest
+# LOG_STREAM_BUFFER entries in a shared ring buffer; each connected client holds only its
+# cursor. Entries this worker appends wake the poller at once; entries appended by other
+# workers arrive on the next poll.
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from config import (
+    LOG_STREAM_BUFFER,
+    LOG_STREAM_POLL_SECONDS,
+    LOG_STREAM_HEARTBEAT_SECONDS,
+    LOG_STREAM_MAX_SECONDS,
+    LOG_STREAM_MAX_CLIENTS,
+)
+from storage_backend import get_backend
+from metrics_utils import set_gauge
+
+_buffer = deque()   # (cursor, entry), oldest first, at most LOG_STREAM_BUFFER long
+_base = None        # cursor just before the oldest buffered entry
+_cursor = None      # cursor of the newest entry seen
+_generation = 0     # bumped when the log is replaced by a shorter one, so clients resync
+_changed = threading.Condition()
+_wake = threading.Event()
+_clients = 0
+_poller_pid = None
+_poller_lock = threading.Lock()
+
+def notify_appended():
+    """Wake the poller after this process appends a log entry"""
+    _wake.set()
+
+def _poll():
+    global _base, _cursor, _generation
+    backend = get_backend()
+    if _cursor is None:
+        latest = backend.log_cursor()
+        with _changed:
+            _base = _cursor = latest
+            _changed.notify_all()
+        return
+
+    entries, latest = backend.load_logs_since(_cursor)
+    with _changed:
+        if latest < _cursor:
+            # An import or restore replaced the log — clients must reload it
+            _buffer.clear()
+            _base = _cursor = latest
+            _generation += 1
+        for cursor, entry in entries:
+            if len(_buffer) >= LOG_STREAM_BUFFER:
+                _base = _buffer.popleft()[0]
+            _buffer.append((cursor, entry))
+            _cursor = cursor
+        if entries or latest < _cursor:
+            _changed.notify_all()
+
+def _poll_loop():
+    while True:
+        _wake.wait(LOG_STREAM_POLL_SECONDS)
+        _wake.clear()
+        # Nobody is watching — don't read the log just to throw it away
+        if not _clients:
+            continue
+        try:
+            _poll()
+        except Exception as e:
+            print(f"⚠️ Log stream poll failed: {e}")
+
+def _start_poller():
+    global _poller_pid
+    if _poller_pid == os.getpid():
+        return
+    with _poller_lock:
+        if _poller_pid != os.getpid():
+            threading.Thread(target=_poll_loop, daemon=True, name="log-stream").start()
+            _poller_pid = os.getpid()
+
+def acquire():
+    """Reserve a stream slot; False when LOG_STREAM_MAX_CLIENTS are already connected to this worker"""
+    global _clients
+    with _changed:
+        if _clients >= LOG_STREAM_MAX_CLIENTS:
+            return False
+        _clients += 1
+        set_gauge("log_stream.clients", _clients)
+    _start_poller()
+    _wake.set()
+    return True
+
+def release():
+    global _clients
+    with _changed:
+        _clients -= 1
+        set_gauge("log_stream.clients", _clients)
+
+def _message(event, data, cursor=None):
+    lines = [f"id: {cursor}"] if cursor is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+def _catch_up(cursor):
+    # Entries older than the buffer come straight from the backend, if there aren't too many
+    entries, _ = get_backend().load_logs_since(cursor)
+    return entries if len(entries) <= LOG_STREAM_BUFFER else None
+
+def events(cursor=None):
+    """Yield SSE messages for log entries after `cursor` (None = from now on).
+
+    Ends after LOG_STREAM_MAX_SECONDS; the browser's EventSource reconnects with Last-Event-ID.
+    Sends a `reset` event when the client has fallen too far behind, or holds a cursor this
+    worker never catches up to, and must reload the log.
+    """
+    ends_at = time.monotonic() + LOG_STREAM_MAX_SECONDS
+    yield f"retry: {int(LOG_STREAM_POLL_SECONDS * 1000)}\n\n"
+
+    with _changed:
+        _changed.wait_for(lambda: _cursor is not None, timeout=LOG_STREAM_HEARTBEAT_SECONDS)
+        if _cursor is None:
+            yield _message("reset", {})
+            return
+        generation = _generation
+        if cursor is None:
+            cursor = _cursor
+        ahead = cursor > _cursor
+        behind = cursor < _base
+
+    if ahead:
+        # Entries another worker appended that this one hasn't polled yet — or a cursor from
+        # before the log was replaced, which no amount of waiting would reach
+        _wake.set()
+        with _changed:
+            _changed.wait_for(lambda: _generation != generation or _cursor >= cursor, timeout=LOG_STREAM_POLL_SECONDS * 2)
+            caught_up = _generation == generation and _cursor >= cursor
+        if not caught_up:
+            yield _message("reset", {})
+            return
+
+    if behind:
+        missed = _catch_up(cursor)
+        if missed is None:
+            yield _message("reset", {})
+            return
+        for cursor, entry in missed:
+            yield _message("log", entry, cursor)
+
+    while time.monotonic() < ends_at:
+        with _changed:
+            _changed.wait_for(
+                lambda: _generation != generation or _cursor > cursor,
+                timeout=LOG_STREAM_HEARTBEAT_SECONDS
+            )
+            if _generation != generation or cursor < _base:
+                batch = None
+            else:
+                batch = [(c, entry) for c, entry in _buffer if c > cursor]
+
+        if batch is None:
+            yield _message("reset", {})
+            return
+        if not batch:
+            # Keeps proxies from closing an idle connection, and surfaces a disconnected client
+            yield ": keepalive\n\n"
+            continue
+        for cursor, entry in batch:
+            yield _message("log", entry, cursor)
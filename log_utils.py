@@ -1,10 +1,24 @@
 # log_utils.py
 
+import sys
 from datetime import datetime
-from config import LOG_FILE
-from storage_utils import load_json, save_json
+from storage_backend import get_backend, member_id_from_payload
+from payload_store import store_payload, store_payload_async, payload_ref
+from concurrency_utils import map_concurrently
+from log_stream import notify_appended
 
-def append_log_entry(event, email, status, diff=None, payload=None):
+def _attach_payload(log, payload, ref):
+    # Log entries reference the payload by hash; `ref` is None when the blob store write failed,
+    # and the payload is kept inline instead. Callers store it first, so this never does I/O.
+    member_id = member_id_from_payload(payload)
+    if member_id:
+        log["member_id"] = member_id
+    if ref:
+        log["payload_ref"] = ref
+    else:
+        log["payload"] = payload
+
+def _log_entry(event, email, status, diff):
     log = {
         "timestamp": datetime.utcnow().isoformat() + "Z",
         "event": event,
@@ -13,9 +27,58 @@ def append_log_entry(event, email, status, diff=None, payload=None):
     }
     if diff:
         log["changes"] = diff
+    return log
+
+def append_log_entry(event, email, status, diff=None, payload=None):
+    log = _log_entry(event, email, status, diff)
     if payload:
-        log["payload"] = payload
+        _attach_payload(log, payload, store_payload(payload))
+
+    get_backend().append_log(log)
+    notify_appended()
+
+async def append_log_entry_async(event, email, status, diff=None, payload=None):
+    log = _log_entry(event, email, status, diff)
+    if payload:
+        _attach_payload(log, payload, await store_payload_async(payload))
+
+    await get_backend().append_log_async(log)
+    notify_appended()
+
+def load_logs():
+    return get_backend().load_logs()
+
+def load_logs_since(cursor):
+    return get_backend().load_logs_since(cursor)
+
+def compact_logs():
+    """Move payloads embedded in existing log entries out to the payload store; returns how many moved"""
+    # Upload first, outside the rewrite: its compare-and-swap may re-run the transform on conflict,
+    # so the transform itself only swaps in refs that are already stored
+    pending = {}
+    for entry in load_logs():
+        if entry.get("payload"):
+            pending.setdefault(payload_ref(entry["payload"]), entry["payload"])
+    stored = {ref for ref in map_concurrently(store_payload, pending.values()) if ref}
+    if not stored:
+        return 0
+
+    def _externalize(entry):
+        payload = entry.get("payload")
+        if not payload:
+            return entry
+        ref = payload_ref(payload)
+        if ref not in stored:
+            return entry
+        compacted = {key: value for key, value in entry.items() if key != "payload"}
+        _attach_payload(compacted, payload, ref)
+        return compacted
+
+    return get_backend().rewrite_logs(_externalize)
 
-    logs = load_json(LOG_FILE)
-    logs.append(log)
-    save_json(LOG_FILE, logs)
+if __name__ == "__main__":
+    # python log_utils.py compact
+    if sys.argv[1:] != ["compact"]:
+        print("Usage: python log_utils.py compact")
+        sys.exit(1)
+    print(f"✅ Moved {compact_logs()} inline payloads to the payload store")
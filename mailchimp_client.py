@@ -0,0 +1,97 @@
+# mailchimp_client.py
+
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from config import MAILCHIMP_API_KEY, MAILCHIMP_SERVER_PREFIX, MAILCHIMP_POOL_SIZE, MAILCHIMP_TIMEOUT_SECONDS
+from circuit_breaker import get_breaker, deadline_timeout, CircuitOpenError, DeadlineExceeded
+from async_http import get_async_client, is_unhealthy
+
+MAILCHIMP_BASE_URL = f"https://{MAILCHIMP_SERVER_PREFIX}.api.mailchimp.com/3.0"
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Shared keep-alive session for Mailchimp, so calls reuse pooled TLS connections"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.auth = ("anystring", MAILCHIMP_API_KEY)
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAILCHIMP_POOL_SIZE))
+                _session = session
+    return _session
+
+def contact_hash(email):
+    return hashlib.md5(email.lower().encode()).hexdigest()
+
+def member_url(list_id, email):
+    return f"{MAILCHIMP_BASE_URL}/lists/{list_id}/members/{contact_hash(email)}"
+
+def mailchimp_request(method, url, **kwargs):
+    """Call Mailchimp through its circuit breaker, bounded by the request deadline"""
+    kwargs["timeout"] = deadline_timeout(kwargs.get("timeout", MAILCHIMP_TIMEOUT_SECONDS))
+    return get_breaker("mailchimp").call(get_session().request, method, url, is_failure=is_unhealthy, **kwargs)
+
+async def mailchimp_request_async(method, url, **kwargs):
+    """mailchimp_request over the pooled async client (responses are httpx.Response)"""
+    kwargs["timeout"] = deadline_timeout(kwargs.get("timeout", MAILCHIMP_TIMEOUT_SECONDS))
+    return await get_breaker("mailchimp").acall(
+        get_async_client().request, method, url,
+        auth=("anystring", MAILCHIMP_API_KEY or ""), is_failure=is_unhealthy, **kwargs
+    )
+
+def warm_up_mailchimp():
+    """Open a pooled connection to Mailchimp ahead of the first request"""
+    mailchimp_request("GET", f"{MAILCHIMP_BASE_URL}/ping", timeout=5)
+
+# 📣 Multi-audience fan-out helpers
+def capture_failures(fn):
+    """Wrap fn so an error comes back as its result — one audience failing mustn't sink the others.
+
+    Circuit and deadline errors still propagate and abort the whole fan-out.
+    """
+    def run():
+        try:
+            return fn()
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            return e
+    return run
+
+async def capture_failures_async(awaitable):
+    """capture_failures for a coroutine"""
+    try:
+        return await awaitable
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        return e
+
+def succeeded(response, codes=(200, 201)):
+    return response is not None and not isinstance(response, Exception) and response.status_code in codes
+
+def failure_result(response, stage):
+    """Per-audience result for a failed call (a response or a captured exception)"""
+    if isinstance(response, Exception):
+        return {"status": "exception", "stage": stage, "error": str(response), "permanent": False}
+    status = response.status_code
+    return {
+        "status": "error",
+        "stage": stage,
+        "mailchimp_status": status,
+        "mailchimp_error": response.text,
+        "permanent": 400 <= status < 500 and status != 429
+    }
+
+def audience_log_diff(results):
+    """Log `changes` for {list_id: result}: per-audience when fanning out, the classic shape for one audience"""
+    public = {list_id: {k: v for k, v in r.items() if k != "permanent"} for list_id, r in results.items()}
+    if len(public) > 1:
+        return {"audiences": public}
+    (result,) = public.values()
+    return {k: v for k, v in result.items() if k in ("mailchimp_status", "mailchimp_error", "error")} or None
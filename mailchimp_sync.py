@@ -1,114 +1,301 @@
 # mailchimp_sync.py
 
-import hashlib
 import json
-import requests
-from config import MAILCHIMP_API_KEY, MAILCHIMP_LIST_ID, MAILCHIMP_SERVER_PREFIX
-from utils import format_date, convert_bool, convert_autorenew
-from cache_utils import get_cached_email, update_cache
-from log_utils import append_log_entry
-from storage_utils import load_merge_map
+import asyncio
+from functools import partial
+from config import MAILCHIMP_AUDIENCES
+from cache_utils import get_cached_email, update_cache, get_cached_email_async, update_cache_async
+from log_utils import append_log_entry, append_log_entry_async
+from sync_state import record_sync, record_sync_async, sync_timestamp, last_synced
+from merge_utils import get_compiled_merge_maps, get_compiled_merge_maps_async
+from concurrency_utils import run_concurrently, gather_all
+from mailchimp_client import (
+    mailchimp_request, mailchimp_request_async, member_url, capture_failures, capture_failures_async,
+    succeeded, failure_result, audience_log_diff
+)
+from circuit_breaker import CircuitOpenError, DeadlineExceeded
+from deferred_utils import defer_event, dead_letter_event, register_processor
 
-def sync_to_mailchimp(member, subscription, event_type, override_guid=False, tag_only=False):
-    merge_map = load_merge_map()
-    MERGE_FIELDS = merge_map["MERGE_FIELDS"]
-
-    member_id = str(member.get("id"))
-    current_email = member.get("email")
-    original_email = get_cached_email(member_id) or current_email
+# 🔖 Events that toggle the "Payment Failed" tag
+ADD_TAG_EVENTS = {
+    "order.failed",
+    "invoice.payment_failed",
+    "charge.failed",
+    "payment_intent.payment_failed"
+}
 
-    print(f"📨 Using original email: {original_email}")
-    if original_email != current_email:
-        print(f"✳️ Email changed in Memberful: {original_email} → {current_email}")
+REMOVE_TAG_EVENTS = {
+    "invoice.paid",
+    "invoice.payment_succeeded",
+    "charge.succeeded",
+    "payment_intent.succeeded"
+}
 
-    merge_fields = {
-        MERGE_FIELDS["first_name"]: member.get("first_name", ""),
-        MERGE_FIELDS["last_name"]: member.get("last_name", ""),
-        MERGE_FIELDS["member_id"]: "USER DELETED" if override_guid else member_id,
-        MERGE_FIELDS["signup_date"]: format_date(member.get("created_at")),
+def _tag_payload(event_type):
+    return {
+        "tags": [
+            {
+                "name": "Payment Failed",
+                "status": "active" if event_type in ADD_TAG_EVENTS else "inactive"
+            }
+        ]
     }
 
-    # 🆕 Dynamically add any additional mapped fields from member
-    for source_key, merge_tag in MERGE_FIELDS.items():
-        if merge_tag in merge_fields:
-            continue  # Already added above
-        if source_key in member:
-            merge_fields[merge_tag] = member[source_key]
+def _update_payment_tag(url, event_type):
+    return mailchimp_request("POST", f"{url}/tags", json=_tag_payload(event_type))
 
-    if subscription:
-        merge_fields.update({
-            MERGE_FIELDS["plan_name"]: subscription.get("plan_name") or subscription.get("subscription_plan", {}).get("name", ""),
-            MERGE_FIELDS["plan_active"]: convert_bool(subscription.get("active")),
-            MERGE_FIELDS["auto_renew"]: convert_autorenew(subscription.get("autorenew")),
-            MERGE_FIELDS["expires_at"]: format_date(subscription.get("expires_at")),
-        })
+async def _update_payment_tag_async(url, event_type):
+    return await mailchimp_request_async("POST", f"{url}/tags", json=_tag_payload(event_type))
 
-    contact_hash = hashlib.md5(original_email.lower().encode()).hexdigest()
-    member_url = f"https://{MAILCHIMP_SERVER_PREFIX}.api.mailchimp.com/3.0/lists/{MAILCHIMP_LIST_ID}/members/{contact_hash}"
+class SyncFailed(Exception):
+    """A Mailchimp sync that didn't go through in some audiences.
 
+    `audiences` maps each failed list ID to whether its failure is permanent (won't succeed on retry).
+    """
+
+    def __init__(self, message, audiences):
+        super().__init__(message)
+        self.audiences = audiences
+
+    @property
+    def permanent(self):
+        return all(self.audiences.values())
+
+def _queue_failed(error, member, subscription, event_type, override_guid, tag_only, received_at):
+    job = {
+        "member": member,
+        "subscription": subscription,
+        "event_type": event_type,
+        "override_guid": override_guid,
+        "tag_only": tag_only,
+        "received_at": received_at
+    }
+    transient = [list_id for list_id, permanent in error.audiences.items() if not permanent]
+    permanent = [list_id for list_id, permanent in error.audiences.items() if permanent]
+    if transient:
+        defer_event("mailchimp_sync", {**job, "audiences": transient}, str(error), attempts=1)
+    if permanent:
+        dead_letter_event("mailchimp_sync", {**job, "audiences": permanent}, str(error), attempts=1)
+
+def sync_to_mailchimp(member, subscription, event_type, override_guid=False, tag_only=False):
+    """Sync one member to every audience; failed audiences are queued in the retry store rather than dropped"""
+    received_at = sync_timestamp()
     try:
+        return _sync_to_mailchimp(member, subscription, event_type, override_guid, tag_only)
+    except SyncFailed as e:
+        _queue_failed(e, member, subscription, event_type, override_guid, tag_only, received_at)
+
+async def sync_to_mailchimp_async(member, subscription, event_type, override_guid=False, tag_only=False):
+    """sync_to_mailchimp for the asyncio path; failed audiences go to the same retry store"""
+    received_at = sync_timestamp()
+    try:
+        return await _sync_to_mailchimp_async(member, subscription, event_type, override_guid, tag_only)
+    except SyncFailed as e:
+        await asyncio.to_thread(_queue_failed, e, member, subscription, event_type, override_guid, tag_only, received_at)
+
+def _superseded(job, audiences):
+    """Audiences that accepted a sync of this member after the job's event arrived.
+
+    The job replays a snapshot of the member; applying it there would revert a newer change.
+    """
+    received_at = job.get("received_at")
+    if not received_at or job.get("tag_only") or job.get("override_guid"):
+        return []
+    synced = last_synced(job["member"].get("id"))
+    return [list_id for list_id in audiences if synced.get(list_id, "") > received_at]
+
+def retry_sync(job):
+    """Retry-store processor; raises SyncFailed so the scheduler can back off"""
+    audiences = job.get("audiences") or MAILCHIMP_AUDIENCES
+    superseded = _superseded(job, audiences)
+    if superseded:
+        print(f"⏭️ Skipping retry of {job['event_type']} in {', '.join(superseded)}: a newer sync already landed")
+        audiences = [list_id for list_id in audiences if list_id not in superseded]
+        if not audiences:
+            return
+    _sync_to_mailchimp(
+        job["member"],
+        job.get("subscription"),
+        job["event_type"],
+        job.get("override_guid", False),
+        job.get("tag_only", False),
+        audiences
+    )
+
+register_processor("mailchimp_sync", retry_sync)
+
+def sync_payment_tag(member, event_type):
+    """Set the "Payment Failed" tag in every audience; raises SyncFailed instead of queueing its own retry.
+
+    Stripe events retry as a whole, so a late retry is re-checked against newer payment outcomes.
+    """
+    return _sync_to_mailchimp(member, None, event_type, tag_only=True)
+
+async def sync_payment_tag_async(member, event_type):
+    return await _sync_to_mailchimp_async(member, None, event_type, tag_only=True)
+
+
+def _announce(original_email, current_email):
+    print(f"📨 Using original email: {original_email}")
+    if original_email != current_email:
+        print(f"✳️ Email changed in Memberful: {original_email} → {current_email}")
+
+def _planned_calls(member, subscription, event_type, override_guid, tag_only, merge_maps, urls):
+    """Every audience's upsert and tag update as [((list_id, kind), method, url, body)], plus the merge fields sent"""
+    update_tags = event_type in ADD_TAG_EVENTS.union(REMOVE_TAG_EVENTS)
+    calls, sent = [], {}
+    for list_id, url in urls.items():
         if not tag_only:
             payload = {
-                "email_address": current_email,
+                "email_address": member.get("email"),
                 "status_if_new": "subscribed",
-                "merge_fields": merge_fields
+                "merge_fields": merge_maps[list_id].member_merge_fields(member, subscription, override_guid=override_guid)
             }
-
-            print("Payload being sent to Mailchimp:")
+            sent[list_id] = payload["merge_fields"]
+            print(f"Payload being sent to Mailchimp audience {list_id}:")
             print(json.dumps(payload, indent=2))
+            calls.append(((list_id, "upsert"), "PUT", url, payload))
+        if update_tags:
+            calls.append(((list_id, "tags"), "POST", f"{url}/tags", _tag_payload(event_type)))
+    return calls, sent
 
-            response = requests.put(member_url, auth=("anystring", MAILCHIMP_API_KEY), json=payload)
-
-            if response.status_code in [200, 201]:
-                print(f"✅ Synced {original_email}: {response.status_code}")
-
-                if member_id not in [None, "", "None"] and not event_type.startswith("invoice."):
-                    update_cache(member_id, current_email)
-
-                append_log_entry(event_type, current_email, "success")
-            else:
-                print(f"❌ Failed to sync {original_email}: {response.status_code}")
-                print("Mailchimp error response:")
-                print(response.text)
-                append_log_entry(
-                    event_type,
-                    current_email,
-                    "error",
-                    diff={"mailchimp_status": response.status_code, "mailchimp_error": response.text}
-                )
-                return
-
-        # 🔖 Tag update logic
-        ADD_TAG_EVENTS = {
-            "order.failed",
-            "invoice.payment_failed",
-            "charge.failed",
-            "payment_intent.payment_failed"
-        }
-
-        REMOVE_TAG_EVENTS = {
-            "invoice.paid",
-            "invoice.payment_succeeded",
-            "charge.succeeded",
-            "payment_intent.succeeded"
-        }
-
-        if event_type in ADD_TAG_EVENTS.union(REMOVE_TAG_EVENTS):
-            tag_url = f"{member_url}/tags"
-            tag_payload = {
-                "tags": [
-                    {
-                        "name": "Payment Failed",
-                        "status": "active" if event_type in ADD_TAG_EVENTS else "inactive"
-                    }
-                ]
-            }
+def _audience_results(targets, responses, tag_only, original_email):
+    """{list_id: result} from the batch, plus audiences whose contact must be tagged again"""
+    results, retags = {}, []
+    for list_id in targets:
+        upsert = responses.get((list_id, "upsert"))
+        tags = responses.get((list_id, "tags"))
+
+        if not tag_only and not succeeded(upsert, (200, 201)):
+            print(f"❌ Failed to sync {original_email} to {list_id}: {getattr(upsert, 'status_code', upsert)}")
+            print("Mailchimp error response:")
+            print(getattr(upsert, "text", upsert))
+            results[list_id] = failure_result(upsert, "upsert")
+            continue
+
+        if not tag_only:
+            print(f"✅ Synced {original_email} to {list_id}: {upsert.status_code}")
+        results[list_id] = {"status": "success"}
+
+        if tags is None or succeeded(tags, (200, 204)):
+            continue
+        if not tag_only and getattr(tags, "status_code", None) == 404:
+            # The contact didn't exist until the upsert landed — tag it again now
+            retags.append(list_id)
+        else:
+            print(f"⚠️ Failed to update tags in {list_id}: {getattr(tags, 'status_code', tags)}")
+            results[list_id] = failure_result(tags, "tags")
+    return results, retags
+
+def _follow_ups(member_id, current_email, event_type, override_guid, tag_only, results, retags, sent, urls):
+    """Phase-two work as [(list_id or None, step, args)]: log, cache and sync-state writes, and re-tags"""
+    steps = []
+    if not tag_only:
+        all_ok = all(r["status"] == "success" for r in results.values())
+        steps.append((None, "log", (event_type, current_email, "success" if all_ok else "error", audience_log_diff(results))))
+    upserted = not tag_only and any(r["status"] == "success" for r in results.values())
+    # A deleted member is uncached by the route — a retried deletion must not put them back
+    deleted = override_guid or event_type == "member.deleted"
+    if upserted and member_id not in [None, "", "None"] and not event_type.startswith("invoice.") and not deleted:
+        steps.append((None, "cache", (member_id, current_email)))
+    if upserted and member_id not in [None, "", "None"] and not override_guid:
+        accepted = {list_id: sent[list_id] for list_id, r in results.items() if r["status"] == "success"}
+        steps.append((None, "record", (member_id, current_email, accepted)))
+    for list_id in retags:
+        steps.append((list_id, "retag", (urls[list_id], event_type)))
+    return steps
+
+def _apply_retags(results, steps, outcomes):
+    for (list_id, _, _), response in zip(steps, outcomes):
+        if list_id and not succeeded(response, (200, 204)):
+            print(f"⚠️ Failed to update tags in {list_id}: {getattr(response, 'status_code', response)}")
+            results[list_id] = failure_result(response, "tags")
+
+def _raise_if_failed(results):
+    failed = {list_id: r["permanent"] for list_id, r in results.items() if r["status"] != "success"}
+    if failed:
+        raise SyncFailed(f"Mailchimp sync failed for audience(s) {', '.join(failed)}", failed)
+    return results
+
+FOLLOW_UP_STEPS = {"log": append_log_entry, "cache": update_cache, "record": record_sync, "retag": _update_payment_tag}
+FOLLOW_UP_STEPS_ASYNC = {
+    "log": append_log_entry_async,
+    "cache": update_cache_async,
+    "record": record_sync_async,
+    "retag": _update_payment_tag_async
+}
+
+def _sync_to_mailchimp(member, subscription, event_type, override_guid=False, tag_only=False, audiences=None):
+    member_id = str(member.get("id"))
+    current_email = member.get("email")
+    targets = audiences or MAILCHIMP_AUDIENCES
+
+    # ⚡ Merge maps and cached email are independent reads — fetch both at once
+    merge_maps, cached_email = run_concurrently(
+        lambda: get_compiled_merge_maps(targets),
+        lambda: get_cached_email(member_id)
+    )
+    original_email = cached_email or current_email
+    _announce(original_email, current_email)
+    urls = {list_id: member_url(list_id, original_email) for list_id in targets}
 
-            tag_response = requests.post(tag_url, auth=("anystring", MAILCHIMP_API_KEY), json=tag_payload)
-            if tag_response.status_code not in [200, 204]:
-                print(f"⚠️ Failed to update tags: {tag_response.status_code}")
-                print(tag_response.text)
+    try:
+        # ⚡ Every audience's upsert and tag update go out as one concurrent batch
+        calls, sent = _planned_calls(member, subscription, event_type, override_guid, tag_only, merge_maps, urls)
+        batch = run_concurrently(*[
+            capture_failures(partial(mailchimp_request, method, url, json=body)) for _, method, url, body in calls
+        ])
+        results, retags = _audience_results(targets, dict(zip([key for key, *_ in calls], batch)), tag_only, original_email)
+
+        # ⚡ Log, cache and any re-tags of just-created contacts are independent
+        steps = _follow_ups(member_id, current_email, event_type, override_guid, tag_only, results, retags, sent, urls)
+        outcomes = run_concurrently(*[
+            capture_failures(partial(FOLLOW_UP_STEPS[step], *args)) if list_id else partial(FOLLOW_UP_STEPS[step], *args)
+            for list_id, step, args in steps
+        ])
+        _apply_retags(results, steps, outcomes)
 
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
         print(f"❌ Exception during Mailchimp sync: {e}")
         append_log_entry(event_type, current_email, "exception", diff={"error": str(e)})
+        raise SyncFailed(str(e), {list_id: False for list_id in targets}) from e
+
+    return _raise_if_failed(results)
+
+async def _sync_to_mailchimp_async(member, subscription, event_type, override_guid=False, tag_only=False, audiences=None):
+    member_id = str(member.get("id"))
+    current_email = member.get("email")
+    targets = audiences or MAILCHIMP_AUDIENCES
+
+    merge_maps, cached_email = await gather_all(
+        get_compiled_merge_maps_async(targets),
+        get_cached_email_async(member_id)
+    )
+    original_email = cached_email or current_email
+    _announce(original_email, current_email)
+    urls = {list_id: member_url(list_id, original_email) for list_id in targets}
+
+    try:
+        calls, sent = _planned_calls(member, subscription, event_type, override_guid, tag_only, merge_maps, urls)
+        batch = await gather_all(*[
+            capture_failures_async(mailchimp_request_async(method, url, json=body)) for _, method, url, body in calls
+        ])
+        results, retags = _audience_results(targets, dict(zip([key for key, *_ in calls], batch)), tag_only, original_email)
+
+        steps = _follow_ups(member_id, current_email, event_type, override_guid, tag_only, results, retags, sent, urls)
+        outcomes = await gather_all(*[
+            capture_failures_async(FOLLOW_UP_STEPS_ASYNC[step](*args)) if list_id else FOLLOW_UP_STEPS_ASYNC[step](*args)
+            for list_id, step, args in steps
+        ])
+        _apply_retags(results, steps, outcomes)
+
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"❌ Exception during Mailchimp sync: {e}")
+        await append_log_entry_async(event_type, current_email, "exception", diff={"error": str(e)})
+        raise SyncFailed(str(e), {list_id: False for list_id in targets}) from e
+
+    return _raise_if_failed(results)
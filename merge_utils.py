@@ -1,6 +1,293 @@
 # merge_utils.py
 
-from storage_utils import load_json
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from config import MAILCHIMP_AUDIENCES
+from storage_backend import get_backend
+from circuit_breaker import CircuitOpenError, DeadlineExceeded
+from utils import format_date, convert_bool, convert_autorenew
+
+# 🔁 Per-field value transforms, referenced by name from the specs below
+TRANSFORMS = {
+    "raw": lambda value: value,
+    "string": str,
+    "date": format_date,
+    "yes_no": convert_bool,
+    "on_off": convert_autorenew,
+}
+
+# 🧩 Where each built-in MERGE_FIELDS key comes from: (source, paths, transform, default)
+# Alternative paths are tried in order and the first truthy value wins.
+MEMBER_FIELD_SPECS = {
+    "first_name": ("member", ["first_name"], "raw", ""),
+    "last_name": ("member", ["last_name"], "raw", ""),
+    "member_id": ("member", ["id"], "string", None),
+    "signup_date": ("member", ["created_at"], "date", None),
+    "plan_name": ("subscription", ["plan_name", "subscription_plan.name"], "raw", ""),
+    "plan_active": ("subscription", ["active"], "yes_no", None),
+    "auto_renew": ("subscription", ["autorenew"], "on_off", None),
+    "expires_at": ("subscription", ["expires_at"], "date", None),
+}
+
+DELETED_MEMBER_ID = "USER DELETED"
+MERGE_TAG_PATTERN = re.compile(r"^[A-Z0-9_]{1,10}$")
+MAP_SECTIONS = ("MERGE_FIELDS", "GBX_PROFILE_FIELDS", "FIELD_TRANSFORMS")
+# {"AUDIENCES": {"<list_id>": {<sections>}}} overrides whole sections for one audience
+AUDIENCES_SECTION = "AUDIENCES"
+
+def load_merge_map():
+    return get_backend().load_merge_map()
+
+def save_merge_map(data):
+    """Validate and store `data`; returns the validation warnings"""
+    warnings = validate_merge_map(data)
+    get_backend().save_merge_map(data)
+    return warnings
+
+async def load_merge_map_async():
+    return await get_backend().load_merge_map_async()
 
 def get_merge_fields():
-    return load_json("merge_map.json")
+    return load_merge_map()
+
+def audience_merge_map(merge_map, list_id):
+    """The merge map for one audience: its AUDIENCES overrides on top of the shared sections"""
+    shared = {key: value for key, value in merge_map.items() if key != AUDIENCES_SECTION}
+    overrides = (merge_map.get(AUDIENCES_SECTION) or {}).get(list_id) or {}
+    return {**shared, **overrides}
+
+# ✅ Validation
+def validate_merge_map(merge_map):
+    """Raise ValueError listing every problem with `merge_map`; returns warnings for what's merely suspicious.
+
+    Unknown sections and tags that don't look like Mailchimp merge tags are warnings: Mailchimp
+    is the judge of its own tags, and one odd tag shouldn't stop every sync.
+    """
+    if not isinstance(merge_map, dict):
+        raise ValueError("Merge map must be a JSON object")
+
+    errors = []
+    warnings = []
+    unknown = set(merge_map) - set(MAP_SECTIONS) - {AUDIENCES_SECTION}
+    if unknown:
+        warnings.append(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    merge_fields = merge_map.get("MERGE_FIELDS")
+    if not isinstance(merge_fields, dict):
+        errors.append("MERGE_FIELDS must be an object")
+    else:
+        missing = [key for key in MEMBER_FIELD_SPECS if not merge_fields.get(key)]
+        if missing:
+            errors.append(f"MERGE_FIELDS is missing: {', '.join(missing)}")
+
+    for section in ("MERGE_FIELDS", "GBX_PROFILE_FIELDS"):
+        fields = merge_map.get(section, {})
+        if not isinstance(fields, dict):
+            if section != "MERGE_FIELDS":
+                errors.append(f"{section} must be an object")
+            continue
+        seen = {}
+        for key, tag in fields.items():
+            if not isinstance(tag, str) or not tag:
+                errors.append(f"{section}.{key}: merge tag must be a non-empty string")
+                continue
+            if not MERGE_TAG_PATTERN.match(tag):
+                warnings.append(f"{section}.{key}: '{tag}' doesn't look like a Mailchimp merge tag")
+            if tag in seen:
+                errors.append(f"{section}: {key} and {seen[tag]} both map to {tag}")
+            else:
+                seen[tag] = key
+
+    transforms = merge_map.get("FIELD_TRANSFORMS", {})
+    if not isinstance(transforms, dict):
+        errors.append("FIELD_TRANSFORMS must be an object")
+    else:
+        for key, name in transforms.items():
+            if name not in TRANSFORMS:
+                errors.append(f"FIELD_TRANSFORMS.{key}: unknown transform '{name}' (use {', '.join(TRANSFORMS)})")
+
+    audiences = merge_map.get(AUDIENCES_SECTION, {})
+    if not isinstance(audiences, dict):
+        errors.append(f"{AUDIENCES_SECTION} must be an object")
+        audiences = {}
+    for list_id, overrides in audiences.items():
+        if not isinstance(overrides, dict) or set(overrides) - set(MAP_SECTIONS):
+            errors.append(f"{AUDIENCES_SECTION}.{list_id} may only contain {', '.join(MAP_SECTIONS)}")
+            continue
+        try:
+            # Shared sections were already checked above; only report what the overrides add
+            audience_warnings = validate_merge_map(audience_merge_map(merge_map, list_id))
+            warnings.extend(f"{AUDIENCES_SECTION}.{list_id}: {w}" for w in audience_warnings if w not in warnings)
+        except ValueError as e:
+            errors.append(f"{AUDIENCES_SECTION}.{list_id}: {e}")
+
+    if errors:
+        raise ValueError("; ".join(errors))
+    return warnings
+
+# ⚙️ Compilation
+def _compile_getter(paths, default):
+    split_paths = [path.split(".") for path in paths]
+
+    def get(source):
+        for parts in split_paths:
+            value = source
+            for part in parts:
+                value = value.get(part) if isinstance(value, dict) else None
+            if value:
+                return value
+        if len(split_paths) == 1 and isinstance(source, dict):
+            return source.get(paths[0], default)
+        return default
+
+    return get
+
+class CompiledMergeMap:
+    """A merge map turned into flat lists of (tag, getter, transform) for one-pass field building"""
+
+    def __init__(self, merge_map, version=None):
+        for warning in validate_merge_map(merge_map):
+            print(f"⚠️ Merge map: {warning}")
+        self.version = version
+        merge_fields = merge_map["MERGE_FIELDS"]
+        transforms = merge_map.get("FIELD_TRANSFORMS", {})
+
+        self.member_fields = []
+        self.subscription_fields = []
+        self.member_id_tag = merge_fields["member_id"]
+        for key, (source, paths, transform, default) in MEMBER_FIELD_SPECS.items():
+            compiled = (merge_fields[key], _compile_getter(paths, default), TRANSFORMS[transforms.get(key, transform)])
+            (self.member_fields if source == "member" else self.subscription_fields).append(compiled)
+
+        # Any other mapped key is copied from the member when present
+        built_in_tags = {tag for tag, _, _ in self.member_fields}
+        self.extra_fields = [
+            (key, tag, TRANSFORMS[transforms.get(key, "raw")])
+            for key, tag in merge_fields.items()
+            if key not in MEMBER_FIELD_SPECS or MEMBER_FIELD_SPECS[key][0] != "member"
+            if tag not in built_in_tags
+        ]
+
+        self.gbx_fields = [
+            (key, tag, TRANSFORMS[transforms.get(key, "raw")])
+            for key, tag in (merge_map.get("GBX_PROFILE_FIELDS") or {}).items()
+        ]
+
+    def member_merge_fields(self, member, subscription=None, override_guid=False):
+        merge_fields = {tag: transform(get(member)) for tag, get, transform in self.member_fields}
+        if override_guid:
+            merge_fields[self.member_id_tag] = DELETED_MEMBER_ID
+
+        for key, tag, transform in self.extra_fields:
+            if key in member:
+                merge_fields[tag] = transform(member[key])
+
+        if subscription:
+            for tag, get, transform in self.subscription_fields:
+                merge_fields[tag] = transform(get(subscription))
+        return merge_fields
+
+    def gbx_merge_fields(self, profile):
+        merge_fields = {}
+        for key, tag, transform in self.gbx_fields:
+            value = profile.get(key)
+            if value is not None:
+                merge_fields[tag] = transform(value)
+        return merge_fields
+
+def merge_map_version(merge_map):
+    return hashlib.sha1(json.dumps(merge_map, sort_keys=True).encode()).hexdigest()
+
+COMPILED_CACHE_SIZE = 32
+_compiled = OrderedDict()
+_last_valid = {}
+_compiled_lock = threading.Lock()
+# Compiled maps per audience for the stored merge map at one backend version (ETag, mtime, updated_at)
+_current = {"version": None, "maps": {}}
+
+def compile_merge_map(merge_map):
+    """Compile `merge_map`, reusing earlier results while its version is unchanged"""
+    version = merge_map_version(merge_map)
+    with _compiled_lock:
+        if version in _compiled:
+            _compiled.move_to_end(version)
+            return _compiled[version]
+    compiled = CompiledMergeMap(merge_map, version)
+    with _compiled_lock:
+        _compiled[version] = compiled
+        while len(_compiled) > COMPILED_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return compiled
+
+def _cached_for(version, audiences):
+    if version is None:
+        return None
+    with _compiled_lock:
+        if _current["version"] != version:
+            return None
+        maps = _current["maps"]
+        if all(list_id in maps for list_id in audiences):
+            return {list_id: maps[list_id] for list_id in audiences}
+    return None
+
+def _remember(version, compiled):
+    if version is not None:
+        with _compiled_lock:
+            if _current["version"] != version:
+                _current.update(version=version, maps={})
+            _current["maps"].update(compiled)
+    return compiled
+
+def get_compiled_merge_maps(audiences=None):
+    """{list_id: compiled map} for each audience, falling back to an audience's last good map if it's invalid.
+
+    The map is only re-read and recompiled when the backend reports a new version.
+    """
+    audiences = audiences or MAILCHIMP_AUDIENCES
+    try:
+        version = get_backend().merge_map_version()
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"⚠️ Could not check the merge map version: {e}")
+        version = None
+    cached = _cached_for(version, audiences)
+    if cached is not None:
+        return cached
+    return _remember(version, _compile_for_audiences(load_merge_map(), audiences))
+
+async def get_compiled_merge_maps_async(audiences=None):
+    audiences = audiences or MAILCHIMP_AUDIENCES
+    try:
+        version = await get_backend().merge_map_version_async()
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"⚠️ Could not check the merge map version: {e}")
+        version = None
+    cached = _cached_for(version, audiences)
+    if cached is not None:
+        return cached
+    return _remember(version, _compile_for_audiences(await load_merge_map_async(), audiences))
+
+def _compile_for_audiences(merge_map, audiences):
+    compiled = {}
+    for list_id in audiences:
+        try:
+            compiled[list_id] = compile_merge_map(audience_merge_map(merge_map, list_id))
+            _last_valid[list_id] = compiled[list_id]
+        except ValueError as e:
+            print(f"⚠️ Stored merge map is invalid for audience {list_id}: {e}")
+            if list_id not in _last_valid:
+                raise
+            print("↩️ Using last valid merge map")
+            compiled[list_id] = _last_valid[list_id]
+    return compiled
+
+def get_compiled_merge_map():
+    """Compiled merge map for the primary (first) audience"""
+    primary = MAILCHIMP_AUDIENCES[0]
+    return get_compiled_merge_maps([primary])[primary]
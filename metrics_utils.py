@@ -0,0 +1,28 @@
+# metrics_utils.py
+#
+# Tiny in-process metrics registry, reported as JSON on /metrics.
+
+import time
+import threading
+
+PROCESS_STARTED_AT = time.time()
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def snapshot():
+    with _lock:
+        return {
+            "uptime_seconds": round(time.time() - PROCESS_STARTED_AT, 3),
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+        }
@@ -0,0 +1,83 @@
+# payload_store.py
+#
+# Webhook payloads stored once, content-addressed by SHA-256, as payloads/<ref>.json in the
+# blob store (local files, or Spaces in production) whichever STORAGE_BACKEND is in use.
+# Log entries keep only the `payload_ref`; the admin UI and /replay-log fetch payloads on demand.
+
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from storage_utils import load_json_versioned, save_json_if_match, save_json_if_match_async
+from circuit_breaker import CircuitOpenError, DeadlineExceeded
+
+PAYLOAD_DIR = "payloads"
+REF_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Refs this process has already stored, so logging the same payload twice skips the write
+KNOWN_REFS_MAX = 4096
+_known_refs = OrderedDict()
+_known_refs_lock = threading.Lock()
+
+def payload_ref(payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _payload_filename(ref):
+    return f"{PAYLOAD_DIR}/{ref}.json"
+
+def _is_known(ref):
+    with _known_refs_lock:
+        if ref in _known_refs:
+            _known_refs.move_to_end(ref)
+            return True
+        return False
+
+def _remember(ref):
+    with _known_refs_lock:
+        _known_refs[ref] = True
+        while len(_known_refs) > KNOWN_REFS_MAX:
+            _known_refs.popitem(last=False)
+
+def store_payload(payload):
+    """Store `payload` under its content hash and return the ref (None if it couldn't be stored)"""
+    ref = payload_ref(payload)
+    if _is_known(ref):
+        return ref
+
+    try:
+        # Create-only write: False just means an identical payload is already stored
+        save_json_if_match(_payload_filename(ref), json.loads(json.dumps(payload, default=str)), None)
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"⚠️ Failed to store payload {ref[:12]}: {e}")
+        return None
+
+    _remember(ref)
+    return ref
+
+async def store_payload_async(payload):
+    """store_payload for coroutines"""
+    ref = payload_ref(payload)
+    if _is_known(ref):
+        return ref
+
+    try:
+        await save_json_if_match_async(_payload_filename(ref), json.loads(json.dumps(payload, default=str)), None)
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"⚠️ Failed to store payload {ref[:12]}: {e}")
+        return None
+
+    _remember(ref)
+    return ref
+
+def load_payload(ref):
+    """The payload stored under `ref`, or None if the ref is malformed or unknown"""
+    if not isinstance(ref, str) or not REF_PATTERN.match(ref):
+        return None
+    payload, _ = load_json_versioned(_payload_filename(ref))
+    return payload
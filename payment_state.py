@@ -0,0 +1,114 @@
+# payment_state.py
+#
+# The latest payment outcome applied for each Stripe customer. Stripe sends several events for
+# one payment (invoice.*, charge.*, payment_intent.*); the first one claims the outcome here and
+# does the customer lookup and tag update, the rest are acknowledged as duplicates, and an older
+# event that arrives late can't undo a newer outcome. Sharded by customer ID like the email cache
+# (payment_state/shard-NNN.json), so every worker sees the same claims.
+
+import time
+from config import STRIPE_CORRELATION_WINDOW_SECONDS, PAYMENT_STATE_TTL_SECONDS
+from storage_utils import load_json, update_json, load_json_async, update_json_async
+from storage_backend import shard_for
+from mailchimp_sync import ADD_TAG_EVENTS
+
+PAYMENT_STATE_DIR = "payment_state"
+PAYMENT_STATE_SHARDS = 16
+
+APPLY, DUPLICATE, STALE = "apply", "duplicate", "stale"
+
+def _shard_filename(customer_id):
+    return f"{PAYMENT_STATE_DIR}/shard-{shard_for(customer_id, PAYMENT_STATE_SHARDS):03d}.json"
+
+def payment_outcome(event_type):
+    return "failed" if event_type in ADD_TAG_EVENTS else "succeeded"
+
+def payment_keys(event):
+    """Invoice / payment intent / charge IDs that tie this event to one payment"""
+    obj = event["data"]["object"]
+    keys = {obj.get("invoice"), obj.get("payment_intent")}
+    if str(obj.get("id", "")).startswith(("in_", "pi_", "ch_")):
+        keys.add(obj["id"])
+    return {key for key in keys if isinstance(key, str) and key}
+
+def event_time(event):
+    return event.get("created") or event["data"]["object"].get("created") or time.time()
+
+def _prune(state):
+    expired = time.time() - PAYMENT_STATE_TTL_SECONDS
+    for customer_id in [c for c, entry in state.items() if entry.get("recorded_at", 0) < expired]:
+        del state[customer_id]
+
+def _claiming(customer_id, event, result):
+    outcome, created, keys = payment_outcome(event["type"]), event_time(event), payment_keys(event)
+
+    def _claim(state):
+        _prune(state)
+        current = state.get(customer_id)
+        result["previous"] = current
+        # A retry of the event that holds the claim goes ahead
+        if current and current["event_id"] != event["id"]:
+            correlated = bool(keys & set(current["keys"])) or abs(created - current["created"]) <= STRIPE_CORRELATION_WINDOW_SECONDS
+            if current["outcome"] == outcome and correlated:
+                result["decision"] = DUPLICATE
+                return state
+            if created < current["created"]:
+                result["decision"] = STALE
+                return state
+
+        state[customer_id] = {
+            "event_id": event["id"],
+            "event_type": event["type"],
+            "outcome": outcome,
+            "created": created,
+            "keys": sorted(keys),
+            "recorded_at": time.time(),
+        }
+        result["decision"] = APPLY
+        return state
+    return _claim
+
+def claim_payment_event(customer_id, event):
+    """Decide what to do with a payment event: (APPLY | DUPLICATE | STALE, previous state).
+
+    APPLY records the event as the customer's latest outcome before returning.
+    """
+    result = {}
+    if update_json(_shard_filename(customer_id), _claiming(customer_id, event, result)) is None:
+        raise RuntimeError(f"Could not record payment state for {customer_id}")
+    return result["decision"], result["previous"]
+
+async def claim_payment_event_async(customer_id, event):
+    result = {}
+    if await update_json_async(_shard_filename(customer_id), _claiming(customer_id, event, result)) is None:
+        raise RuntimeError(f"Could not record payment state for {customer_id}")
+    return result["decision"], result["previous"]
+
+def _releasing(customer_id, event_id, previous):
+    def _release(state):
+        if state.get(customer_id, {}).get("event_id") == event_id:
+            if previous:
+                state[customer_id] = previous
+            else:
+                del state[customer_id]
+        return state
+    return _release
+
+def release_payment_event(customer_id, event_id, previous):
+    """Give up a claim that wasn't applied, so a correlated event can do the work instead"""
+    update_json(_shard_filename(customer_id), _releasing(customer_id, event_id, previous))
+
+async def release_payment_event_async(customer_id, event_id, previous):
+    await update_json_async(_shard_filename(customer_id), _releasing(customer_id, event_id, previous))
+
+def _superseding(current, event):
+    if current and current["event_id"] != event["id"] and current["outcome"] != payment_outcome(event["type"]):
+        return current
+    return None
+
+def superseding_outcome(customer_id, event):
+    """The customer's latest state if a newer event with a different outcome claimed it meanwhile"""
+    return _superseding(load_json(_shard_filename(customer_id)).get(customer_id), event)
+
+async def superseding_outcome_async(customer_id, event):
+    return _superseding((await load_json_async(_shard_filename(customer_id))).get(customer_id), event)
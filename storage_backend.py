@@ -0,0 +1,852 @@
+# storage_backend.py
+#
+# Pluggable home for logs, the member email cache and the merge map.
+#   STORAGE_BACKEND=json   → JSON blobs (local files / DigitalOcean Spaces); the email cache
+#                            is split into EMAIL_CACHE_SHARDS shard objects plus a manifest
+#   STORAGE_BACKEND=sqlite → an indexed SQLite database (WAL mode), with the JSON
+#                            blobs used as the import/export and Spaces snapshot format.
+#                            The database lives on one container's disk: single instance only
+#
+# CLI:
+#   python storage_backend.py import     # JSON blobs → SQLite
+#   python storage_backend.py export     # SQLite → local JSON files
+#   python storage_backend.py snapshot [--force]  # SQLite → JSON blobs in storage (Spaces in production)
+#   python storage_backend.py shard-cache  # single member_email_cache.json → sharded layout
+
+import os
+import sys
+import json
+import socket
+import asyncio
+import sqlite3
+import threading
+import time
+import bisect
+import zlib
+import uuid
+from datetime import datetime
+from config import (
+    LOG_FILE, CACHE_FILE, STORAGE_BACKEND, SQLITE_PATH, STORAGE_SNAPSHOT_INTERVAL_SECONDS,
+    EMAIL_INDEX_TTL_SECONDS, EMAIL_CACHE_SHARDS
+)
+from storage_utils import (
+    load_json, save_json, update_json, load_json_versioned, save_json_if_match, MERGE_MAP_FILENAME,
+    load_json_async, update_json_async, file_lock, object_version, object_version_async, load_json_if_changed
+)
+from concurrency_utils import map_concurrently
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines — every worker snapshots
+    fcntl = None
+
+class StorageBackend:
+    """Interface every storage backend implements"""
+
+    # 📋 Logs
+    def append_log(self, entry):
+        raise NotImplementedError
+
+    def load_logs(self):
+        raise NotImplementedError
+
+    def rewrite_logs(self, transform):
+        """Replace every log entry with transform(entry); returns how many entries changed"""
+        raise NotImplementedError
+
+    def load_logs_since(self, cursor):
+        """Return ([(cursor, entry), ...] appended after `cursor`, latest cursor).
+
+        A cursor is an increasing integer position in the log; 0 is before the first entry.
+        """
+        raise NotImplementedError
+
+    def log_cursor(self):
+        """Cursor of the newest entry (0 when the log is empty)"""
+        raise NotImplementedError
+
+    # 📧 Member email cache
+    def load_cache(self):
+        raise NotImplementedError
+
+    def replace_cache(self, cache):
+        raise NotImplementedError
+
+    def get_cached_email(self, member_id):
+        raise NotImplementedError
+
+    def set_cached_email(self, member_id, email):
+        raise NotImplementedError
+
+    def delete_cached_email(self, member_id):
+        raise NotImplementedError
+
+    def find_member_ids(self, email):
+        """Reverse lookup: every member ID cached against `email` (case-insensitive)"""
+        raise NotImplementedError
+
+    def search_cache(self, query="", match="substring", offset=0, limit=100):
+        """Return (total, [(member_id, email), ...]) matching `query` on ID or email, newest ID first"""
+        raise NotImplementedError
+
+    def cache_shards(self):
+        """How many pieces load_cache_shard splits the cache into; shard_for(member_id, n) picks one"""
+        return 1
+
+    def load_cache_shard(self, shard):
+        """{member_id: email} for the members shard_for puts in `shard`"""
+        return self.load_cache()
+
+    # 🧩 Merge map
+    def load_merge_map(self):
+        raise NotImplementedError
+
+    def save_merge_map(self, data):
+        raise NotImplementedError
+
+    def merge_map_version(self):
+        """A value that changes whenever the merge map does, cheaper to fetch than the map; None if unknown"""
+        return None
+
+    # ⚡ asyncio versions of the per-webhook operations (asgi.py). By default they run the
+    # blocking method on a worker thread; backends with a native async path override them.
+    async def append_log_async(self, entry):
+        await asyncio.to_thread(self.append_log, entry)
+
+    async def get_cached_email_async(self, member_id):
+        return await asyncio.to_thread(self.get_cached_email, member_id)
+
+    async def set_cached_email_async(self, member_id, email):
+        await asyncio.to_thread(self.set_cached_email, member_id, email)
+
+    async def delete_cached_email_async(self, member_id):
+        await asyncio.to_thread(self.delete_cached_email, member_id)
+
+    async def load_merge_map_async(self):
+        return await asyncio.to_thread(self.load_merge_map)
+
+    async def merge_map_version_async(self):
+        return await asyncio.to_thread(self.merge_map_version)
+
+    # 📦 Import / export in the JSON blob format
+    def export_all(self):
+        return {
+            LOG_FILE: self.load_logs(),
+            CACHE_FILE: self.load_cache(),
+            MERGE_MAP_FILENAME: self.load_merge_map(),
+        }
+
+    def import_all(self, snapshot):
+        raise NotImplementedError
+
+
+def _id_sort_key(member_id):
+    return (1, int(member_id), "") if member_id.isdigit() else (0, 0, member_id)
+
+def _prefix_range(sorted_values, prefix):
+    start = bisect.bisect_left(sorted_values, prefix)
+    end = bisect.bisect_left(sorted_values, prefix + "\uffff")
+    return sorted_values[start:end]
+
+
+class EmailIndex:
+    """In-memory member ID ⇄ email index, with sorted keys for prefix search"""
+
+    def __init__(self, cache):
+        self.by_id = {}
+        self.by_email = {}
+        self.sorted_ids = []
+        self.sorted_emails = []
+        for member_id, email in cache.items():
+            self.by_id[str(member_id)] = email
+            self.by_email.setdefault(email.lower(), set()).add(str(member_id))
+        self.sorted_ids = sorted(self.by_id)
+        self.sorted_emails = sorted(self.by_email)
+
+    def set(self, member_id, email):
+        member_id = str(member_id)
+        self.remove(member_id)
+        self.by_id[member_id] = email
+        bisect.insort(self.sorted_ids, member_id)
+        key = email.lower()
+        if key not in self.by_email:
+            self.by_email[key] = set()
+            bisect.insort(self.sorted_emails, key)
+        self.by_email[key].add(member_id)
+
+    def remove(self, member_id):
+        member_id = str(member_id)
+        email = self.by_id.pop(member_id, None)
+        if email is None:
+            return
+        self.sorted_ids.pop(bisect.bisect_left(self.sorted_ids, member_id))
+        key = email.lower()
+        ids = self.by_email.get(key, set())
+        ids.discard(member_id)
+        if not ids:
+            self.by_email.pop(key, None)
+            self.sorted_emails.pop(bisect.bisect_left(self.sorted_emails, key))
+
+    def member_ids(self, email):
+        return sorted(self.by_email.get((email or "").lower(), set()), key=_id_sort_key, reverse=True)
+
+    def search(self, query="", match="substring", offset=0, limit=100):
+        query = (query or "").strip().lower()
+        if not query:
+            matched = set(self.by_id)
+        elif match == "prefix":
+            matched = set(_prefix_range(self.sorted_ids, query))
+            for email in _prefix_range(self.sorted_emails, query):
+                matched.update(self.by_email[email])
+        else:
+            matched = {
+                member_id for member_id, email in self.by_id.items()
+                if query in member_id or query in email.lower()
+            }
+        ordered = sorted(matched, key=_id_sort_key, reverse=True)
+        return len(ordered), [(member_id, self.by_id[member_id]) for member_id in ordered[offset:offset + limit]]
+
+
+# 🧱 Sharded email cache layout
+# email_cache/manifest.json records the shard count; member IDs hash into email_cache/shard-NNN.json,
+# so a single-member read or write only touches one small object.
+EMAIL_CACHE_DIR = "email_cache"
+EMAIL_CACHE_MANIFEST = f"{EMAIL_CACHE_DIR}/manifest.json"
+
+def shard_filename(shard):
+    return f"{EMAIL_CACHE_DIR}/shard-{shard:03d}.json"
+
+def shard_for(member_id, shards):
+    return zlib.crc32(str(member_id).encode()) % shards
+
+def _split_into_shards(cache, shards):
+    buckets = [{} for _ in range(shards)]
+    for member_id, email in cache.items():
+        buckets[shard_for(member_id, shards)][str(member_id)] = email
+    return buckets
+
+def migrate_email_cache(shards=EMAIL_CACHE_SHARDS, remerge=False):
+    """Split the single CACHE_FILE blob into shards and write the manifest; returns the manifest.
+
+    Safe to re-run or race: shard writes merge into what's there, entries already in a shard
+    win over the old file's, and only the first manifest write wins. The old single file is
+    left in place for rollback. `remerge` merges CACHE_FILE into an already-sharded cache too,
+    picking up members backfilled into it since.
+    """
+    manifest, _ = load_json_versioned(EMAIL_CACHE_MANIFEST)
+    if manifest and not remerge:
+        return manifest
+    if manifest:
+        shards = manifest["shards"]
+
+    legacy, _ = load_json_versioned(CACHE_FILE)
+    legacy = legacy if isinstance(legacy, dict) else {}
+    buckets = _split_into_shards(legacy, shards)
+
+    def _write_shard(shard):
+        # A racing worker may already be taking webhook updates into this shard — those are newer
+        def _merge(existing):
+            return {**buckets[shard], **(existing if isinstance(existing, dict) else {})}
+        if update_json(shard_filename(shard), _merge) is None:
+            raise RuntimeError(f"Could not write {shard_filename(shard)}")
+
+    list(map_concurrently(_write_shard, range(shards)))
+    if manifest:
+        print(f"🧱 Merged {len(legacy)} cached emails into the existing {shards} shards")
+        return manifest
+
+    manifest = {
+        "layout": "sharded",
+        "shards": shards,
+        "migrated_from": CACHE_FILE,
+        "migrated_members": len(legacy),
+        "created_at": _now()
+    }
+    if save_json_if_match(EMAIL_CACHE_MANIFEST, manifest, None):
+        print(f"🧱 Migrated {len(legacy)} cached emails into {shards} shards")
+        return manifest
+
+    # Another worker finished the migration first — use its manifest
+    manifest, _ = load_json_versioned(EMAIL_CACHE_MANIFEST)
+    return manifest
+
+
+# Read-modify-write steps for update_json / update_json_async
+def _appending(entry):
+    def _append(logs):
+        if not isinstance(logs, list):
+            logs = []
+        logs.append(entry)
+        return logs
+    return _append
+
+def _setting(member_id, email):
+    def _set(cache):
+        cache[str(member_id)] = email
+        return cache
+    return _set
+
+def _popping(member_id):
+    def _pop(cache):
+        cache.pop(str(member_id), None)
+        return cache
+    return _pop
+
+
+class JsonStorageBackend(StorageBackend):
+    """One JSON blob per dataset via storage_utils, with the email cache sharded (see EMAIL_CACHE_SHARDS)"""
+
+    def __init__(self, shards=EMAIL_CACHE_SHARDS):
+        self._index = None
+        self._index_loaded_at = 0
+        self._index_lock = threading.Lock()
+        self._requested_shards = shards
+        self._shards = None
+        self._manifest_lock = threading.Lock()
+        self._log_seen = (None, 0)  # (version, length) of the log as load_logs_since last read it
+
+    def _shard_count(self):
+        # The manifest's shard count wins over EMAIL_CACHE_SHARDS so changing the env var can't orphan data
+        if not self._requested_shards:
+            return 0
+        if self._shards is None:
+            with self._manifest_lock:
+                if self._shards is None:
+                    shards = migrate_email_cache(self._requested_shards)["shards"]
+                    if shards != self._requested_shards:
+                        print(f"ℹ️ Email cache has {shards} shards (EMAIL_CACHE_SHARDS={self._requested_shards} ignored)")
+                    self._shards = shards
+        return self._shards
+
+    def _cache_file(self, member_id):
+        shards = self._shard_count()
+        return shard_filename(shard_for(member_id, shards)) if shards else CACHE_FILE
+
+    def _email_index(self):
+        # Rebuilt from the blob at most every EMAIL_INDEX_TTL_SECONDS; this worker's own writes apply immediately
+        with self._index_lock:
+            if self._index is None or time.monotonic() - self._index_loaded_at > EMAIL_INDEX_TTL_SECONDS:
+                self._index = EmailIndex(self.load_cache())
+                self._index_loaded_at = time.monotonic()
+            return self._index
+
+    def _update_index(self, apply):
+        with self._index_lock:
+            if self._index is not None:
+                apply(self._index)
+
+    async def _cache_file_async(self, member_id):
+        # The first call may run the shard migration — keep it off the event loop
+        if self._shards is None and self._requested_shards:
+            await asyncio.to_thread(self._shard_count)
+        return self._cache_file(member_id)
+
+    def append_log(self, entry):
+        update_json(LOG_FILE, _appending(entry), default=list)
+
+    async def append_log_async(self, entry):
+        await update_json_async(LOG_FILE, _appending(entry), default=list)
+
+    def load_logs(self):
+        logs = load_json(LOG_FILE)
+        return logs if isinstance(logs, list) else []
+
+    def rewrite_logs(self, transform):
+        changed = []
+
+        def _rewrite(logs):
+            changed.clear()
+            rewritten = []
+            for entry in logs if isinstance(logs, list) else []:
+                new_entry = transform(entry)
+                if new_entry != entry:
+                    changed.append(entry)
+                rewritten.append(new_entry)
+            return rewritten
+
+        if update_json(LOG_FILE, _rewrite, default=list) is None:
+            raise RuntimeError(f"Could not rewrite {LOG_FILE}")
+        return len(changed)
+
+    def load_logs_since(self, cursor):
+        # The log is append-only (rewrites keep every entry in place), so a position is a stable cursor.
+        # A caller already at the end (the log stream's poller) gets a conditional read, so an
+        # unchanged log isn't downloaded and parsed again every poll.
+        version, length = self._log_seen
+        logs, latest_version = load_json_if_changed(LOG_FILE, version if cursor >= length else None)
+        if logs is None and latest_version is not None:
+            return [], length
+        logs = logs if isinstance(logs, list) else []
+        self._log_seen = (latest_version, len(logs))
+        return list(enumerate(logs[cursor:], start=cursor + 1)), len(logs)
+
+    def log_cursor(self):
+        return len(self.load_logs())
+
+    def load_cache(self):
+        shards = self._shard_count()
+        if not shards:
+            return load_json(CACHE_FILE)
+
+        cache = {}
+        for shard in map_concurrently(lambda n: load_json(shard_filename(n)), range(shards)):
+            cache.update(shard)
+        return cache
+
+    def cache_shards(self):
+        return self._shard_count() or 1
+
+    def load_cache_shard(self, shard):
+        return load_json(shard_filename(shard)) if self._shard_count() else load_json(CACHE_FILE)
+
+    def replace_cache(self, cache):
+        shards = self._shard_count()
+        if not shards:
+            save_json(CACHE_FILE, cache)
+        else:
+            buckets = _split_into_shards(cache, shards)
+            list(map_concurrently(lambda n: save_json(shard_filename(n), buckets[n]), range(shards)))
+        with self._index_lock:
+            self._index = None
+
+    def get_cached_email(self, member_id):
+        return load_json(self._cache_file(member_id)).get(str(member_id))
+
+    async def get_cached_email_async(self, member_id):
+        return (await load_json_async(await self._cache_file_async(member_id))).get(str(member_id))
+
+    def set_cached_email(self, member_id, email):
+        if update_json(self._cache_file(member_id), _setting(member_id, email)) is not None:
+            self._update_index(lambda index: index.set(member_id, email))
+
+    async def set_cached_email_async(self, member_id, email):
+        if await update_json_async(await self._cache_file_async(member_id), _setting(member_id, email)) is not None:
+            self._update_index(lambda index: index.set(member_id, email))
+
+    def delete_cached_email(self, member_id):
+        if update_json(self._cache_file(member_id), _popping(member_id)) is not None:
+            self._update_index(lambda index: index.remove(member_id))
+
+    async def delete_cached_email_async(self, member_id):
+        if await update_json_async(await self._cache_file_async(member_id), _popping(member_id)) is not None:
+            self._update_index(lambda index: index.remove(member_id))
+
+    def find_member_ids(self, email):
+        index = self._email_index()
+        with self._index_lock:
+            return index.member_ids(email)
+
+    def search_cache(self, query="", match="substring", offset=0, limit=100):
+        index = self._email_index()
+        with self._index_lock:
+            return index.search(query, match, offset, limit)
+
+    def load_merge_map(self):
+        return load_json(MERGE_MAP_FILENAME)
+
+    async def load_merge_map_async(self):
+        return await load_json_async(MERGE_MAP_FILENAME)
+
+    def save_merge_map(self, data):
+        save_json(MERGE_MAP_FILENAME, data)
+
+    def merge_map_version(self):
+        return object_version(MERGE_MAP_FILENAME)
+
+    async def merge_map_version_async(self):
+        return await object_version_async(MERGE_MAP_FILENAME)
+
+    def import_all(self, snapshot):
+        save_json(LOG_FILE, snapshot.get(LOG_FILE) or [])
+        self.replace_cache(snapshot.get(CACHE_FILE) or {})
+        if snapshot.get(MERGE_MAP_FILENAME):
+            save_json(MERGE_MAP_FILENAME, snapshot[MERGE_MAP_FILENAME])
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT,
+    event TEXT,
+    email TEXT,
+    status TEXT,
+    member_id TEXT,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp);
+CREATE INDEX IF NOT EXISTS idx_logs_email ON logs (email);
+CREATE INDEX IF NOT EXISTS idx_logs_status ON logs (status);
+CREATE INDEX IF NOT EXISTS idx_logs_member_id ON logs (member_id);
+
+CREATE TABLE IF NOT EXISTS email_cache (
+    member_id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_email_cache_email ON email_cache (email);
+CREATE INDEX IF NOT EXISTS idx_email_cache_email_nocase ON email_cache (email COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS merge_map (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
+
+-- version counts every write; instance names this database file (see snapshot_to_storage)
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+SQLITE_SCHEMA += "".join(
+    f"CREATE TRIGGER IF NOT EXISTS bump_version_{table}_{op.lower()} AFTER {op} ON {table} "
+    "BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;\n"
+    for table in ("logs", "email_cache", "merge_map") for op in ("INSERT", "UPDATE", "DELETE")
+)
+
+def member_id_from_payload(payload):
+    if not isinstance(payload, dict):
+        return None
+    member = payload.get("member") or (payload.get("subscription") or {}).get("member") or {}
+    member_id = member.get("id") if isinstance(member, dict) else None
+    return str(member_id) if member_id not in (None, "") else None
+
+def _now():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+class SQLiteStorageBackend(StorageBackend):
+    """Indexed SQLite storage — one connection per thread, WAL so readers never block the writer"""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.is_new = not os.path.exists(path)
+        self._conn().executescript(SQLITE_SCHEMA)
+        self._conn().execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', ?)", (uuid.uuid4().hex,))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.create_function("shard_for", 2, shard_for, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    def snapshot_state(self):
+        """{"instance", "version", "seeded_from"}: which database this is and how many writes it has had"""
+        state = dict(self._conn().execute("SELECT key, value FROM meta").fetchall())
+        return {
+            "instance": state["instance"],
+            "version": state["version"],
+            "seeded_from": json.loads(state["seeded_from"]) if state.get("seeded_from") else None,
+        }
+
+    def mark_seeded(self, manifest):
+        """Record the snapshot this database was seeded from, and carry on its version count"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (manifest.get("version", 0),))
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded_from', ?)",
+                (json.dumps({"instance": manifest.get("instance"), "version": manifest.get("version", 0)}),)
+            )
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _insert_logs(self, conn, entries):
+        conn.executemany(
+            "INSERT INTO logs (timestamp, event, email, status, member_id, entry) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    e.get("timestamp"), e.get("event"), e.get("email"), e.get("status"),
+                    e.get("member_id") or member_id_from_payload(e.get("payload")), json.dumps(e, default=str)
+                )
+                for e in entries
+            ]
+        )
+
+    def append_log(self, entry):
+        self._insert_logs(self._conn(), [entry])
+
+    def load_logs(self):
+        rows = self._conn().execute("SELECT entry FROM logs ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def rewrite_logs(self, transform):
+        conn = self._conn()
+        updates = []
+        for log_id, raw in conn.execute("SELECT id, entry FROM logs ORDER BY id").fetchall():
+            entry = json.loads(raw)
+            new_entry = transform(entry)
+            if new_entry != entry:
+                member_id = new_entry.get("member_id") or member_id_from_payload(new_entry.get("payload"))
+                updates.append((json.dumps(new_entry, default=str), member_id, log_id))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE logs SET entry = ?, member_id = ? WHERE id = ?", updates)
+        return len(updates)
+
+    def load_logs_since(self, cursor):
+        rows = self._conn().execute("SELECT id, entry FROM logs WHERE id > ? ORDER BY id", (cursor,)).fetchall()
+        entries = [(row[0], json.loads(row[1])) for row in rows]
+        return entries, entries[-1][0] if entries else self.log_cursor()
+
+    def log_cursor(self):
+        return self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM logs").fetchone()[0]
+
+    def load_cache(self):
+        rows = self._conn().execute("SELECT member_id, email FROM email_cache").fetchall()
+        return {member_id: email for member_id, email in rows}
+
+    def cache_shards(self):
+        return EMAIL_CACHE_SHARDS or 1
+
+    def load_cache_shard(self, shard):
+        rows = self._conn().execute(
+            "SELECT member_id, email FROM email_cache WHERE shard_for(member_id, ?) = ?", (self.cache_shards(), shard)
+        ).fetchall()
+        return {member_id: email for member_id, email in rows}
+
+    def replace_cache(self, cache):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM email_cache")
+            conn.executemany(
+                "INSERT INTO email_cache (member_id, email, updated_at) VALUES (?, ?, ?)",
+                [(str(member_id), email, _now()) for member_id, email in cache.items()]
+            )
+
+    def get_cached_email(self, member_id):
+        row = self._conn().execute(
+            "SELECT email FROM email_cache WHERE member_id = ?", (str(member_id),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_cached_email(self, member_id, email):
+        self._conn().execute(
+            "INSERT INTO email_cache (member_id, email, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(member_id) DO UPDATE SET email = excluded.email, updated_at = excluded.updated_at",
+            (str(member_id), email, _now())
+        )
+
+    def delete_cached_email(self, member_id):
+        self._conn().execute("DELETE FROM email_cache WHERE member_id = ?", (str(member_id),))
+
+    def find_member_ids(self, email):
+        rows = self._conn().execute(
+            "SELECT member_id FROM email_cache WHERE email = ? COLLATE NOCASE", (email or "",)
+        ).fetchall()
+        return sorted((row[0] for row in rows), key=_id_sort_key, reverse=True)
+
+    def search_cache(self, query="", match="substring", offset=0, limit=100):
+        query = (query or "").strip()
+        where, params = "", []
+        if query:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            pattern = f"{escaped}%" if match == "prefix" else f"%{escaped}%"
+            where = "WHERE member_id LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\'"
+            params = [pattern, pattern]
+
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM email_cache {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT member_id, email FROM email_cache {where} "
+            "ORDER BY CAST(member_id AS INTEGER) DESC, member_id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return total, [(member_id, email) for member_id, email in rows]
+
+    def load_merge_map(self):
+        row = self._conn().execute("SELECT data FROM merge_map WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_merge_map(self, data):
+        self._conn().execute(
+            "INSERT INTO merge_map (id, data, updated_at) VALUES (1, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (json.dumps(data), _now())
+        )
+
+    def merge_map_version(self):
+        row = self._conn().execute("SELECT updated_at FROM merge_map WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def import_all(self, snapshot):
+        conn = self._conn()
+        logs = snapshot.get(LOG_FILE) or []
+        cache = snapshot.get(CACHE_FILE) or {}
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM logs")
+            self._insert_logs(conn, logs if isinstance(logs, list) else [])
+            conn.execute("DELETE FROM email_cache")
+            conn.executemany(
+                "INSERT INTO email_cache (member_id, email, updated_at) VALUES (?, ?, ?)",
+                [(str(member_id), email, _now()) for member_id, email in cache.items()]
+            )
+        if snapshot.get(MERGE_MAP_FILENAME):
+            self.save_merge_map(snapshot[MERGE_MAP_FILENAME])
+
+
+# 🔌 Backend selection
+_backend = None
+_backend_lock = threading.Lock()
+
+# Who wrote the JSON snapshot in storage, and at which version of their database
+SNAPSHOT_MANIFEST_FILE = "snapshot_manifest.json"
+
+def _load_strict(filename, default):
+    data, _ = load_json_versioned(filename)
+    return default() if data is None else data
+
+def load_json_snapshot():
+    """Read the JSON layout (local files, or Spaces in production).
+
+    Unlike JsonStorageBackend.export_all, a failed read raises instead of coming back empty,
+    so it can't seed a database with nothing or make a snapshot look newer than it is.
+    """
+    manifest = _load_strict(EMAIL_CACHE_MANIFEST, dict)
+    if manifest.get("shards"):
+        cache = {}
+        for shard in map_concurrently(lambda n: _load_strict(shard_filename(n), dict), range(manifest["shards"])):
+            cache.update(shard)
+    else:
+        cache = _load_strict(CACHE_FILE, dict)
+    return {
+        LOG_FILE: _load_strict(LOG_FILE, list),
+        CACHE_FILE: cache,
+        MERGE_MAP_FILENAME: _load_strict(MERGE_MAP_FILENAME, dict),
+    }
+
+def _snapshot_conflict(local, stored):
+    """Why the database described by `local` must not replace the `stored` snapshot, or None"""
+    if not stored.get("instance"):
+        return None
+    if stored["instance"] == local["instance"]:
+        if stored["version"] > local["version"]:
+            return f"stored snapshot is at version {stored['version']}, this database only at {local['version']}"
+        return None
+    if local["seeded_from"] == {"instance": stored["instance"], "version": stored["version"]}:
+        return None
+    # Each container has its own SQLite file — two of them snapshotting would overwrite each other
+    return (
+        f"the stored snapshot was written by another database ({stored['instance']} on {stored.get('host')}) "
+        "since this one was seeded — STORAGE_BACKEND=sqlite supports a single instance"
+    )
+
+def snapshot_to_storage(backend=None, force=False):
+    """Write the SQLite database out in the JSON layout (Spaces in production).
+
+    Refuses (returns False) when the stored snapshot came from another database or a later
+    version of this one, unless `force`.
+    """
+    backend = backend or get_backend()
+    # Read before exporting, so the manifest never claims writes the snapshot doesn't hold
+    state = backend.snapshot_state()
+    if not force:
+        conflict = _snapshot_conflict(state, _load_strict(SNAPSHOT_MANIFEST_FILE, dict))
+        if conflict:
+            print(f"❌ Refusing storage snapshot: {conflict}")
+            return False
+    JsonStorageBackend().import_all(backend.export_all())
+    save_json(SNAPSHOT_MANIFEST_FILE, {
+        "instance": state["instance"],
+        "version": state["version"],
+        "host": socket.gethostname(),
+        "written_at": _now()
+    })
+    print(f"📸 Storage snapshot written (version {state['version']})")
+    return True
+
+def _snapshot_loop(backend, interval):
+    # Every worker on the host starts this loop; the one holding the lock writes the snapshots,
+    # and another worker takes over if it dies
+    with open(f"{SQLITE_PATH}.snapshot.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        while True:
+            time.sleep(interval)
+            try:
+                snapshot_to_storage(backend)
+            except Exception as e:
+                print(f"⚠️ Storage snapshot failed: {e}")
+
+def _open_sqlite_backend():
+    # Workers on one host start together; the lock makes exactly one of them create and seed the file
+    with file_lock(SQLITE_PATH):
+        backend = SQLiteStorageBackend()
+        if not backend.is_new:
+            return backend
+
+        # Fresh disk (e.g. a new App Platform container) — seed from the last snapshot
+        print(f"📥 Seeding {SQLITE_PATH} from JSON snapshot")
+        try:
+            manifest = _load_strict(SNAPSHOT_MANIFEST_FILE, dict)
+            backend.import_all(load_json_snapshot())
+            backend.mark_seeded(manifest)
+        except Exception as e:
+            # Leave no half-seeded file behind, so the next start tries again rather than serving an empty database
+            backend.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(SQLITE_PATH + suffix):
+                    os.remove(SQLITE_PATH + suffix)
+            raise RuntimeError(f"Could not seed {SQLITE_PATH} from the JSON snapshot: {e}") from e
+        return backend
+
+def get_backend():
+    global _backend
+    if _backend is not None:
+        return _backend
+
+    with _backend_lock:
+        if _backend is None:
+            if STORAGE_BACKEND == "sqlite":
+                backend = _open_sqlite_backend()
+                if STORAGE_SNAPSHOT_INTERVAL_SECONDS > 0:
+                    threading.Thread(
+                        target=_snapshot_loop,
+                        args=(backend, STORAGE_SNAPSHOT_INTERVAL_SECONDS),
+                        daemon=True
+                    ).start()
+                _backend = backend
+            else:
+                _backend = JsonStorageBackend()
+    return _backend
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "shard-cache":
+        manifest = migrate_email_cache(int(sys.argv[2]) if len(sys.argv) > 2 else EMAIL_CACHE_SHARDS, remerge=True)
+        print(f"✅ Email cache is sharded: {json.dumps(manifest)}")
+        sys.exit(0)
+
+    sqlite_backend = SQLiteStorageBackend()
+
+    if command == "import":
+        sqlite_backend.import_all(load_json_snapshot())
+        print(f"✅ Imported JSON blobs into {SQLITE_PATH}")
+    elif command == "export":
+        for filename, data in sqlite_backend.export_all().items():
+            with open(filename, "w") as f:
+                json.dump(data, f, indent=2)
+            print(f"✅ Exported {filename}")
+    elif command == "snapshot":
+        if not snapshot_to_storage(sqlite_backend, force="--force" in sys.argv):
+            print("Re-run with --force to overwrite the stored snapshot anyway")
+            sys.exit(1)
+    else:
+        print("Usage: python storage_backend.py [import|export|snapshot [--force]|shard-cache [shards]]")
+        sys.exit(1)
@@ -2,8 +2,23 @@
 
 import os
 import json
-import boto3
-from botocore.exceptions import NoCredentialsError
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import tempfile
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import quote
+from config import SPACES_CONNECT_TIMEOUT_SECONDS, SPACES_READ_TIMEOUT_SECONDS
+from circuit_breaker import get_breaker, deadline_timeout, CircuitOpenError, DeadlineExceeded
+from async_http import get_async_client, is_unhealthy
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines — fall back to an in-process lock
+    fcntl = None
 
 APP_ENV = os.getenv("APP_ENV", "local")
 USE_SPACES = APP_ENV == "production"
@@ -17,24 +32,148 @@ DO_SECRET = os.getenv("DIGITALOCEAN_SPACE_SECRET")
 
 MERGE_MAP_FILENAME = "merge_map.json"
 
+# 🔌 One pooled S3 client per process (boto3 clients are thread-safe)
+SPACES_MAX_POOL_CONNECTIONS = int(os.getenv("SPACES_MAX_POOL_CONNECTIONS", "20"))
+
+# 🔁 Compare-and-swap retry settings for update_json()
+CAS_MAX_ATTEMPTS = int(os.getenv("STORAGE_CAS_MAX_ATTEMPTS", "8"))
+CAS_BACKOFF_SECONDS = float(os.getenv("STORAGE_CAS_BACKOFF_SECONDS", "0.05"))
+
+PRECONDITION_ERROR_CODES = {"PreconditionFailed", "ConditionalRequestConflict", "412", "409"}
+
+# Scratch object used to check that Spaces enforces conditional writes
+CONDITIONAL_WRITE_PROBE = ".conditional-write-probe.json"
+# Without conditional writes, only a single instance can write safely — and only if it says so
+SPACES_SINGLE_INSTANCE = os.getenv("SPACES_SINGLE_INSTANCE", "false").lower() == "true"
+SPACES_LOCK_DIR = os.path.join(tempfile.gettempdir(), "chimplink-spaces-locks")
+
+# Conditional headers for the next PutObject on this thread (see _add_precondition_headers)
+_precondition = threading.local()
+_local_lock = threading.Lock()
+_conditional_writes = None  # None until probed, then whether Spaces honours If-Match / If-None-Match
+_conditional_writes_lock = threading.Lock()
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def _add_precondition_headers(request, **kwargs):
+    headers = getattr(_precondition, "headers", None)
+    if headers:
+        for name, value in headers.items():
+            request.headers[name] = value
+
 def _get_s3_client():
-    print("👀 SPACE_KEY:", DO_ID)
-    print("👀 SPACE_SECRET:", "SET" if DO_SECRET else "MISSING")
-    return boto3.client(
-        "s3",
-        region_name=DO_REGION,
-        endpoint_url=DO_ENDPOINT,
-        aws_access_key_id=DO_ID,
-        aws_secret_access_key=DO_SECRET
+    global _s3_client
+    if _s3_client is not None:
+        return _s3_client
+
+    with _s3_client_lock:
+        if _s3_client is None:
+            # boto3 is imported on first use so workers that never touch Spaces don't pay for it
+            import boto3
+            from botocore.config import Config
+
+            print("👀 SPACE_KEY:", DO_ID)
+            print("👀 SPACE_SECRET:", "SET" if DO_SECRET else "MISSING")
+            client = boto3.client(
+                "s3",
+                region_name=DO_REGION,
+                endpoint_url=DO_ENDPOINT,
+                aws_access_key_id=DO_ID,
+                aws_secret_access_key=DO_SECRET,
+                config=Config(
+                    max_pool_connections=SPACES_MAX_POOL_CONNECTIONS,
+                    connect_timeout=SPACES_CONNECT_TIMEOUT_SECONDS,
+                    read_timeout=SPACES_READ_TIMEOUT_SECONDS,
+                    retries={"max_attempts": 2, "mode": "standard"}
+                )
+            )
+            client.meta.events.register("before-sign.s3.PutObject", _add_precondition_headers)
+            _s3_client = client
+    return _s3_client
+
+def _spaces_call(operation, **kwargs):
+    """Run an S3 operation through the Spaces circuit breaker, refusing if the request deadline has passed"""
+    deadline_timeout(SPACES_READ_TIMEOUT_SECONDS)
+    client = _get_s3_client()
+    return get_breaker("spaces").call(
+        getattr(client, operation),
+        ignore=lambda e: _is_missing_key(e) or _is_precondition_failure(e) or _is_not_modified(e),
+        **kwargs
     )
 
-def load_json(filename):
+def warm_up_storage():
+    """Create the S3 client and open a pooled connection to Spaces ahead of the first request"""
     if USE_SPACES:
+        _spaces_call("head_bucket", Bucket=DO_BUCKET)
+        if not spaces_conditional_writes() and not SPACES_SINGLE_INSTANCE:
+            raise ConditionalWritesUnsupported()
+
+@contextmanager
+def file_lock(filename):
+    """Exclusive lock on a sidecar .lock file, shared by all workers on this host"""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if fcntl is None:
+        with _local_lock:
+            yield
+        return
+    with open(f"{filename}.lock", "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _local_version(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _write_local_atomic(filename, data):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _error_response(error):
+    # botocore ClientError carries the parsed response; checked by shape to keep botocore imports lazy
+    return getattr(error, "response", None) or {}
+
+def _is_precondition_failure(error):
+    response = _error_response(error)
+    code = str(response.get("Error", {}).get("Code", ""))
+    status = str(response.get("ResponseMetadata", {}).get("HTTPStatusCode", ""))
+    return code in PRECONDITION_ERROR_CODES or status in PRECONDITION_ERROR_CODES
+
+def _is_missing_key(error):
+    code = str(_error_response(error).get("Error", {}).get("Code", ""))
+    return code in ("NoSuchKey", "404", "NotFound")
+
+def _is_not_modified(error):
+    response = _error_response(error)
+    code = str(response.get("Error", {}).get("Code", ""))
+    status = str(response.get("ResponseMetadata", {}).get("HTTPStatusCode", ""))
+    return code in ("NotModified", "304") or status == "304"
+
+def load_json(filename, local=False):
+    """Read a JSON blob, {} if missing or unreadable; `local` reads this host's disk even in production"""
+    if USE_SPACES and not local:
         try:
-            client = _get_s3_client()
             key = f"{DO_FOLDER}/{filename}"
-            response = client.get_object(Bucket=DO_BUCKET, Key=key)
+            response = _spaces_call("get_object", Bucket=DO_BUCKET, Key=key)
             return json.loads(response["Body"].read().decode())
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"⚠️ Failed to load {filename} from Spaces: {e}")
             return {}
@@ -50,21 +189,366 @@ def load_json(filename):
 def save_json(filename, data):
     if USE_SPACES:
         try:
-            client = _get_s3_client()
             key = f"{DO_FOLDER}/{filename}"
-            client.put_object(Bucket=DO_BUCKET, Key=key, Body=json.dumps(data, indent=2))
+            _spaces_call("put_object", Bucket=DO_BUCKET, Key=key, Body=json.dumps(data, indent=2))
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"⚠️ Failed to write {filename} to Spaces: {e}")
     else:
         try:
-            with open(filename, 'w') as f:
-                json.dump(data, f, indent=2)
+            with file_lock(filename):
+                _write_local_atomic(filename, data)
         except Exception as e:
             print(f"⚠️ Failed to write {filename} locally: {e}")
 
-# 🔄 Helpers for merge mapping config
-def load_merge_map():
-    return load_json(MERGE_MAP_FILENAME)
+def object_version(filename):
+    """A cheap change marker for `filename` without reading it: the Spaces ETag, or mtime and size locally.
+
+    None when the object doesn't exist.
+    """
+    if USE_SPACES:
+        try:
+            return _spaces_call("head_object", Bucket=DO_BUCKET, Key=f"{DO_FOLDER}/{filename}").get("ETag")
+        except Exception as e:
+            if _is_missing_key(e):
+                return None
+            raise
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def load_json_if_changed(filename, version):
+    """Return (data, version), or (None, `version`) when the object still has `version`.
+
+    On Spaces this is a conditional GET (If-None-Match on the ETag), so an unchanged object
+    isn't downloaded or parsed; locally it compares the object_version marker. (None, None) if
+    the object doesn't exist. Read failures raise, as with load_json_versioned.
+    """
+    if USE_SPACES:
+        conditions = {"IfNoneMatch": version} if version else {}
+        try:
+            response = _spaces_call("get_object", Bucket=DO_BUCKET, Key=f"{DO_FOLDER}/{filename}", **conditions)
+        except Exception as e:
+            if _is_not_modified(e):
+                return None, version
+            if _is_missing_key(e):
+                return None, None
+            raise
+        return json.loads(response["Body"].read().decode()), response.get("ETag")
+
+    with file_lock(filename):
+        current = object_version(filename)
+        if current is None or current == version:
+            return None, current
+        with open(filename, "rb") as f:
+            raw = f.read()
+    return json.loads(raw.decode()), current
+
+# 🔒 Versioned reads + conditional writes
+def load_json_versioned(filename, local=False):
+    """Return (data, version) — (None, None) if the object doesn't exist yet.
+
+    The version is the Spaces ETag in production and a content hash locally.
+    Unlike load_json, read failures raise so callers never overwrite data they couldn't see.
+    """
+    if USE_SPACES and not local:
+        key = f"{DO_FOLDER}/{filename}"
+        try:
+            response = _spaces_call("get_object", Bucket=DO_BUCKET, Key=key)
+        except Exception as e:
+            if _is_missing_key(e):
+                return None, None
+            raise
+        return json.loads(response["Body"].read().decode()), response.get("ETag")
+
+    with file_lock(filename):
+        if not os.path.exists(filename):
+            return None, None
+        with open(filename, "rb") as f:
+            raw = f.read()
+    return json.loads(raw.decode()), hashlib.sha1(raw).hexdigest()
+
+def _put_refused(key, headers):
+    """Whether a PutObject carrying `headers` is rejected with a precondition failure"""
+    _precondition.headers = headers
+    try:
+        _spaces_call("put_object", Bucket=DO_BUCKET, Key=key, Body=b"{}")
+        return False
+    except Exception as e:
+        if _is_precondition_failure(e):
+            return True
+        raise
+    finally:
+        _precondition.headers = None
+
+class ConditionalWritesUnsupported(RuntimeError):
+    """Spaces ignores If-Match / If-None-Match, so compare-and-swap can't protect writes across instances"""
+
+    def __init__(self):
+        super().__init__(
+            "Spaces ignores conditional writes, so instances would overwrite each other's updates — "
+            "refusing to write. Set SPACES_SINGLE_INSTANCE=true if only one instance runs."
+        )
+
+def spaces_conditional_writes():
+    """Whether Spaces enforces If-Match / If-None-Match, probed once per process.
+
+    The probe writes a scratch object, then sends two writes that must fail with 412:
+    If-None-Match: * on an existing object and If-Match with an ETag it can't have.
+    """
+    global _conditional_writes
+    if _conditional_writes is not None:
+        return _conditional_writes
+
+    with _conditional_writes_lock:
+        if _conditional_writes is None:
+            key = f"{DO_FOLDER}/{CONDITIONAL_WRITE_PROBE}"
+            _spaces_call("put_object", Bucket=DO_BUCKET, Key=key, Body=b"{}")
+            supported = _put_refused(key, {"If-None-Match": "*"}) and _put_refused(key, {"If-Match": '"0"'})
+            if supported:
+                print("🔒 Spaces enforces conditional writes")
+            elif SPACES_SINGLE_INSTANCE:
+                print("⚠️ Spaces ignored If-Match / If-None-Match — using locked writes (SPACES_SINGLE_INSTANCE=true)")
+            else:
+                print(f"❌ {ConditionalWritesUnsupported()}")
+            _conditional_writes = supported
+    return _conditional_writes
+
+def _save_to_spaces_locked(filename, data, version):
+    # Without conditional writes, serialise this host's writers and re-check the version just before writing.
+    # Writers on other hosts could still interleave, so this is only allowed on a declared single instance.
+    if not SPACES_SINGLE_INSTANCE:
+        raise ConditionalWritesUnsupported()
+    with file_lock(os.path.join(SPACES_LOCK_DIR, filename)):
+        _, current = load_json_versioned(filename)
+        if current != version:
+            return False
+        _spaces_call("put_object", Bucket=DO_BUCKET, Key=f"{DO_FOLDER}/{filename}", Body=json.dumps(data, indent=2))
+        return True
+
+def save_json_if_match(filename, data, version, local=False):
+    """Write only if the stored object is still at `version` (None = must not exist).
+
+    Returns True on success, False if another writer got there first.
+    """
+    if USE_SPACES and not local:
+        if not spaces_conditional_writes():
+            return _save_to_spaces_locked(filename, data, version)
+
+        key = f"{DO_FOLDER}/{filename}"
+        _precondition.headers = {"If-Match": version} if version else {"If-None-Match": "*"}
+        try:
+            _spaces_call("put_object", Bucket=DO_BUCKET, Key=key, Body=json.dumps(data, indent=2))
+            return True
+        except Exception as e:
+            if _is_precondition_failure(e):
+                return False
+            raise
+        finally:
+            _precondition.headers = None
+
+    with file_lock(filename):
+        if _local_version(filename) != version:
+            return False
+        _write_local_atomic(filename, data)
+        return True
+
+def update_json(filename, mutate, default=dict, attempts=None, local=False):
+    """Read-modify-write `filename` with compare-and-swap, re-applying `mutate` on conflict.
+
+    `mutate` receives the latest stored data (or default()) and returns the new data.
+    It may run more than once, so it must only merge its own change into what it's given.
+    Returns the saved data, or None if the update could not be persisted.
+    `local` keeps the file on this host's disk even in production.
+    """
+    attempts = attempts or CAS_MAX_ATTEMPTS
+    for attempt in range(attempts):
+        try:
+            data, version = load_json_versioned(filename, local)
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"⚠️ Failed to load {filename} for update: {e}")
+            return None
+
+        updated = mutate(default() if data is None else data)
+
+        try:
+            if save_json_if_match(filename, updated, version, local):
+                return updated
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"⚠️ Failed to write {filename}: {e}")
+            return None
+
+        print(f"🔁 Concurrent write to {filename} — merging and retrying ({attempt + 1}/{attempts})")
+        time.sleep(random.uniform(0, CAS_BACKOFF_SECONDS * (2 ** attempt)))
+
+    print(f"❌ Gave up updating {filename} after {attempts} conflicting writes")
+    return None
+
+
+# ⚡ asyncio versions (asgi.py). Spaces is called over the shared httpx client with a SigV4
+# signature from botocore; local files are read and written on a worker thread.
+class SpacesError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Spaces returned {status}: {message}")
+        self.status = status
+
+async def _spaces_request_async(method, filename, body=None, headers=None):
+    from botocore.auth import S3SigV4Auth
+    from botocore.awsrequest import AWSRequest
+    from botocore.credentials import Credentials
+
+    url = f"{DO_ENDPOINT}/{DO_BUCKET}/{quote(f'{DO_FOLDER}/{filename}')}"
+    request = AWSRequest(method=method, url=url, data=body or b"", headers=headers or {})
+    S3SigV4Auth(Credentials(DO_ID, DO_SECRET), "s3", DO_REGION).add_auth(request)
+    timeout = deadline_timeout(SPACES_READ_TIMEOUT_SECONDS)
+    # 404 / 412 come back as responses, so like _spaces_call they don't count against the breaker
+    return await get_breaker("spaces").acall(
+        get_async_client().request, method, url,
+        content=body, headers=dict(request.headers.items()), timeout=timeout,
+        is_failure=is_unhealthy
+    )
+
+async def load_json_async(filename):
+    if not USE_SPACES:
+        return await asyncio.to_thread(load_json, filename)
+    try:
+        data, _ = await load_json_versioned_async(filename)
+        return {} if data is None else data
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"⚠️ Failed to load {filename} from Spaces: {e}")
+        return {}
+
+async def object_version_async(filename):
+    if not USE_SPACES:
+        return await asyncio.to_thread(object_version, filename)
+    response = await _spaces_request_async("HEAD", filename)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise SpacesError(response.status_code, response.text)
+    return response.headers.get("ETag")
+
+async def load_json_versioned_async(filename):
+    if not USE_SPACES:
+        return await asyncio.to_thread(load_json_versioned, filename)
+    response = await _spaces_request_async("GET", filename)
+    if response.status_code == 404:
+        return None, None
+    if response.status_code != 200:
+        raise SpacesError(response.status_code, response.text)
+    return json.loads(response.content.decode()), response.headers.get("ETag")
+
+async def save_json_if_match_async(filename, data, version):
+    # Until the probe has passed, writes go through the thread path (which runs it, and holds the fallback lock)
+    if not USE_SPACES or _conditional_writes is not True:
+        return await asyncio.to_thread(save_json_if_match, filename, data, version)
+    headers = {"If-Match": version} if version else {"If-None-Match": "*"}
+    headers["Content-Type"] = "application/json"
+    response = await _spaces_request_async("PUT", filename, json.dumps(data, indent=2).encode(), headers)
+    if str(response.status_code) in PRECONDITION_ERROR_CODES:
+        return False
+    if response.status_code != 200:
+        raise SpacesError(response.status_code, response.text)
+    return True
+
+class _MutateFailed(Exception):
+    """One mutate in an update_json_async batch raised; the batch is re-applied without it"""
+
+# Pending update_json_async batches on the event loop, and the lock serialising each file's writes
+_batches = {}
+_batch_locks = {}
+
+async def update_json_async(filename, mutate, default=dict, attempts=None):
+    """update_json for coroutines, with the same contract.
+
+    Concurrent updates to one file are folded into a single compare-and-swap write that applies
+    each `mutate` in turn, so a burst of webhooks appending to the log costs one write per batch
+    rather than a storm of conflicting ones. A `mutate` that raises fails only its own caller;
+    the rest of the batch is still written.
+    """
+    loop = asyncio.get_running_loop()
+    batch = _batches.get(filename)
+    if batch is None:
+        batch = _batches[filename] = {"mutations": []}
+        # Written in a context of its own, so no one caller's request deadline cuts the batch short
+        contextvars.Context().run(loop.create_task, _write_batch(filename, batch, default, attempts))
+    done = loop.create_future()
+    batch["mutations"].append((mutate, done))
+    return await done
+
+async def _write_batch(filename, batch, default, attempts):
+    lock = _batch_locks.setdefault(filename, asyncio.Lock())
+    async with lock:
+        # Updates arriving from here on join the next batch
+        if _batches.get(filename) is batch:
+            del _batches[filename]
+
+        failures = {}
+
+        def _apply_all(data):
+            for index, (mutate, _) in enumerate(batch["mutations"]):
+                if index in failures:
+                    continue
+                try:
+                    data = mutate(data)
+                except Exception as e:
+                    # It may have half-changed `data` — start over from a fresh read without it
+                    failures[index] = e
+                    raise _MutateFailed()
+            return data
+
+        while True:
+            try:
+                updated = await _update_json_async(filename, _apply_all, default, attempts)
+                break
+            except _MutateFailed:
+                continue
+            except Exception as e:
+                updated = None
+                failures.update({index: e for index in range(len(batch["mutations"])) if index not in failures})
+                break
+
+        for index, (_, done) in enumerate(batch["mutations"]):
+            if done.done():
+                continue  # the caller was cancelled
+            if index in failures:
+                done.set_exception(failures[index])
+            else:
+                done.set_result(updated)
+
+async def _update_json_async(filename, mutate, default, attempts):
+    attempts = attempts or CAS_MAX_ATTEMPTS
+    for attempt in range(attempts):
+        try:
+            data, version = await load_json_versioned_async(filename)
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"⚠️ Failed to load {filename} for update: {e}")
+            return None
+
+        updated = mutate(default() if data is None else data)
+
+        try:
+            if await save_json_if_match_async(filename, updated, version):
+                return updated
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"⚠️ Failed to write {filename}: {e}")
+            return None
+
+        print(f"🔁 Concurrent write to {filename} — merging and retrying ({attempt + 1}/{attempts})")
+        await asyncio.sleep(random.uniform(0, CAS_BACKOFF_SECONDS * (2 ** attempt)))
 
-def save_merge_map(data):
-    save_json(MERGE_MAP_FILENAME, data)
+    print(f"❌ Gave up updating {filename} after {attempts} conflicting writes")
+    return None
@@ -0,0 +1,71 @@
+# stripe_client.py
+
+import os
+import threading
+from config import STRIPE_TIMEOUT_SECONDS
+from circuit_breaker import get_breaker, deadline_timeout
+from async_http import get_async_client
+
+STRIPE_API_BASE = "https://api.stripe.com/v1"
+
+_stripe = None
+_stripe_lock = threading.Lock()
+
+def stripe_credentials():
+    """(webhook signing secret, API key) for this environment — the one source for both.
+
+    The live request, the drain thread's retries and the asyncio path all key Stripe from here.
+    STRIPE_API_KEY_LIVE is still read as a fallback for deployments that only set it.
+    """
+    if os.getenv("APP_ENV", "local") == "production":
+        return os.getenv("STRIPE_WEBHOOK_SECRET_PROD"), os.getenv("STRIPE_API_KEY_PROD") or os.getenv("STRIPE_API_KEY_LIVE")
+    return os.getenv("STRIPE_WEBHOOK_SECRET_LOCAL"), os.getenv("STRIPE_API_KEY_TEST")
+
+def _api_key():
+    return stripe_credentials()[1]
+
+def get_stripe():
+    """The stripe module, imported and keyed on first use — it's the slowest import in the app"""
+    global _stripe
+    if _stripe is None:
+        with _stripe_lock:
+            if _stripe is None:
+                import stripe
+                stripe.api_key = _api_key()
+                # Stripe's default is an 80s timeout — far longer than a webhook can wait
+                stripe.default_http_client = stripe.RequestsClient(timeout=STRIPE_TIMEOUT_SECONDS)
+                _stripe = stripe
+    return _stripe
+
+def _is_client_error(error):
+    # 4xx errors (bad ID, auth) say nothing about whether Stripe is up
+    status = getattr(error, "http_status", None)
+    return status is not None and 400 <= status < 500 and status != 429
+
+def retrieve_customer(customer_id):
+    """stripe.Customer.retrieve through the Stripe circuit breaker"""
+    stripe = get_stripe()
+    deadline_timeout(STRIPE_TIMEOUT_SECONDS)
+    return get_breaker("stripe").call(stripe.Customer.retrieve, customer_id, ignore=_is_client_error)
+
+class StripeAPIError(Exception):
+    """A non-2xx answer from the Stripe REST API on the asyncio path"""
+
+    def __init__(self, http_status, message):
+        super().__init__(f"Stripe returned {http_status}: {message}")
+        self.http_status = http_status
+
+async def _get_async(path, api_key):
+    response = await get_async_client().get(
+        f"{STRIPE_API_BASE}/{path}", auth=(api_key or "", ""), timeout=deadline_timeout(STRIPE_TIMEOUT_SECONDS)
+    )
+    if response.status_code >= 400:
+        raise StripeAPIError(response.status_code, response.text)
+    return response.json()
+
+async def retrieve_customer_async(customer_id, api_key=None):
+    """retrieve_customer over the pooled async client; returns the customer as a dict"""
+    deadline_timeout(STRIPE_TIMEOUT_SECONDS)
+    return await get_breaker("stripe").acall(
+        _get_async, f"customers/{customer_id}", api_key or _api_key(), ignore=_is_client_error
+    )
@@ -0,0 +1,60 @@
+# sync_state.py
+#
+# The merge fields each audience last accepted for each member — what drift_audit.py compares
+# Mailchimp against. Sharded by member ID like the email cache (sync_state/shard-NNN.json),
+# so recording one sync touches one small object and the audit loads only the shards it needs.
+# Each entry's synced_at also lets a queued retry see that a newer sync already reached an
+# audience (see mailchimp_sync.retry_sync).
+#
+# Recording costs one CAS read and write of one shard per successful sync, on top of the log
+# append (the asyncio path batches concurrent writes to a shard).
+
+from datetime import datetime
+from storage_utils import load_json, update_json, update_json_async
+from storage_backend import shard_for
+
+SYNC_STATE_DIR = "sync_state"
+SYNC_STATE_SHARDS = 16
+
+def _shard_filename(shard):
+    return f"{SYNC_STATE_DIR}/shard-{shard:03d}.json"
+
+def sync_timestamp():
+    """Now, in the fixed-width form synced_at is stored in, so timestamps compare as strings"""
+    return datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+
+def _recording(member_id, email, merge_fields_by_audience):
+    synced_at = sync_timestamp()
+
+    def _record(state):
+        entry = state.get(member_id) or {}
+        for list_id, merge_fields in merge_fields_by_audience.items():
+            entry[list_id] = {"email": email, "merge_fields": merge_fields, "synced_at": synced_at}
+        state[member_id] = entry
+        return state
+    return _record
+
+def record_sync(member_id, email, merge_fields_by_audience):
+    """Remember the merge fields just accepted for `member_id`, keyed by list ID"""
+    if not merge_fields_by_audience:
+        return
+    member_id = str(member_id)
+    update_json(_shard_filename(shard_for(member_id, SYNC_STATE_SHARDS)), _recording(member_id, email, merge_fields_by_audience))
+
+async def record_sync_async(member_id, email, merge_fields_by_audience):
+    if not merge_fields_by_audience:
+        return
+    member_id = str(member_id)
+    await update_json_async(
+        _shard_filename(shard_for(member_id, SYNC_STATE_SHARDS)), _recording(member_id, email, merge_fields_by_audience)
+    )
+
+def load_sync_state_shard(shard, list_id):
+    """{member_id: state} for one audience, from the shard shard_for(member_id, SYNC_STATE_SHARDS) picks"""
+    return {member_id: entry[list_id] for member_id, entry in load_json(_shard_filename(shard)).items() if list_id in entry}
+
+def last_synced(member_id):
+    """{list_id: synced_at} of the latest sync each audience accepted for `member_id`"""
+    member_id = str(member_id)
+    entry = load_json(_shard_filename(shard_for(member_id, SYNC_STATE_SHARDS))).get(member_id) or {}
+    return {list_id: state.get("synced_at", "") for list_id, state in entry.items()}
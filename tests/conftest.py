@@ -0,0 +1,23 @@
+# Shared setup for the unit tests: the app's modules live at the repo root and read their
+# settings at import time, so the environment is set before anything imports them.
+
+import os
+import sys
+import shutil
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("FLASK_SECRET", "test-secret")
+os.environ.setdefault("MAILCHIMP_LIST_ID", "test-list")
+os.environ["APP_ENV"] = "development"
+os.environ["WARMUP_ON_BOOT"] = "false"
+os.environ["STORAGE_CAS_BACKOFF_SECONDS"] = "0"
+
+@pytest.fixture(autouse=True)
+def local_storage(tmp_path, monkeypatch):
+    """Each test gets its own local-file store in a fresh working directory"""
+    shutil.copy(os.path.join(ROOT, "merge_map.json"), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,39 @@
+import pytest
+import admission_control
+import app as app_module
+from config import WEBHOOK_MAX_IN_FLIGHT, WEBHOOK_PRIORITY_RESERVED_SLOTS, MEMBERFUL_MAX_IN_FLIGHT
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, "start_drain_thread", lambda: None)
+    monkeypatch.setattr(admission_control, "ADMISSION_QUEUE_SECONDS", 0)
+    app_module.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session["logged_in"] = True
+    return client
+
+def _replay(client):
+    return client.post("/replay-log", json={"event": "member.updated", "member": {"id": 1, "email": "a@example.com"}})
+
+def test_replay_is_refused_with_503_when_the_worker_is_full(client, monkeypatch):
+    monkeypatch.setitem(admission_control._threads.in_flight, "stripe", WEBHOOK_MAX_IN_FLIGHT)
+    response = _replay(client)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(admission_control.ADMISSION_RETRY_AFTER_SECONDS)
+
+def test_replay_is_refused_with_429_when_its_route_is_at_its_cap(client, monkeypatch):
+    monkeypatch.setitem(admission_control._threads.in_flight, "memberful", MEMBERFUL_MAX_IN_FLIGHT)
+    response = _replay(client)
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+def test_payment_events_keep_their_reserved_slots(monkeypatch):
+    monkeypatch.setattr(admission_control, "ADMISSION_QUEUE_SECONDS", 0)
+    monkeypatch.setitem(admission_control._threads.in_flight, "gbx", WEBHOOK_MAX_IN_FLIGHT - WEBHOOK_PRIORITY_RESERVED_SLOTS)
+    with pytest.raises(admission_control.AdmissionRejected) as rejected:
+        with admission_control.admit("memberful"):
+            pass
+    assert rejected.value.status == 503
+    with admission_control.admit("stripe"):
+        assert admission_control._threads.in_flight["stripe"] == 1
@@ -0,0 +1,31 @@
+import deferred_utils
+from deferred_utils import defer_event, flush_outbox, load_deferred_events, DEFERRED_FILE, _outbox
+from storage_utils import load_json
+
+def test_flush_outbox_is_idempotent(monkeypatch):
+    monkeypatch.setattr(deferred_utils, "USE_SPACES", True)
+    assert defer_event("memberful", {"event": "member.updated"}, "Circuit open: mailchimp")
+    parked = load_json(_outbox(DEFERRED_FILE), local=True)
+    assert len(parked) == 1
+
+    assert flush_outbox() == 1
+    assert flush_outbox() == 0
+    assert [event["id"] for event in load_json(DEFERRED_FILE)] == [parked[0]["id"]]
+    assert load_json(_outbox(DEFERRED_FILE), local=True) == []
+
+def test_flush_outbox_skips_entries_already_in_the_shared_store(monkeypatch):
+    # A flush that crashed after the merge but before clearing the outbox
+    monkeypatch.setattr(deferred_utils, "USE_SPACES", True)
+    defer_event("memberful", {"event": "member.updated"}, "Circuit open: mailchimp")
+    parked = load_json(_outbox(DEFERRED_FILE), local=True)
+    deferred_utils.update_json(DEFERRED_FILE, lambda events: events + parked, default=list)
+
+    assert flush_outbox() == 1
+    assert len(load_json(DEFERRED_FILE)) == 1
+    assert len(load_deferred_events()) == 1
+
+def test_retry_delay_doubles_up_to_the_cap():
+    assert deferred_utils.retry_delay(0) == 0.0
+    for attempts in range(1, 20):
+        delay = min(deferred_utils.RETRY_MAX_BACKOFF_SECONDS, deferred_utils.RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        assert delay / 2 <= deferred_utils.retry_delay(attempts) <= delay
@@ -0,0 +1,32 @@
+from payment_state import claim_payment_event, release_payment_event, APPLY, DUPLICATE, STALE
+
+def _event(event_id, event_type, created, invoice):
+    return {"id": event_id, "type": event_type, "created": created, "data": {"object": {"invoice": invoice}}}
+
+def test_correlated_event_with_the_same_outcome_is_a_duplicate():
+    assert claim_payment_event("cus_1", _event("evt_1", "invoice.payment_failed", 1000, "in_1"))[0] == APPLY
+    assert claim_payment_event("cus_1", _event("evt_2", "charge.failed", 1001, "in_1"))[0] == DUPLICATE
+
+def test_older_event_cannot_undo_a_newer_outcome():
+    assert claim_payment_event("cus_1", _event("evt_ok", "invoice.payment_succeeded", 5000, "in_2"))[0] == APPLY
+    decision, previous = claim_payment_event("cus_1", _event("evt_late", "invoice.payment_failed", 1000, "in_1"))
+    assert decision == STALE
+    assert previous["event_id"] == "evt_ok"
+    # The stale event didn't take the claim
+    assert claim_payment_event("cus_1", _event("evt_ok", "invoice.payment_succeeded", 5000, "in_2"))[0] == APPLY
+
+def test_newer_event_replaces_the_claim():
+    claim_payment_event("cus_1", _event("evt_1", "invoice.payment_failed", 1000, "in_1"))
+    assert claim_payment_event("cus_1", _event("evt_2", "invoice.payment_succeeded", 5000, "in_2"))[0] == APPLY
+
+def test_retry_of_the_claiming_event_goes_ahead():
+    event = _event("evt_1", "invoice.payment_failed", 1000, "in_1")
+    assert claim_payment_event("cus_1", event)[0] == APPLY
+    assert claim_payment_event("cus_1", event)[0] == APPLY
+
+def test_release_restores_the_previous_claim():
+    claim_payment_event("cus_1", _event("evt_1", "invoice.payment_succeeded", 1000, "in_1"))
+    decision, previous = claim_payment_event("cus_1", _event("evt_2", "invoice.payment_failed", 5000, "in_2"))
+    assert decision == APPLY
+    release_payment_event("cus_1", "evt_2", previous)
+    assert claim_payment_event("cus_1", _event("evt_3", "invoice.payment_failed", 500, "in_0"))[0] == STALE
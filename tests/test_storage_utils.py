@@ -0,0 +1,54 @@
+import asyncio
+import storage_utils
+from storage_utils import update_json, update_json_async, save_json, load_json
+
+def test_update_json_reapplies_mutate_after_concurrent_write(monkeypatch):
+    save_json("counts.json", {"a": 1})
+    load_versioned = storage_utils.load_json_versioned
+    loads = []
+
+    def racing_load(filename, local=False):
+        result = load_versioned(filename, local)
+        if not loads:
+            # Another worker writes between our read and our compare-and-swap
+            save_json(filename, {"a": 1, "b": 2})
+        loads.append(filename)
+        return result
+
+    monkeypatch.setattr(storage_utils, "load_json_versioned", racing_load)
+    saved = update_json("counts.json", lambda data: {**data, "c": 3})
+
+    assert len(loads) == 2
+    assert saved == {"a": 1, "b": 2, "c": 3}
+    assert load_json("counts.json") == {"a": 1, "b": 2, "c": 3}
+
+def test_update_json_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(storage_utils, "save_json_if_match", lambda *args, **kwargs: False)
+    calls = []
+
+    def mutate(data):
+        calls.append(data)
+        return data
+
+    assert update_json("counts.json", mutate, attempts=3) is None
+    assert len(calls) == 3
+
+def test_update_json_async_isolates_a_failing_mutate():
+    save_json("list.json", [])
+
+    def boom(events):
+        events.append("partial")
+        raise ValueError("bad mutate")
+
+    async def run():
+        return await asyncio.gather(
+            update_json_async("list.json", lambda events: events + ["a"], default=list),
+            update_json_async("list.json", boom, default=list),
+            update_json_async("list.json", lambda events: events + ["b"], default=list),
+            return_exceptions=True,
+        )
+
+    first, failed, last = asyncio.run(run())
+    assert isinstance(failed, ValueError)
+    assert sorted(load_json("list.json")) == ["a", "b"]
+    assert "partial" not in last
@@ -1,12 +1,18 @@
 # utils.py
 
+from datetime import datetime
+from functools import lru_cache
+
+@lru_cache(maxsize=4096)
+def _format_iso_date(date_str):
+    return datetime.fromisoformat(date_str.replace("Z", "+00:00")).strftime("%Y-%m-%d")
+
 def format_date(date_str_or_ts):
     """Format date from ISO or timestamp to DD/MM/YYYY"""
-    from datetime import datetime
     try:
         if isinstance(date_str_or_ts, (int, float)):
             return datetime.utcfromtimestamp(date_str_or_ts).strftime("%Y-%m-%d")
-        return datetime.fromisoformat(date_str_or_ts.replace("Z", "+00:00")).strftime("%Y-%m-%d")
+        return _format_iso_date(date_str_or_ts)
     except Exception:
         return ""
 
@@ -0,0 +1,51 @@
+# warmup.py
+#
+# Boot-time warm-up: open pooled connections and preload the merge map and email
+# cache so a fresh worker's first webhook doesn't pay for them. Called from the
+# gunicorn post_worker_init hook (see gunicorn.conf.py) before a worker accepts traffic.
+
+import time
+from metrics_utils import PROCESS_STARTED_AT, set_gauge, incr
+from concurrency_utils import run_concurrently
+from storage_utils import warm_up_storage, ConditionalWritesUnsupported
+from storage_backend import get_backend
+from merge_utils import get_compiled_merge_maps
+from mailchimp_client import warm_up_mailchimp
+from stripe_client import get_stripe
+
+def _preload_email_cache():
+    # Builds the reverse email index (and fetches the cache) for the JSON backend
+    get_backend().find_member_ids("")
+
+WARMUP_STEPS = {
+    "spaces": warm_up_storage,
+    "merge_map": get_compiled_merge_maps,
+    "email_cache": _preload_email_cache,
+    "mailchimp": warm_up_mailchimp,
+    "stripe": get_stripe,
+}
+
+def _timed(name, step):
+    def run():
+        started = time.perf_counter()
+        try:
+            step()
+        except ConditionalWritesUnsupported:
+            # Not a slow start but a setup that would lose updates — don't serve traffic on it
+            raise
+        except Exception as e:
+            print(f"⚠️ Warm-up step '{name}' failed: {e}")
+            incr(f"startup.warmup_failures.{name}")
+        finally:
+            set_gauge(f"startup.warmup.{name}_seconds", round(time.perf_counter() - started, 3))
+    return run
+
+def warm_up():
+    started = time.perf_counter()
+    run_concurrently(*[_timed(name, step) for name, step in WARMUP_STEPS.items()])
+
+    warmup_seconds = time.perf_counter() - started
+    ready_seconds = time.time() - PROCESS_STARTED_AT
+    set_gauge("startup.warmup_seconds", round(warmup_seconds, 3))
+    set_gauge("startup.ready_seconds", round(ready_seconds, 3))
+    print(f"🔥 Warm-up finished in {warmup_seconds:.2f}s — worker ready {ready_seconds:.2f}s after start")
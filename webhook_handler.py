@@ -1,6 +1,6 @@
 from flask import request
 from mailchimp_sync import sync_to_mailchimp
-from cache_utils import get_cached_email, load_cache, save_cache
+from cache_utils import get_cached_email, remove_from_cache
 from log_utils import append_log_entry
 import json
 
@@ -67,9 +67,7 @@ def handle_webhook():
                 }
                 sync_to_mailchimp(member_stub, subscription_stub, event_type=event_type, override_guid=True)
 
-                cache = load_cache()
-                cache.pop(str(member_id), None)
-                save_cache(cache)
+                remove_from_cache(member_id)
             else:
                 print(f"⚠️ No cached email found for deleted member ID {member_id}")
         else: